@@ -26,7 +26,11 @@ def main():
 	parser.add_option("-s", "--slice", action="store_true", dest="slice",
 		help="Slice the given files instead of opening them in Cura")
 	parser.add_option("-o", "--output", action="store", type="string", dest="output",
-		help="path to write sliced file to")
+		help="path to write sliced file to, or the directory to write the sliced files to when slicing multiple files")
+	parser.add_option("-j", "--jobs", action="store", type="int", dest="jobs",
+		help="Number of files to slice at the same time, defaults to the number of processor cores")
+	parser.add_option("--summary", action="store", type="string", dest="summary",
+		help="Write a CSV file with the print time and filament use of each sliced file")
 	parser.add_option("--serialCommunication", action="store", type="string", dest="serialCommunication",
 		help="Start commandline serial monitor")
 
@@ -52,35 +56,23 @@ def main():
 		from Cura.gui import printWindow
 		printWindow.startPrintInterface(options.printfile)
 	elif options.slice is not None:
-		from Cura.util import sliceEngine
-		from Cura.util import objectScene
-		from Cura.util import meshLoader
-		import shutil
+		from Cura.util import batchSlicer
+		import os
 
-		def commandlineProgressCallback(progress):
-			if progress >= 0:
-				#print 'Preparing: %d%%' % (progress * 100)
-				pass
-		scene = objectScene.Scene()
-		scene.updateMachineDimensions()
-		engine = sliceEngine.Engine(commandlineProgressCallback)
-		for m in meshLoader.loadMeshes(args[0]):
-			scene.add(m)
-		engine.runEngine(scene)
-		engine.wait()
-
-		if not options.output:
-			options.output = args[0] + profile.getGCodeExtension()
-		with open(options.output, "wb") as f:
-			gcode = engine.getResult().getGCode()
-			while True:
-				data = gcode.read()
-				if len(data) == 0:
-					break
-				f.write(data)
-		print 'GCode file saved : %s' % options.output
-
-		engine.cleanup()
+		filenames = batchSlicer.expandInputFiles(args)
+		if len(filenames) < 1:
+			print 'No files to slice'
+			return
+		if len(filenames) > 1 and options.output is not None and not os.path.isdir(options.output):
+			os.makedirs(options.output)
+		slicer = batchSlicer.batchSlicer(filenames, options.output, options.jobs)
+		infoList = slicer.run()
+		summary = options.summary
+		if summary is None and len(filenames) > 1:
+			summary = os.path.join(options.output if options.output is not None else os.path.dirname(os.path.abspath(filenames[0])), 'slice_summary.csv')
+		if summary is not None:
+			batchSlicer.writeSummary(summary, infoList)
+			print 'Summary saved : %s' % (summary)
 	else:
 		from Cura.gui import app
 		app.CuraApp(args).MainLoop()
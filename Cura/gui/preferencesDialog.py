@@ -51,6 +51,14 @@ class preferencesDialog(wx.Dialog):
 		configBase.SettingRow(right, 'auto_detect_sd')
 		configBase.SettingRow(right, 'check_for_updates')
 		configBase.SettingRow(right, 'submit_slice_information')
+		configBase.SettingRow(right, 'gcode_interpreter')
+		configBase.SettingRow(right, 'gcode_layer_cache')
+		configBase.SettingRow(right, 'gcode_layer_cache_size')
+		configBase.SettingRow(right, 'slice_cache_memory_size')
+		configBase.SettingRow(right, 'slice_cache_disk')
+		configBase.SettingRow(right, 'slice_cache_disk_size')
+		configBase.SettingRow(right, 'usb_print_package_cache')
+		configBase.SettingRow(right, 'usb_print_package_cache_size')
 
 		self.okButton = wx.Button(right, -1, 'Ok')
 		right.GetSizer().Add(self.okButton, (right.GetSizer().GetRows(), 0), flag=wx.BOTTOM, border=5)
@@ -107,6 +115,8 @@ class machineSettingsDialog(wx.Dialog):
 			configBase.TitleRow(right, _("Communication settings"))
 			configBase.SettingRow(right, 'serial_port', ['AUTO'] + machineCom.serialList(), index=idx)
 			configBase.SettingRow(right, 'serial_baud', ['AUTO'] + map(str, machineCom.baudrateList()), index=idx)
+			configBase.SettingRow(right, 'um2_usb_send_window', index=idx)
+			configBase.SettingRow(right, 'um2_usb_pack_format', index=idx)
 
 			self.nb.AddPage(main, profile.getMachineSetting('machine_name', idx).title())
 
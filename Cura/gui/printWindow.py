@@ -340,6 +340,7 @@ class printWindowBasic(wx.Frame):
 		self.connectButton = wx.Button(self.panel, -1, _("Connect"))
 		#self.loadButton = wx.Button(self.panel, -1, 'Load')
 		self.printButton = wx.Button(self.panel, -1, _("Print"))
+		self.resumeButton = wx.Button(self.panel, -1, _("Resume print"))
 		self.pauseButton = wx.Button(self.panel, -1, _("Pause"))
 		self.cancelButton = wx.Button(self.panel, -1, _("Cancel print"))
 		self.errorLogButton = wx.Button(self.panel, -1, _("Error log"))
@@ -350,6 +351,7 @@ class printWindowBasic(wx.Frame):
 
 		if printerConnection.hasStoreMode():
 			self.sizer.Add(self.storeMode, pos=(2, 0))
+		self.sizer.Add(self.resumeButton, pos=(2, 1))
 
 		self.sizer.Add(self.connectButton, pos=(3, 0))
 		#self.sizer.Add(self.loadButton, pos=(3,1))
@@ -363,6 +365,7 @@ class printWindowBasic(wx.Frame):
 		self.connectButton.Bind(wx.EVT_BUTTON, self.OnConnect)
 		#self.loadButton.Bind(wx.EVT_BUTTON, self.OnLoad)
 		self.printButton.Bind(wx.EVT_BUTTON, self.OnPrint)
+		self.resumeButton.Bind(wx.EVT_BUTTON, self.OnResume)
 		self.pauseButton.Bind(wx.EVT_BUTTON, self.OnPause)
 		self.cancelButton.Bind(wx.EVT_BUTTON, self.OnCancel)
 		self.errorLogButton.Bind(wx.EVT_BUTTON, self.OnErrorLog)
@@ -381,8 +384,13 @@ class printWindowBasic(wx.Frame):
 			self._printerConnection.openActiveConnection()
 		preventComputerFromSleeping(True)
 
+		self.onIdleTimer = None
 		if printerConnection.hasOnIdle():
 			wx.EVT_IDLE(self, printerConnection.onIdle)
+			#Idle events stop when nothing happens in the gui, the timer keeps the connection messages coming.
+			self.onIdleTimer = wx.Timer(self)
+			self.Bind(wx.EVT_TIMER, printerConnection.onIdle, self.onIdleTimer)
+			self.onIdleTimer.Start(50)
 
 	def OnPowerWarningChange(self, e):
 		type = self.powerManagement.get_providing_power_source_type()
@@ -400,6 +408,8 @@ class printWindowBasic(wx.Frame):
 			self.Refresh()
 
 	def OnClose(self, e):
+		if self.onIdleTimer is not None:
+			self.onIdleTimer.Stop()
 		if self._printerConnection.hasActiveConnection():
 			if self._printerConnection.isPrinting():
 				pass #TODO: Give warning that the close will kill the print.
@@ -421,6 +431,12 @@ class printWindowBasic(wx.Frame):
 			self._printerConnection.setStoreMode(self.storeMode.IsChecked())
 		self._printerConnection.startPrint()
 
+	def OnResume(self, e):
+		#The checkpoint is only resumed in the mode the window shows.
+		if self._printerConnection.hasStoreMode():
+			self._printerConnection.setStoreMode(self.storeMode.IsChecked())
+		self._printerConnection.resumePrint()
+
 	def OnCancel(self, e):
 		self._printerConnection.cancelPrint()
 
@@ -465,12 +481,15 @@ class printWindowBasic(wx.Frame):
 		self.connectButton.Show(self._printerConnection.hasActiveConnection())
 		self.connectButton.Enable(not self._printerConnection.isActiveConnectionOpen() and not self._printerConnection.isActiveConnectionOpening())
 		self.pauseButton.Show(self._printerConnection.hasPause())
+		self.resumeButton.Show(self._printerConnection.hasResume())
 		if not self._printerConnection.hasActiveConnection() or self._printerConnection.isActiveConnectionOpen():
 			self.printButton.Enable(not self._printerConnection.isPrinting())
+			self.resumeButton.Enable(not self._printerConnection.isPrinting() and self._printerConnection.canResume())
 			self.pauseButton.Enable(self._printerConnection.isPrinting())
 			self.cancelButton.Enable(self._printerConnection.isPrinting())
 		else:
 			self.printButton.Enable(False)
+			self.resumeButton.Enable(False)
 			self.pauseButton.Enable(False)
 			self.cancelButton.Enable(False)
 		self.errorLogButton.Show(self._printerConnection.isInErrorState())
@@ -23,6 +23,8 @@ class engineResultView(object):
 		self._resultLock = threading.Lock()
 		self._layerVBOs = []
 		self._layer20VBOs = []
+		#Number of GCode layers next to the visible layers that are decoded in the background while the GCode is loading.
+		self._gcodePrefetchCount = 5
 
 		self.layerSelect = openglGui.glSlider(self._parent, 10000, 0, 1, (-1,-2), lambda : self._parent.QueueRefresh())
 
@@ -66,12 +68,16 @@ class engineResultView(object):
 		result = self._result
 		if result is not None:
 			gcodeLayers = result.getGCodeLayers(self._gcodeLoadCallback)
+			gcodeLayerIndex = result.getGCodeLayerIndex()
+			gcodeLayerCount = self._getGCodeLayerCount(gcodeLayers, gcodeLayerIndex)
 			if result._polygons is not None and len(result._polygons) > 0:
 				self.layerSelect.setRange(1, len(result._polygons))
-			elif gcodeLayers is not None and len(gcodeLayers) > 0:
-				self.layerSelect.setRange(1, len(gcodeLayers))
+			elif gcodeLayerCount > 0:
+				self.layerSelect.setRange(1, gcodeLayerCount)
 		else:
 			gcodeLayers = None
+			gcodeLayerIndex = None
+			gcodeLayerCount = 0
 
 		glPushMatrix()
 		glEnable(GL_BLEND)
@@ -82,9 +88,10 @@ class engineResultView(object):
 		layerNr = self.layerSelect.getValue()
 		if layerNr == self.layerSelect.getMaxValue() and result is not None and len(result._polygons) > 0:
 			layerNr = max(layerNr, len(result._polygons))
-		if result is not None and len(result._polygons) > layerNr-1 and 'inset0' in result._polygons[layerNr-1] and len(result._polygons[layerNr-1]['inset0']) > 0 and len(result._polygons[layerNr-1]['inset0'][0]) > 0:
-			viewZ = result._polygons[layerNr-1]['inset0'][0][0][2]
-		else:
+		viewZ = None
+		if result is not None and len(result._polygons) > layerNr-1:
+			viewZ = result._polygons[layerNr-1].getZ('inset0')
+		if viewZ is None:
 			viewZ = (layerNr - 1) * profile.getProfileSettingFloat('layer_height') + profile.getProfileSettingFloat('bottom_thickness')
 		self._parent._viewTarget[2] = viewZ
 		msize = max(profile.getMachineSettingFloat('machine_width'), profile.getMachineSettingFloat('machine_depth'))
@@ -100,6 +107,10 @@ class engineResultView(object):
 		]
 		n = layerNr - 1
 		generatedVBO = False
+		if gcodeLayerIndex is not None and (gcodeLayers is None or len(gcodeLayers) < layerNr + 1):
+			#The layers around the selected layer are not loaded yet, decode them from the layer index and prefetch the layers next to them.
+			gcodeLayerIndex.decodeLayers(layerNr - 10, layerNr)
+			gcodeLayerIndex.prefetch(layerNr - 10 - self._gcodePrefetchCount, layerNr + self._gcodePrefetchCount)
 		if result is not None:
 			while n >= 0:
 				if layerNr - n > 30 and n % 20 == 0 and len(result._polygons) > 0:
@@ -121,7 +132,7 @@ class engineResultView(object):
 									polygons = []
 									for i in xrange(0, 20):
 										if typeName in result._polygons[n + i]:
-											polygons += result._polygons[n + i][typeName]
+											polygons.append(result._polygons[n + i][typeName])
 									layerVBOs[typeName] = self._polygonsToVBO_lines(polygons)
 									generatedVBO = True
 								glColor4f(color[0]*0.5,color[1]*0.5,color[2]*0.5,color[3])
@@ -133,18 +144,18 @@ class engineResultView(object):
 					while len(self._layerVBOs) < n + 1:
 						self._layerVBOs.append({})
 					layerVBOs = self._layerVBOs[n]
-					if gcodeLayers is not None and ((layerNr - 10 < n < (len(gcodeLayers) - 1)) or len(result._polygons) < 1):
+					if gcodeLayerCount > 0 and ((layerNr - 10 < n < (gcodeLayerCount - 1)) or len(result._polygons) < 1):
 						for typeNamePolygons, typeName, color in lineTypeList:
 							if typeName is None:
 								continue
 							if 'GCODE-' + typeName not in layerVBOs:
-								layerVBOs['GCODE-' + typeName] = self._gcodeToVBO_quads(gcodeLayers[n+1:n+2], typeName)
+								layerVBOs['GCODE-' + typeName] = self._gcodeToVBO_quads(self._getGCodeLayers(gcodeLayers, gcodeLayerIndex, n+1), typeName)
 							glColor4f(color[0]*c,color[1]*c,color[2]*c,color[3])
 							layerVBOs['GCODE-' + typeName].render()
 
 						if n == layerNr - 1:
 							if 'GCODE-MOVE' not in layerVBOs:
-								layerVBOs['GCODE-MOVE'] = self._gcodeToVBO_lines(gcodeLayers[n+1:n+2])
+								layerVBOs['GCODE-MOVE'] = self._gcodeToVBO_lines(self._getGCodeLayers(gcodeLayers, gcodeLayerIndex, n+1))
 							glColor4f(0,0,c,1)
 							layerVBOs['GCODE-MOVE'].render()
 					elif n < len(result._polygons):
@@ -152,7 +163,7 @@ class engineResultView(object):
 						for typeName, typeNameGCode, color in lineTypeList:
 							if typeName in polygons:
 								if typeName not in layerVBOs:
-									layerVBOs[typeName] = self._polygonsToVBO_lines(polygons[typeName])
+									layerVBOs[typeName] = self._polygonsToVBO_lines([polygons[typeName]])
 								glColor4f(color[0]*c,color[1]*c,color[2]*c,color[3])
 								layerVBOs[typeName].render()
 					n -= 1
@@ -160,7 +171,7 @@ class engineResultView(object):
 		if generatedVBO:
 			self._parent._queueRefresh()
 
-		if gcodeLayers is not None and self._gcodeLoadProgress != 0.0 and self._gcodeLoadProgress != 1.0:
+		if gcodeLayerCount > 0 and self._gcodeLoadProgress != 0.0 and self._gcodeLoadProgress != 1.0:
 			glPushMatrix()
 			glLoadIdentity()
 			glTranslate(0,-0.8,-2)
@@ -169,33 +180,65 @@ class engineResultView(object):
 			glPopMatrix()
 		self._resultLock.release()
 
-	def _polygonsToVBO_lines(self, polygons):
-		verts = numpy.zeros((0, 3), numpy.float32)
-		indices = numpy.zeros((0), numpy.uint32)
-		for poly in polygons:
-			if len(poly) > 2:
-				i = numpy.arange(len(verts), len(verts) + len(poly) + 1, 1, numpy.uint32)
-				i[-1] = len(verts)
-				i = numpy.dstack((i[0:-1],i[1:])).flatten()
-			else:
-				i = numpy.arange(len(verts), len(verts) + len(poly), 1, numpy.uint32)
-			indices = numpy.concatenate((indices, i), 0)
-			verts = numpy.concatenate((verts, poly), 0)
-		return openglHelpers.GLVBO(GL_LINES, verts, indicesArray=indices)
+	def _getGCodeLayerCount(self, gcodeLayers, gcodeLayerIndex):
+		if gcodeLayerIndex is not None:
+			return gcodeLayerIndex.getLayerCount()
+		if gcodeLayers is not None:
+			return len(gcodeLayers)
+		return 0
 
-	def _polygonsToVBO_quads(self, polygons):
-		verts = numpy.zeros((0, 3), numpy.float32)
-		indices = numpy.zeros((0), numpy.uint32)
-		for poly in polygons:
-			i = numpy.arange(len(verts), len(verts) + len(poly) + 1, 1, numpy.uint32)
-			i2 = numpy.arange(len(verts) + len(poly), len(verts) + len(poly) + len(poly) + 1, 1, numpy.uint32)
-			i[-1] = len(verts)
-			i2[-1] = len(verts) + len(poly)
-			i = numpy.dstack((i[0:-1],i2[0:-1],i2[1:],i[1:])).flatten()
-			indices = numpy.concatenate((indices, i), 0)
-			verts = numpy.concatenate((verts, poly), 0)
-			verts = numpy.concatenate((verts, poly * numpy.array([1,0,1],numpy.float32) + numpy.array([0,-100,0],numpy.float32)), 0)
-		return openglHelpers.GLVBO(GL_QUADS, verts, indicesArray=indices)
+	def _getGCodeLayers(self, gcodeLayers, gcodeLayerIndex, layerNr):
+		"""
+		Get a list with the GCode layer layerNr, from the loaded layers when it is loaded already, else decoded from the layer index.
+		"""
+		if gcodeLayers is not None and layerNr < len(gcodeLayers):
+			return gcodeLayers[layerNr:layerNr+1]
+		if gcodeLayerIndex is not None and layerNr < gcodeLayerIndex.getLayerCount():
+			return [gcodeLayerIndex.getLayer(layerNr)]
+		return []
+
+	def _joinPolygonLists(self, polygonLists):
+		"""
+		Join a list of PolygonLists into one vertex array, with the start and vertex count of each polygon in that array.
+		"""
+		verts = numpy.concatenate([polygonList.getPoints() for polygonList in polygonLists] + [numpy.zeros((0, 3), numpy.float32)])
+		starts = [numpy.zeros(0, numpy.int64)]
+		offset = 0
+		for polygonList in polygonLists:
+			starts.append(polygonList.getOffsets()[:-1] + offset)
+			offset += len(polygonList.getPoints())
+		starts = numpy.concatenate(starts)
+		lengths = numpy.diff(numpy.append(starts, len(verts)))
+		return verts, starts, lengths
+
+	def _polygonsToVBO_lines(self, polygonLists):
+		verts, starts, lengths = self._joinPolygonLists(polygonLists)
+		#Polygons with more than 2 points are closed: each point gives a line to the next point, and the last point to the first.
+		#Smaller polygons only give their own points.
+		closed = numpy.repeat(lengths > 2, lengths)
+		i = numpy.arange(0, len(verts), 1, numpy.uint32)
+		nextIdx = i + 1
+		nextIdx[(starts + lengths - 1)[lengths > 2]] = starts[lengths > 2]
+		mask = numpy.ones((len(verts), 2), numpy.bool)
+		mask[:,1] = closed
+		indices = numpy.column_stack((i, nextIdx))[mask]
+		return openglHelpers.GLVBO(GL_LINES, verts, indicesArray=numpy.array(indices, numpy.uint32))
+
+	def _polygonsToVBO_quads(self, polygonLists):
+		verts, starts, lengths = self._joinPolygonLists(polygonLists)
+		#Each polygon is followed by a copy projected down to the floor, quads connect each line of the polygon to the copy.
+		polygonStarts = numpy.repeat(starts, lengths)
+		polygonLengths = numpy.repeat(lengths, lengths)
+		i = numpy.arange(0, len(verts), 1, numpy.int64)
+		nextIdx = i + 1
+		nextIdx[(starts + lengths - 1)[lengths > 0]] = starts[lengths > 0]
+		quadVerts = numpy.empty((len(verts) * 2, 3), numpy.float32)
+		quadVerts[i + polygonStarts] = verts
+		quadVerts[i + polygonStarts + polygonLengths] = verts * numpy.array([1,0,1],numpy.float32) + numpy.array([0,-100,0],numpy.float32)
+		a = i + polygonStarts
+		aNext = nextIdx + polygonStarts
+		indices = numpy.column_stack((a, a + polygonLengths, aNext + polygonLengths, aNext)).flatten()
+		return openglHelpers.GLVBO(GL_QUADS, quadVerts, indicesArray=numpy.array(indices, numpy.uint32))
 
 	def _gcodeToVBO_lines(self, gcodeLayers, extrudeType):
 		if ':' in extrudeType:
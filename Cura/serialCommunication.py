@@ -11,6 +11,8 @@ import sys
 import time
 import os
 import json
+import threading
+import collections
 
 from Cura.util import machineCom
 
@@ -18,10 +20,24 @@ class serialComm(object):
 	"""
 	The serialComm class is the interface class which handles the communication between stdin/stdout and the machineCom class.
 	This interface class is used to run the (USB) serial communication in a different process then the GUI.
+
+	Progress and temperature updates are coalesced, only the last one is written every reportInterval seconds.
+	The updates are built by the thread that reports them, the report thread does not read the state of machineCom.
+	Of the Send/Recv log lines of the printer traffic only the last trafficLogSize are written each time.
 	"""
+	reportInterval = 0.2
+	trafficLogSize = 30
+
 	def __init__(self, portName, baudrate):
 		self._comm = None
 		self._gcodeList = []
+		self._writeLock = threading.Lock()
+		self._reports = {}
+		self._trafficLog = collections.deque(maxlen=self.trafficLogSize)
+
+		reportThread = threading.Thread(target=self._reportThread)
+		reportThread.daemon = True
+		reportThread.start()
 
 		try:
 			baudrate = int(baudrate)
@@ -29,25 +45,66 @@ class serialComm(object):
 			baudrate = 0
 		self._comm = machineCom.MachineCom(portName, baudrate, callbackObject=self)
 
+	def _write(self, line):
+		with self._writeLock:
+			sys.stdout.write(line)
+
+	#Keep only the last update of a kind, the report thread writes it.
+	def _report(self, kind, line):
+		with self._writeLock:
+			self._reports[kind] = line
+
+	#Write the pending updates, the write lock must be held.
+	def _flushReports(self):
+		self._flushTrafficLog()
+		if 'temp' in self._reports:
+			sys.stdout.write(self._reports.pop('temp'))
+		if 'progress' in self._reports:
+			sys.stdout.write(self._reports.pop('progress'))
+
+	def _reportThread(self):
+		while True:
+			time.sleep(self.reportInterval)
+			with self._writeLock:
+				self._flushReports()
+
+	#Write the pending traffic log lines, the write lock must be held.
+	def _flushTrafficLog(self):
+		if len(self._trafficLog) > 0:
+			sys.stdout.write(''.join(self._trafficLog))
+			self._trafficLog.clear()
+
 	def mcLog(self, message):
-		sys.stdout.write('log:%s\n' % (message))
+		with self._writeLock:
+			if message.startswith('Send: ') or message.startswith('Recv: '):
+				self._trafficLog.append('log:%s\n' % (message))
+			else:
+				self._flushTrafficLog()
+				sys.stdout.write('log:%s\n' % (message))
 
 	def mcTempUpdate(self, temp, bedTemp, targetTemp, bedTargetTemp):
-		sys.stdout.write('temp:%s:%s:%f:%f\n' % (json.dumps(temp), json.dumps(targetTemp), bedTemp, bedTargetTemp))
+		self._report('temp', 'temp:%s:%s:%f:%f\n' % (json.dumps(temp), json.dumps(targetTemp), bedTemp, bedTargetTemp))
 
 	def mcStateChange(self, state):
 		if self._comm is None:
 			return
-		sys.stdout.write('state:%d:%s\n' % (state, self._comm.getStateString()))
+		#Pending updates go first, so the final progress of a print comes before its state change.
+		with self._writeLock:
+			self._flushReports()
+			sys.stdout.write('state:%d:%s\n' % (state, self._comm.getStateString()))
 
 	def mcMessage(self, message):
-		sys.stdout.write('message:%s\n' % (message))
+		self._write('message:%s\n' % (message))
 
 	def mcProgress(self, lineNr):
-		sys.stdout.write('progress:%d\n' % (lineNr))
+		#Called right after the line is sent, so the line, layer and time left are of the same moment.
+		timeLeft = self._comm.getPrintTimeRemainingEstimate()
+		if timeLeft is None:
+			timeLeft = -1
+		self._report('progress', 'progress:%d:%d:%d\n' % (lineNr, self._comm.getLayer(), timeLeft * 60))
 
 	def mcZChange(self, newZ):
-		sys.stdout.write('changeZ:%d\n' % (newZ))
+		self._write('changeZ:%d\n' % (newZ))
 
 	def monitorStdin(self):
 		while not self._comm.isClosed():
@@ -58,10 +115,20 @@ class serialComm(object):
 				self._gcodeList = ['M110']
 			elif line[0] == 'G':
 				self._gcodeList.append(line[1])
+			elif line[0] == 'FILE':
+				#The whole gcode is handed over in a temporary file, one line per command.
+				with open(line[1], 'rb') as f:
+					data = f.read()
+				os.remove(line[1])
+				if len(data) > 0:
+					self._gcodeList += data.split('\n')
 			elif line[0] == 'C':
 				self._comm.sendCommand(line[1])
 			elif line[0] == 'START':
-				self._comm.printGCode(self._gcodeList)
+				startLayer = 0
+				if len(line) > 1:
+					startLayer = int(line[1])
+				self._comm.printGCode(self._gcodeList, startLayer)
 			else:
 				sys.stderr.write(str(line))
 
@@ -0,0 +1,151 @@
+"""
+Batch slicing from the commandline.
+Slices many model files with a pool of workers, where each worker has its own Engine, so multiple CuraEngine processes run at the same time.
+A summary with the print time and filament use of each file is written as CSV.
+"""
+__copyright__ = "Copyright (C) 2013 David Braam - Released under terms of the AGPLv3 License"
+
+import os
+import csv
+import glob
+import time
+import threading
+import Queue
+import multiprocessing
+
+from Cura.util import profile
+from Cura.util import sliceEngine
+from Cura.util import objectScene
+from Cura.util import meshLoader
+
+def expandInputFiles(args):
+	"""
+	Expand the commandline arguments into a list of model files. Directories are searched for all supported model files,
+	and wildcards are expanded here, as not every shell does this.
+	"""
+	filenames = []
+	for arg in args:
+		if os.path.isdir(arg):
+			for filename in sorted(os.listdir(arg)):
+				if os.path.splitext(filename)[1].lower() in meshLoader.loadSupportedExtensions():
+					filenames.append(os.path.join(arg, filename))
+		elif os.path.isfile(arg):
+			filenames.append(arg)
+		else:
+			filenames += sorted(glob.glob(arg))
+	return filenames
+
+def getDefaultJobCount():
+	try:
+		return multiprocessing.cpu_count()
+	except NotImplementedError:
+		return 1
+
+class batchSlicer(object):
+	"""
+	Slices a list of model files with jobCount workers. Each file is sliced as a scene with only the objects from that file.
+	"""
+	def __init__(self, filenames, outputPath = None, jobCount = None):
+		self._filenames = filenames
+		self._outputPath = outputPath
+		self._outputFilenames = {}
+		if outputPath is not None and os.path.isdir(outputPath):
+			#Files with the same name from different directories get a number added, so they do not overwrite each other.
+			used = set()
+			ext = profile.getGCodeExtension()
+			for filename in filenames:
+				name = os.path.basename(filename)
+				outputFilename = os.path.join(outputPath, name + ext)
+				n = 1
+				while os.path.normcase(outputFilename) in used:
+					n += 1
+					outputFilename = os.path.join(outputPath, '%s_%d%s' % (name, n, ext))
+				used.add(os.path.normcase(outputFilename))
+				self._outputFilenames[filename] = outputFilename
+		if jobCount is None:
+			jobCount = getDefaultJobCount()
+		self._jobCount = max(1, min(jobCount, len(filenames)))
+		self._queue = Queue.Queue()
+		self._results = {}
+		self._printLock = threading.Lock()
+
+	def getOutputFilename(self, filename):
+		if self._outputPath is None:
+			return filename + profile.getGCodeExtension()
+		if filename in self._outputFilenames:
+			return self._outputFilenames[filename]
+		return self._outputPath
+
+	def run(self):
+		"""
+		Slice all files.
+		:return: A list with a dictionary of the slice information for each file, in the order of the files.
+		"""
+		for filename in self._filenames:
+			self._queue.put(filename)
+		#The engines are created here, so each gets its own socket port from the port search in Engine.__init__.
+		engines = []
+		for n in xrange(0, self._jobCount):
+			engines.append(sliceEngine.Engine(lambda progress: None))
+		threads = []
+		for engine in engines:
+			thread = threading.Thread(target=self._worker, args=(engine,))
+			thread.daemon = True
+			thread.start()
+			threads.append(thread)
+		for thread in threads:
+			thread.join()
+		for engine in engines:
+			engine.cleanup()
+		return map(lambda filename: self._results[filename], self._filenames)
+
+	def _worker(self, engine):
+		while True:
+			try:
+				filename = self._queue.get_nowait()
+			except Queue.Empty:
+				return
+			self._results[filename] = self._sliceFile(engine, filename)
+
+	def _sliceFile(self, engine, filename):
+		info = {'filename': filename, 'output': self.getOutputFilename(filename), 'success': False, 'printTime': 0, 'filamentMM': 0.0, 'filamentGram': 0.0, 'sliceTime': 0.0}
+		t = time.time()
+		try:
+			scene = objectScene.Scene()
+			scene.updateMachineDimensions()
+			for m in meshLoader.loadMeshes(filename):
+				scene.add(m)
+			engine.runEngine(scene)
+			engine.wait()
+			result = engine.getResult()
+			if result is not None and result.isFinished():
+				with open(info['output'], "wb") as f:
+					gcode = result.getGCode()
+					while True:
+						data = gcode.read(1024 * 1024)
+						if len(data) == 0:
+							break
+						f.write(data)
+				info['success'] = True
+				if result._printTimeSeconds is not None:
+					info['printTime'] = result._printTimeSeconds
+				info['filamentMM'] = result._filamentMM[0]
+				info['filamentGram'] = result.getFilamentWeight() * 1000.0
+		except:
+			import traceback
+			traceback.print_exc()
+		info['sliceTime'] = time.time() - t
+		self._printLock.acquire()
+		if info['success']:
+			print 'GCode file saved : %s (%.1fs)' % (info['output'], info['sliceTime'])
+		else:
+			print 'Failed to slice : %s' % (filename)
+		self._printLock.release()
+		return info
+
+def writeSummary(filename, infoList):
+	with open(filename, 'wb') as f:
+		writer = csv.writer(f)
+		writer.writerow(['filename', 'output', 'success', 'print_time_seconds', 'filament_mm', 'filament_gram', 'slice_time_seconds'])
+		for info in infoList:
+			writer.writerow([info['filename'], info['output'], info['success'], '%d' % (info['printTime']), '%.2f' % (info['filamentMM']), '%.2f' % (info['filamentGram']), '%.2f' % (info['sliceTime'])])
@@ -1,4 +1,8 @@
+import os
 import sys
+import io
+import mmap
+import tempfile
 import cStringIO as StringIO
 
 class BigDataStorage(object):
@@ -35,6 +39,28 @@ class BigDataStorage(object):
 				ret = self.activeRead(size)
 		return ret
 
+	def readRange(self, offset, size):
+		"""
+		Read size bytes starting at offset, without changing the read position.
+		"""
+		ret = []
+		for data in self._list:
+			pos = data.tell()
+			data.seek(0, 2)
+			length = data.tell()
+			if offset < length:
+				data.seek(offset)
+				ret.append(data.read(size))
+				data.seek(pos)
+				size -= len(ret[-1])
+				if size < 1:
+					break
+				offset = 0
+			else:
+				data.seek(pos)
+				offset -= length
+		return ''.join(ret)
+
 	def replaceAtStart(self, key, value):
 		data = self._list[0].getvalue()
 		block0 = data[0:2048]
@@ -86,3 +112,181 @@ class BigDataStorage(object):
 			clone._list.append(StringIO.StringIO(item.getvalue()))
 		clone._active = clone._list[-1]
 		return clone
+
+class _DiskData(object):
+	"""
+	The temporary file and memory mapping shared by a DiskDataStorage and all its clones.
+	"""
+	def __init__(self, filename = None):
+		if filename is None:
+			self._file = tempfile.TemporaryFile(prefix='CuraGCode')
+			self._size = 0
+		else:
+			self._file = open(filename, 'rb')
+			self._size = os.fstat(self._file.fileno()).st_size
+		self._map = None
+		self._mapSize = 0
+
+	def write(self, data):
+		self._file.seek(0, 2)
+		self._file.write(data)
+		self._size += len(data)
+
+	def writeAt(self, offset, data):
+		self._file.seek(offset)
+		self._file.write(data)
+		self._file.flush()
+
+	def getMap(self):
+		#The mapping is created again when data was written after the last mapping, readers holding the old mapping can keep using it.
+		if self._map is None or self._mapSize != self._size:
+			self._file.flush()
+			if self._size > 0:
+				self._map = mmap.mmap(self._file.fileno(), self._size, access=mmap.ACCESS_READ)
+			else:
+				self._map = ''
+			self._mapSize = self._size
+		return self._map
+
+class DiskDataStorage(object):
+	"""
+	A BigDataStorage that keeps the data in a temporary file instead of in memory, and reads it back through a memory mapping.
+	The memory use stays the same no matter how big the GCode is, and clone() only creates a new read position on the same file.
+	"""
+	def __init__(self, diskData = None):
+		if diskData is None:
+			diskData = _DiskData()
+		self._data = diskData
+		self._pos = 0
+
+	@staticmethod
+	def fromFile(filename):
+		"""
+		Create a read only DiskDataStorage that maps an existing file.
+		"""
+		return DiskDataStorage(_DiskData(filename))
+
+	def saveToFile(self, filename):
+		with open(filename, 'wb') as f:
+			offset = 0
+			while True:
+				data = self.readRange(offset, 1024 * 1024)
+				if len(data) < 1:
+					break
+				f.write(data)
+				offset += len(data)
+
+	def write(self, data):
+		self._data.write(data)
+
+	def writeFromStream(self, stream, abortCheck = None, bufferSize = 1024 * 1024):
+		"""
+		Write all data from a file object until the end of the stream.
+		The data is read straight from the file descriptor into one reusable buffer, so no string is created for each read.
+		:param abortCheck: Called before each read, used to stop the process that produces the data.
+		:return: The number of bytes written.
+		"""
+		fileIO = io.FileIO(stream.fileno(), 'r', closefd=False)
+		buffer = bytearray(bufferSize)
+		view = memoryview(buffer)
+		total = 0
+		while True:
+			if abortCheck is not None:
+				abortCheck()
+			size = fileIO.readinto(buffer)
+			if not size:
+				break
+			self._data.write(view[:size])
+			total += size
+		return total
+
+	def writeRange(self, source, offset, size):
+		"""
+		Append size bytes from offset of another storage, in blocks so the data is never in memory at once.
+		"""
+		while size > 0:
+			data = source.readRange(offset, min(size, 1024 * 1024))
+			if len(data) < 1:
+				break
+			self._data.write(data)
+			offset += len(data)
+			size -= len(data)
+
+	def seekStart(self):
+		self._pos = 0
+
+	def activeRead(self, size=None):
+		return self.read(size)
+
+	def read(self, size=None):
+		data = self._data.getMap()
+		if size is None:
+			ret = data[self._pos:]
+		else:
+			ret = data[self._pos:self._pos + size]
+		self._pos += len(ret)
+		return ret
+
+	def readRange(self, offset, size):
+		"""
+		Read size bytes starting at offset, without changing the read position.
+		"""
+		return self._data.getMap()[offset:offset + size]
+
+	def replaceAtStart(self, key, value):
+		block0 = self.readRange(0, 2048)
+		value = (value + ' ' * len(key))[:len(key)]
+		#The value has the same length as the key, so the data can be patched in place.
+		self._data.writeAt(0, block0.replace(key, value))
+
+	def __len__(self):
+		return self._data._size
+
+	def __iter__(self):
+		return self
+
+	def next(self):
+		data = self._data.getMap()
+		if self._pos >= len(data):
+			raise StopIteration
+		end = data.find('\n', self._pos)
+		if end < 0:
+			end = len(data)
+		else:
+			end += 1
+		ret = data[self._pos:end]
+		self._pos = end
+		return ret
+
+	def tell(self):
+		return self._pos
+
+	def close(self):
+		pass
+
+	def clone(self):
+		return DiskDataStorage(self._data)
+
+if __name__ == '__main__':
+	#Benchmark of the throughput from a process to the data storage.
+	#Usage: bigDataStorage.py [size in MB]
+	import time
+	import subprocess
+	size = 200
+	if len(sys.argv) > 1:
+		size = int(sys.argv[1])
+	writer = 'import sys\ndata = "G1 X100.000 Y100.000 E10.00000\\n" * 32768\nfor n in xrange(0, %d):\n\tsys.stdout.write(data)\n' % (size * 1024 * 1024 / (32 * 32768))
+	for name in ['read(4096)', 'writeFromStream']:
+		p = subprocess.Popen([sys.executable, '-c', writer], stdout=subprocess.PIPE)
+		storage = DiskDataStorage()
+		t = time.time()
+		if name == 'read(4096)':
+			data = p.stdout.read(4096)
+			while len(data) > 0:
+				storage.write(data)
+				data = p.stdout.read(4096)
+		else:
+			storage.writeFromStream(p.stdout)
+		p.wait()
+		t = time.time() - t
+		print '%s: %d MB in %.2fs, %.1f MB/s' % (name, len(storage) / 1024 / 1024, t, len(storage) / 1024.0 / 1024.0 / t)
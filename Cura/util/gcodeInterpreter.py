@@ -1,18 +1,33 @@
 """
 The GCodeInterpreter module generates layer information from GCode.
 It does this by parsing the whole GCode file. On large files this can take a while and should be used from a thread.
+
+Two interpreter engines are available, selected with the 'gcode_interpreter' preference:
+ Classic: parses the GCode line by line.
+ Vectorized: tokenizes the GCode in large blocks with a single regular expression and processes runs of moves with numpy.
+Both engines produce the same layerList structure, compareLayerLists checks that for a file.
+
+When the 'gcode_layer_cache' preference is enabled the resulting layerList is stored by the gcodeLayerCache module,
+and loading the same GCode again with the same settings is done from that cache instead of parsing it.
 """
 __copyright__ = "Copyright (C) 2013 David Braam - Released under terms of the AGPLv3 License"
 
 import sys
+import copy
 import math
 import os
+import re
 import time
 import numpy
 import types
+import threading
 import cStringIO as StringIO
 
 from Cura.util import profile
+from Cura.util import gcodeLayerCache
+
+#Version of the interpretation of the GCode, increase this when the resulting layerList changes so old cache entries are not used.
+interpreterVersion = 1
 
 def gcodePath(newType, pathType, layerThickness, startPoint):
 	"""
@@ -33,27 +48,58 @@ class gcode(object):
 	The heavy lifting GCode parser. This is most likely the hardest working python code in Cura.
 	It parses a GCode file and stores the result in layers where each layer as paths that describe the GCode.
 	"""
-	def __init__(self):
+	def __init__(self, engine = None):
 		self.regMatch = {}
 		self.layerList = None
 		self.extrusionAmount = 0
 		self.filename = None
 		self.progressCallback = None
-	
+		#The interpreter engine to use, 'Classic' or 'Vectorized'. None uses the 'gcode_interpreter' preference.
+		self.engine = engine
+
+	def _getLoadFunction(self):
+		engine = self.engine
+		if engine is None:
+			engine = profile.getPreference('gcode_interpreter')
+		if engine == 'Vectorized':
+			return lambda gcodeFile: _vectorizedLoader(self).load(gcodeFile)
+		return self._load
+
 	def load(self, data):
 		self.filename = None
+		self._aborted = False
+		cacheKey = None
+		if profile.getPreference('gcode_layer_cache') == 'True':
+			cacheKey = gcodeLayerCache.getCacheKey(data, interpreterVersion)
+			layerList = gcodeLayerCache.load(cacheKey)
+			if layerList is not None:
+				if type(data) in types.StringTypes and os.path.isfile(data):
+					self.filename = data
+				self.layerList = layerList
+				if self.progressCallback is not None:
+					self.progressCallback(1.0)
+				return
+		loadFunction = self._getLoadFunction()
 		if type(data) in types.StringTypes and os.path.isfile(data):
 			self.filename = data
 			self._fileSize = os.stat(data).st_size
 			gcodeFile = open(data, 'r')
-			self._load(gcodeFile)
+			loadFunction(gcodeFile)
 			gcodeFile.close()
 		elif type(data) is list:
-			self._load(data)
+			if loadFunction == self._load:
+				self._load(data)
+			else:
+				lines = map(lambda line: line[0] if type(line) is tuple else line, data)
+				gcodeFile = StringIO.StringIO('\n'.join(map(lambda line: line.rstrip('\n'), lines)))
+				self._fileSize = len(gcodeFile.getvalue())
+				loadFunction(gcodeFile)
 		else:
 			self._fileSize = len(data)
 			data.seekStart()
-			self._load(data)
+			loadFunction(data)
+		if cacheKey is not None and not self._aborted:
+			gcodeLayerCache.save(cacheKey, self.layerList)
 
 	def calculateWeight(self):
 		#Calculates the weight of the filament in kg
@@ -120,6 +166,7 @@ class gcode(object):
 					if self.progressCallback is not None:
 						if self.progressCallback(float(gcodeFile.tell()) / float(self._fileSize)):
 							#Abort the loading, we can safely return as the results here will be discarded
+							self._aborted = True
 							gcodeFile.close()
 							return
 					currentLayer = [currentPath]
@@ -313,10 +360,638 @@ def getCodeFloat(line, code):
 	except:
 		return None
 
+#Number characters accepted by the vectorized tokenizer, invalid numbers are treated as missing parameters just like getCodeFloat does.
+_floatRegex = r'[-+0-9.]+'
+#Matches every non-empty line. Plain G0/G1/G10/G11 lines in the "G F X Y Z E" parameter order fill the first 5 groups,
+# all other lines end up in the 6th group and are handled one by one.
+_lineRegex = re.compile(r'^(?:G(1[01]|[01])(?: F%s)?(?: X(%s))?(?: Y(%s))?(?: Z(%s))?(?: E(%s))?[ \t\r]*$|(.+))' % ((_floatRegex,) * 5), re.MULTILINE)
+_knownMCodes = (0, 1, 25, 80, 81, 84, 92, 101, 103, 104, 105, 106, 107, 108, 109, 110, 113, 117, 140, 190)
+_moveTypeNames = ('move', 'extrude', 'retract')
+
+def _commentPathType(line, pathType):
+	"""
+	Return the path type after a line with a comment, this follows the comment parsing of gcode._load.
+	"""
+	#Parse Cura_SF comments
+	if line.startswith(';TYPE:'):
+		pathType = line[6:].strip()
+	comment = line[line.find(';')+1:].strip()
+	#Slic3r GCode comment parser
+	if comment == 'fill':
+		pathType = 'FILL'
+	elif comment == 'perimeter':
+		pathType = 'WALL-INNER'
+	elif comment == 'skirt':
+		pathType = 'SKIRT'
+	return pathType
+
+def _toFloatArray(values):
+	"""
+	Convert a sequence of number strings to a float64 array, empty strings become NaN.
+	"""
+	a = numpy.fromstring(' '.join([v or 'nan' for v in values]), numpy.float64, sep=' ')
+	if len(a) != len(values):
+		#A malformed number stops the parser early, fall back to parsing each value on its own.
+		return numpy.array(map(_parseFloat, values), numpy.float64)
+	return a
+
+def _parseFloat(value):
+	try:
+		return float(value)
+	except ValueError:
+		return numpy.nan
+
+def _forwardFill(values, initial):
+	"""
+	Replace each NaN in values with the last non-NaN value before it, or initial if there is none.
+	"""
+	valid = ~numpy.isnan(values)
+	idx = numpy.where(valid, numpy.arange(len(values)), -1)
+	idx = numpy.maximum.accumulate(idx)
+	return numpy.where(idx >= 0, values[idx], initial)
+
+class _vectorizedLoader(object):
+	"""
+	The vectorized GCode interpreter engine. Produces the same layerList as gcode._load.
+	The GCode is tokenized in large blocks with a single regular expression, after which each run of plain move lines
+	between two other lines is processed with numpy. Per layer only the point indices, extrusion values and path start
+	offsets are collected, the path dictionaries get their numpy arrays when the layer is finished.
+	"""
+	def __init__(self, gcodeObject, blockSize = 4 * 1024 * 1024):
+		self._gcode = gcodeObject
+		self._blockSize = blockSize
+		self._spiralize = profile.getProfileSetting('spiralize') == 'True'
+		self._layerHeight = profile.getProfileSettingFloat('layer_height')
+
+	#The interpreter state that carries over from one layer to the next.
+	_stateNames = ('_pos', '_posOffset', '_currentE', '_currentExtruder', '_extrudeAmountMultiply', '_absoluteE', '_scale', '_posAbs', '_moveType', '_layerThickness', '_pathType')
+
+	def getState(self):
+		return dict(map(lambda name: (name, copy.copy(getattr(self, name))), self._stateNames))
+
+	def setState(self, state):
+		for name in self._stateNames:
+			setattr(self, name, copy.copy(state[name]))
+
+	def load(self, gcodeFile, state = None):
+		"""
+		Load the GCode into the layerList of the gcode object. When a state is given the interpreter starts with that state instead of the power-on state.
+		"""
+		self._gcode.layerList = []
+		self._bytesDone = 0
+		if state is not None:
+			self.setState(state)
+		else:
+			self._pos = [0.0, 0.0, 0.0]
+			self._posOffset = [0.0, 0.0, 0.0]
+			self._currentE = 0.0
+			self._currentExtruder = 0
+			self._extrudeAmountMultiply = 1.0
+			self._absoluteE = True
+			self._scale = 1.0
+			self._posAbs = True
+			self._moveType = 0
+			self._layerThickness = 0.1
+			self._pathType = 'CUSTOM'
+		self._startLayer(numpy.array([self._pos], numpy.float64), True)
+		self._addPath(self._moveType, 0, self._layerThickness, 0)
+
+		for block in self._readBlocks(gcodeFile):
+			if self._loadBlock(block):
+				#Abort the loading, we can safely return as the results here will be discarded
+				self._gcode._aborted = True
+				gcodeFile.close()
+				return
+		self._finishLayer()
+		if self._gcode.progressCallback is not None and self._gcode._fileSize > 0:
+			self._gcode.progressCallback(float(self._bytesDone) / float(self._gcode._fileSize))
+
+	def _readBlocks(self, gcodeFile):
+		rest = ''
+		while True:
+			data = gcodeFile.read(self._blockSize)
+			if len(data) < 1:
+				break
+			data = rest + data
+			n = data.rfind('\n')
+			if n < 0:
+				rest = data
+				continue
+			rest = data[n+1:]
+			self._blockEnd = self._bytesDone + n + 1
+			yield data[:n+1]
+			self._bytesDone = self._blockEnd
+		if len(rest) > 0:
+			self._blockEnd = self._bytesDone + len(rest)
+			yield rest
+			self._bytesDone = self._blockEnd
+
+	def _loadBlock(self, data):
+		matches = _lineRegex.findall(data)
+		if len(matches) < 1:
+			return False
+		codes, xs, ys, zs, es, others = zip(*matches)
+		codes = numpy.array(codes)
+		isMove = codes != ''
+		code = numpy.zeros(len(codes), numpy.int8)
+		code[codes == '1'] = 1
+		code[codes == '10'] = 10
+		code[codes == '11'] = 11
+		x = _toFloatArray(xs)
+		y = _toFloatArray(ys)
+		z = _toFloatArray(zs)
+		e = _toFloatArray(es)
+		moveCount = numpy.concatenate(([0], numpy.cumsum(isMove))).tolist()
+
+		#Comment lines that only change the path type do not interrupt a run of moves, they become path type markers.
+		runStart = 0
+		pathTypeMarkers = []
+		pathType = self._pathType
+		for n in numpy.nonzero(~isMove)[0].tolist():
+			line = others[n]
+			if line.startswith(';') and not line[1:].strip().startswith('LAYER:'):
+				newPathType = _commentPathType(line, pathType)
+				if newPathType != pathType:
+					pathType = newPathType
+					pathTypeMarkers.append((moveCount[n] - moveCount[runStart], pathType))
+				continue
+			self._addRun(runStart, n, isMove, code, x, y, z, e, pathTypeMarkers)
+			pathTypeMarkers = []
+			if self._processLine(line):
+				return True
+			pathType = self._pathType
+			runStart = n + 1
+		self._addRun(runStart, len(code), isMove, code, x, y, z, e, pathTypeMarkers)
+		return False
+
+	def _addRun(self, start, end, isMove, code, x, y, z, e, pathTypeMarkers):
+		if start >= end:
+			if len(pathTypeMarkers) > 0:
+				self._pathType = pathTypeMarkers[-1][1]
+			return
+		select = isMove[start:end]
+		if select.all():
+			self._addMoves(code[start:end], x[start:end], y[start:end], z[start:end], e[start:end], pathTypeMarkers)
+		else:
+			self._addMoves(code[start:end][select], x[start:end][select], y[start:end][select], z[start:end][select], e[start:end][select], pathTypeMarkers)
+
+	def _processLine(self, line):
+		"""
+		Handle a single line that is not a plain move, this follows gcode._load.
+		Returns True when the loading is aborted.
+		"""
+		if ';' in line:
+			self._pathType = _commentPathType(line, self._pathType)
+			#Cura layer comments.
+			if line[line.find(';')+1:].strip().startswith('LAYER:'):
+				if self._nextLayer():
+					return True
+			line = line[0:line.find(';')]
+		T = getCodeInt(line, 'T')
+		if T is not None:
+			if self._currentExtruder > 0:
+				self._posOffset[0] -= profile.getMachineSettingFloat('extruder_offset_x%d' % (self._currentExtruder))
+				self._posOffset[1] -= profile.getMachineSettingFloat('extruder_offset_y%d' % (self._currentExtruder))
+			self._currentExtruder = T
+			if self._currentExtruder > 0:
+				self._posOffset[0] += profile.getMachineSettingFloat('extruder_offset_x%d' % (self._currentExtruder))
+				self._posOffset[1] += profile.getMachineSettingFloat('extruder_offset_y%d' % (self._currentExtruder))
+
+		G = getCodeInt(line, 'G')
+		if G is not None:
+			if G == 0 or G == 1 or G == 10 or G == 11:
+				values = map(lambda code: getCodeFloat(line, code), 'XYZE')
+				values = numpy.array(map(lambda v: numpy.nan if v is None else v, values), numpy.float64).reshape((4, 1))
+				self._addMoves(numpy.array([G], numpy.int8), values[0], values[1], values[2], values[3])
+			elif G == 4:	#Delay
+				pass
+			elif G == 20:	#Units are inches
+				self._scale = 25.4
+			elif G == 21:	#Units are mm
+				self._scale = 1.0
+			elif G == 28:	#Home
+				x = getCodeFloat(line, 'X')
+				y = getCodeFloat(line, 'Y')
+				z = getCodeFloat(line, 'Z')
+				if x is None and y is None and z is None:
+					self._pos = [0.0, 0.0, 0.0]
+				else:
+					self._pos = self._pos[:]
+					if x is not None:
+						self._pos[0] = 0.0
+					if y is not None:
+						self._pos[1] = 0.0
+					if z is not None:
+						self._pos[2] = 0.0
+				#The new position is not a point of any path.
+				self._posIdx = -1
+			elif G == 90:	#Absolute position
+				self._posAbs = True
+			elif G == 91:	#Relative position
+				self._posAbs = False
+			elif G == 92:
+				e = getCodeFloat(line, 'E')
+				if e is not None:
+					self._currentE = e
+			else:
+				print "Unknown G code:" + str(G)
+		else:
+			M = getCodeInt(line, 'M')
+			if M is not None:
+				if M == 82:   #Absolute E
+					self._absoluteE = True
+				elif M == 83:   #Relative E
+					self._absoluteE = False
+				elif M == 221:	#Extrude amount multiplier
+					s = getCodeFloat(line, 'S')
+					if s is not None:
+						self._extrudeAmountMultiply = s / 100.0
+				elif M not in _knownMCodes:
+					print "Unknown M code:" + str(M)
+		return False
+
+	def _addMoves(self, code, x, y, z, e, pathTypeMarkers = None):
+		"""
+		Process a run of G0/G1/G10/G11 commands. The code array holds the G number of each command,
+		x, y, z and e hold the parameters with NaN for missing ones.
+		pathTypeMarkers is a list of (command index, path type) tuples for path type changes within the run.
+		"""
+		if (code == 11).any():
+			keep = code != 11
+			code, x, y, z, e = code[keep], x[keep], y[keep], z[keep], e[keep]
+			if pathTypeMarkers:
+				keepCount = numpy.concatenate(([0], numpy.cumsum(keep))).tolist()
+				pathTypeMarkers = map(lambda m: (keepCount[m[0]], m[1]), pathTypeMarkers)
+		count = len(code)
+		if count < 1:
+			if pathTypeMarkers:
+				self._pathType = pathTypeMarkers[-1][1]
+			return
+		isRetract = code == 10
+		isMove = ~isRetract
+		hasRetract = isRetract.any()
+
+		#Positions after each command, retract commands keep the current position.
+		pos = numpy.empty((count, 3), numpy.float64)
+		for axis, v in enumerate((x, y, z)):
+			if hasRetract:
+				v = numpy.where(isRetract, numpy.nan, v)
+			if self._posAbs:
+				pos[:,axis] = _forwardFill(v * self._scale + self._posOffset[axis], self._pos[axis])
+			else:
+				pos[:,axis] = numpy.cumsum(numpy.concatenate(([self._pos[axis]], numpy.nan_to_num(v) * self._scale)))[1:]
+
+		#Extrusion amount of each command
+		if hasRetract:
+			e = numpy.where(isRetract, numpy.nan, e)
+		if self._absoluteE:
+			absE = _forwardFill(e, self._currentE)
+			eAmount = numpy.where(numpy.isnan(e), 0.0, absE - numpy.concatenate(([self._currentE], absE[:-1])))
+			self._currentE = float(absE[-1])
+		else:
+			eAmount = numpy.nan_to_num(e)
+			self._currentE = float(numpy.cumsum(numpy.concatenate(([self._currentE], eAmount)))[-1])
+
+		#Move type of each command: 0 move, 1 extrude, 2 retract
+		moveType = numpy.where(eAmount > 0.0, 1, numpy.where(eAmount < 0.0, 2, 0))
+		moveType[isRetract] = 2
+		if isMove.any():
+			self._moveType = int(moveType[isMove][-1])
+
+		#Index of the point of each command in the layer point buffer.
+		movesBefore = numpy.cumsum(isMove)
+		pointIdx = self._pointCount - 1 + movesBefore
+		movesBefore -= isMove
+		prevPointIdx = numpy.where(movesBefore > 0, self._pointCount - 1 + movesBefore, self._posIdx)
+
+		#Layer thickness detection on Z changes of plain moves.
+		prevZ = numpy.concatenate(([self._pos[2]], pos[:-1,2]))
+		layerThickness = numpy.empty(count, numpy.float64)
+		layerThickness.fill(self._layerThickness)
+		zMove = isMove & (moveType == 0) & (prevZ != pos[:,2])
+		zDrop = None
+		if zMove.any():
+			zDrop = zMove & (prevZ > pos[:,2]) & (numpy.abs(prevZ - pos[:,2]) > 5.0) & (pos[:,2] < 1.0)
+			if zDrop.any():
+				prevZ = numpy.where(zDrop, 0.0, prevZ)
+			else:
+				zDrop = None
+			if self._layerThickness == 0.0:
+				thickness = numpy.abs(prevZ - pos[:,2])
+				setIdx = numpy.nonzero(zMove & (thickness != 0.0))[0]
+				if len(setIdx) > 0:
+					self._layerThickness = float(thickness[setIdx[0]])
+					layerThickness[setIdx[0]:] = self._layerThickness
+
+		#Path type of each command
+		pathTypeNames = [self._lastPathType, self._pathType]
+		pathTypeIdx = None
+		if pathTypeMarkers:
+			markerIdx = []
+			for idx, pathType in pathTypeMarkers:
+				if pathType not in pathTypeNames:
+					pathTypeNames.append(pathType)
+				markerIdx.append(pathTypeNames.index(pathType))
+			pathTypeIdx = numpy.array([pathTypeNames.index(self._pathType)] + markerIdx)[numpy.searchsorted(numpy.array([m[0] for m in pathTypeMarkers]), numpy.arange(count), 'right')]
+			self._pathType = pathTypeMarkers[-1][1]
+
+		#New paths start at each retract, and when the move type or path type changes.
+		newPath = isRetract | (moveType != numpy.concatenate(([self._lastPathMoveType], moveType[:-1])))
+		if pathTypeIdx is not None:
+			newPath |= pathTypeIdx != numpy.concatenate(([pathTypeNames.index(self._lastPathType)], pathTypeIdx[:-1]))
+		elif self._lastPathType != self._pathType:
+			newPath[0] = True
+		newPathIdx = numpy.nonzero(newPath)[0]
+		if len(newPathIdx) > 0:
+			startPointIdx = numpy.concatenate(([self._pointCount - 1], pointIdx[:-1]))[newPathIdx]
+			pathLayerThickness = layerThickness[newPathIdx]
+			if self._spiralize:
+				pathLayerThickness.fill(self._layerHeight)
+			else:
+				pathLayerThickness[pathLayerThickness <= 0.0] = 0.01
+			pathMoveType = moveType[newPathIdx].tolist()
+			if pathTypeIdx is not None:
+				pathType = [pathTypeNames[n] for n in pathTypeIdx[newPathIdx].tolist()]
+			else:
+				pathType = [self._pathType] * len(newPathIdx)
+			extruder = self._currentExtruder
+			for t, p, l in zip(pathMoveType, pathType, pathLayerThickness.tolist()):
+				self._paths.append({'type': _moveTypeNames[t], 'pathType': p, 'layerThickness': l, 'extruder': extruder})
+			self._pathStartPointIdx += startPointIdx.tolist()
+			self._pathStartRow += (newPathIdx + self._rowCount).tolist()
+			self._lastPathMoveType = pathMoveType[-1]
+			self._lastPathType = pathType[-1]
+
+		self._points.append(pos[isMove])
+		if zDrop is not None:
+			#A big drop in Z moves the previous point to Z 0.0, just like gcode._load does.
+			self._points = [numpy.concatenate(self._points)]
+			for idx in prevPointIdx[zDrop].tolist():
+				if idx >= 0:
+					self._points[0][idx,2] = 0.0
+		self._pointCount += int(isMove.sum())
+		self._pos = pos[-1].tolist()
+		self._posIdx = self._pointCount - 1
+		self._rowPointIdx.append(pointIdx)
+		self._rowExtrusion.append(eAmount * self._extrudeAmountMultiply)
+		self._rowIsMove.append(isMove)
+		self._rowCount += count
+
+	def _addPath(self, moveType, startPointIdx, layerThickness, rowIdx):
+		if layerThickness <= 0.0:
+			layerThickness = 0.01
+		if self._spiralize:
+			layerThickness = self._layerHeight
+		self._paths.append({'type': _moveTypeNames[moveType],
+			'pathType': self._pathType,
+			'layerThickness': layerThickness,
+			'extruder': self._currentExtruder})
+		self._pathStartPointIdx.append(startPointIdx)
+		self._pathStartRow.append(rowIdx)
+		self._lastPathMoveType = moveType
+		self._lastPathType = self._pathType
+
+	def _startLayer(self, points, posIsLastPoint):
+		self._points = [points]
+		self._pointCount = len(points)
+		self._posIdx = self._pointCount - 1 if posIsLastPoint else -1
+		self._pendingZDrop = None
+		self._paths = []
+		self._pathStartPointIdx = []
+		self._pathStartRow = []
+		self._rowPointIdx = []
+		self._rowExtrusion = []
+		self._rowIsMove = []
+		self._rowCount = 0
+
+	def _finishLayer(self):
+		"""
+		Build the points and extrusion arrays of all paths in the current layer and add the layer to the layerList.
+		"""
+		points = numpy.concatenate(self._points)
+		pathStartRow = numpy.array(self._pathStartRow, numpy.intp)
+		if self._rowCount > 0:
+			rowPointIdx = numpy.concatenate(self._rowPointIdx)
+			rowIsMove = numpy.concatenate(self._rowIsMove)
+			rowExtrusion = numpy.concatenate(self._rowExtrusion)[rowIsMove]
+			extrusionStart = numpy.concatenate(([0], numpy.cumsum(rowIsMove)))[pathStartRow]
+		else:
+			rowPointIdx = numpy.zeros(0, numpy.intp)
+			rowExtrusion = numpy.zeros(0, numpy.float64)
+			extrusionStart = numpy.zeros(len(pathStartRow), numpy.intp)
+		#Each path starts with the last point of the previous path and an extrusion of 0.0
+		pathNr = numpy.arange(len(pathStartRow))
+		pointIdx = numpy.insert(rowPointIdx, pathStartRow, self._pathStartPointIdx)
+		layerPoints = numpy.array(points[pointIdx], numpy.float32)
+		pointStart = (pathStartRow + pathNr).tolist() + [len(layerPoints)]
+		layerExtrusion = numpy.array(numpy.insert(rowExtrusion, extrusionStart, 0.0), numpy.float32)
+		extrusionStart = (extrusionStart + pathNr).tolist() + [len(layerExtrusion)]
+		for n, path in enumerate(self._paths):
+			path['points'] = layerPoints[pointStart[n]:pointStart[n+1]]
+			path['extrusion'] = layerExtrusion[extrusionStart[n]:extrusionStart[n+1]]
+		self._gcode.layerList.append(self._paths)
+		return points[self._pointCount - 1:]
+
+	def _nextLayer(self):
+		"""
+		Finish the current layer and start a new one, returns True when the loading is aborted.
+		"""
+		posIsLastPoint = self._posIdx == self._pointCount - 1
+		layerThickness = self._layerThickness
+		self._layerThickness = 0.0
+		lastPoint = self._finishLayer()
+		if self._gcode.progressCallback is not None:
+			if self._gcode.progressCallback(float(self._blockEnd) / float(self._gcode._fileSize)):
+				return True
+		self._startLayer(lastPoint.copy(), posIsLastPoint)
+		self._addPath(self._moveType, 0, layerThickness, 0)
+		return False
+
+#Commands that change the interpreter state for the rest of the file. Changes of the positioning mode and units are not
+#included, Cura only switches to relative positioning for a few moves and switches back before the next layer starts.
+_stateCodes = ('T0', 'T1', 'T2', 'T3', 'M82', 'M83', 'M221')
+
+class gcodeLayerIndex(object):
+	"""
+	Index of the byte offsets of the ';LAYER:' markers in GCode data, which allows decoding single layers on demand.
+	Building the index only searches for the markers, so layers far into a big print can be shown long before a full load is done.
+	The layer numbers match the gcode.layerList, layer 0 is the GCode before the first marker.
+	A layer is decoded with the vectorized engine, starting with the interpreter state at the end of the header and decoding
+	the two layers before it as well, so the position, extrusion and layer thickness are known when the layer starts.
+	"""
+	def __init__(self, data, maxCachedLayers = 200):
+		self._data = data
+		self._dataSize = len(data)
+		self._maxCachedLayers = maxCachedLayers
+		self._layerOffsets = []
+		self._layers = {}
+		self._headerState = None
+		self._lock = threading.Lock()
+		self._prefetchRange = None
+		self._prefetchThread = None
+
+		#Lines with commands that change the interpreter state, these are replayed before decoding a layer.
+		self._stateLines = []
+		offset = 0
+		rest = ''
+		data.seekStart()
+		while True:
+			block = data.read(1024 * 1024)
+			if len(block) < 1:
+				break
+			block = rest + block
+			n = block.rfind('\n')
+			rest = block[n+1:]
+			#The start of each block is the start of a line.
+			self._scanBlock('\n' + block[:n+1], offset - 1)
+			offset += n + 1
+		if len(rest) > 0:
+			self._scanBlock('\n' + rest + '\n', offset - 1)
+		self._stateLines.sort()
+		data.seekStart()
+
+	def _scanBlock(self, text, offset):
+		n = text.find('\n;LAYER:')
+		while n >= 0:
+			self._layerOffsets.append(offset + n + 1)
+			n = text.find('\n;LAYER:', n + 1)
+		#Only search for the first letter, which is a lot faster than searching for a line start followed by the code.
+		for code in 'TM':
+			n = text.find(code)
+			while n >= 0:
+				if text[n-1] == '\n':
+					line = text[n:text.find('\n', n)]
+					if line.startswith(_stateCodes):
+						self._stateLines.append((offset + n, line))
+				n = text.find(code, n + 1)
+
+	def getLayerCount(self):
+		return len(self._layerOffsets) + 1
+
+	def getLayer(self, layerNr):
+		"""
+		:return: The list of paths of a layer, decoded now if it is not decoded yet.
+		"""
+		self._lock.acquire()
+		try:
+			if layerNr not in self._layers:
+				self._decodeLayers(layerNr, layerNr)
+			return self._layers[layerNr]
+		finally:
+			self._lock.release()
+
+	def decodeLayers(self, first, last):
+		"""
+		Make sure all layers from first up to and including last are decoded, all missing layers are decoded in a single pass.
+		"""
+		first = max(first, 0)
+		last = min(last, self.getLayerCount() - 1)
+		self._lock.acquire()
+		try:
+			missing = filter(lambda n: n not in self._layers, xrange(first, last + 1))
+			if len(missing) > 0:
+				self._decodeLayers(missing[0], missing[-1])
+		finally:
+			self._lock.release()
+
+	def prefetch(self, first, last):
+		"""
+		Decode the layers from first up to and including last in a background thread, replacing any earlier prefetch request.
+		"""
+		self._lock.acquire()
+		self._prefetchRange = (first, last)
+		if self._prefetchThread is None:
+			self._prefetchThread = threading.Thread(target=self._prefetchRun)
+			self._prefetchThread.daemon = True
+			self._prefetchThread.start()
+		self._lock.release()
+
+	def _prefetchRun(self):
+		while True:
+			self._lock.acquire()
+			prefetchRange = self._prefetchRange
+			self._prefetchRange = None
+			if prefetchRange is None:
+				self._prefetchThread = None
+				self._lock.release()
+				return
+			self._lock.release()
+			self.decodeLayers(prefetchRange[0], prefetchRange[1])
+
+	def _getLayerEnd(self, layerNr):
+		if layerNr < len(self._layerOffsets):
+			return self._layerOffsets[layerNr]
+		return self._dataSize
+
+	def _decodeLayers(self, first, last):
+		if self._headerState is None:
+			loader = _vectorizedLoader(gcode())
+			loader.load(StringIO.StringIO(self._data.readRange(0, self._getLayerEnd(0))))
+			self._headerState = loader.getState()
+			self._layers[0] = loader._gcode.layerList[0]
+		if first < 1:
+			first = 1
+			if last < first:
+				return
+		start = self._layerOffsets[max(first - 3, 0)]
+		end = self._getLayerEnd(last)
+		loader = _vectorizedLoader(gcode())
+		loader.setState(self._headerState)
+		for offset, line in self._stateLines:
+			if offset >= start:
+				break
+			if offset >= self._layerOffsets[0]:
+				loader._processLine(line)
+		loader.load(StringIO.StringIO(self._data.readRange(start, end - start)), loader.getState())
+		#The first decoded layer is the part before the first marker, and the layers before the first one are only decoded for their state.
+		layerList = loader._gcode.layerList
+		for n in xrange(first, last + 1):
+			self._layers[n] = layerList[len(layerList) - 1 - (last - n)]
+		if len(self._layers) > self._maxCachedLayers:
+			center = (first + last) / 2
+			for n in sorted(self._layers.keys(), key=lambda n: -abs(n - center))[:len(self._layers) - self._maxCachedLayers]:
+				del self._layers[n]
+
+def compareLayerLists(layerListA, layerListB):
+	"""
+	Compare the layerLists of two gcode objects.
+	:return: A description of the first difference, or None when they are the same.
+	"""
+	if len(layerListA) != len(layerListB):
+		return 'layer count %d != %d' % (len(layerListA), len(layerListB))
+	for layerNr, (layerA, layerB) in enumerate(zip(layerListA, layerListB)):
+		if len(layerA) != len(layerB):
+			return 'layer %d: path count %d != %d' % (layerNr, len(layerA), len(layerB))
+		for pathNr, (pathA, pathB) in enumerate(zip(layerA, layerB)):
+			for key in pathA:
+				if key in ('points', 'extrusion'):
+					if not numpy.array_equal(pathA[key], pathB[key]):
+						return 'layer %d path %d: %s differ' % (layerNr, pathNr, key)
+				elif pathA[key] != pathB.get(key):
+					return 'layer %d path %d: %s %s != %s' % (layerNr, pathNr, key, pathA[key], pathB.get(key))
+	return None
+
 if __name__ == '__main__':
+	#Usage: gcodeInterpreter.py [--engine=Classic|Vectorized|--compare] <gcode files>
+	#With --compare each file is loaded with both engines, and the load times and the first difference are printed.
+	engine = None
+	filenames = sys.argv[1:]
+	if len(filenames) > 0 and filenames[0] == '--compare':
+		for filename in filenames[1:]:
+			layerLists = []
+			for engine in ['Classic', 'Vectorized']:
+				t = time.time()
+				g = gcode(engine)
+				g.load(filename)
+				print '%s %s: %.2fs' % (filename, engine, time.time() - t)
+				layerLists.append(g.layerList)
+			print '%s: %s' % (filename, compareLayerLists(layerLists[0], layerLists[1]) or 'same result')
+		sys.exit(0)
+	if len(filenames) > 0 and filenames[0].startswith('--engine='):
+		engine = filenames.pop(0)[len('--engine='):]
 	t = time.time()
-	for filename in sys.argv[1:]:
-		g = gcode()
+	for filename in filenames:
+		g = gcode(engine)
 		g.load(filename)
 	print time.time() - t
 
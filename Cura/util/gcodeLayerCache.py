@@ -0,0 +1,180 @@
+"""
+The GCode layer cache stores the layerList created by the gcodeInterpreter on disk, so a GCode file that has been viewed before
+does not need to be parsed again.
+Each cache entry is a directory in the cache path, named after a hash of the GCode content, the interpreter version and the
+profile settings that change the interpretation of the GCode. The points, extrusion and path information are stored as numpy
+arrays, which are memory mapped when the entry is loaded.
+The cache is used when the 'gcode_layer_cache' preference is enabled, and its size on disk is limited by the
+'gcode_layer_cache_size' preference. The least recently used entries are removed first.
+"""
+__copyright__ = "Copyright (C) 2013 David Braam - Released under terms of the AGPLv3 License"
+
+import os
+import types
+import shutil
+import hashlib
+import numpy
+import cPickle as pickle
+
+from Cura.util import profile
+
+_pathDType = numpy.dtype([('layer', numpy.int32), ('type', numpy.int32), ('pathType', numpy.int32), ('extruder', numpy.int32), ('layerThickness', numpy.float64), ('pointEnd', numpy.int64), ('extrusionEnd', numpy.int64)])
+
+def getCachePath():
+	return os.path.join(profile.getBasePath(), 'gcode_cache')
+
+def getCacheKey(data, interpreterVersion):
+	"""
+	Calculate the cache key of GCode data, which can be a filename, a list of lines or a BigDataStorage or DiskDataStorage object.
+	The key includes the interpreter version and the settings that the interpreter uses, so a change in those gives a new key.
+	"""
+	h = hashlib.sha1()
+	h.update('version:%s\n' % (interpreterVersion))
+	spiralize = profile.getProfileSetting('spiralize') == 'True'
+	h.update('spiralize:%s\n' % (spiralize))
+	if spiralize:
+		h.update('layer_height:%f\n' % (profile.getProfileSettingFloat('layer_height')))
+	for n in xrange(1, 4):
+		h.update('extruder_offset:%f,%f\n' % (profile.getMachineSettingFloat('extruder_offset_x%d' % (n)), profile.getMachineSettingFloat('extruder_offset_y%d' % (n))))
+	if type(data) in types.StringTypes and os.path.isfile(data):
+		f = open(data, 'rb')
+		while True:
+			block = f.read(1024 * 1024)
+			if len(block) < 1:
+				break
+			h.update(block)
+		f.close()
+	elif type(data) is list:
+		for line in data:
+			if type(line) is tuple:
+				line = line[0]
+			h.update(line.rstrip('\n'))
+			h.update('\n')
+	else:
+		data.seekStart()
+		while True:
+			block = data.read(1024 * 1024)
+			if len(block) < 1:
+				break
+			h.update(block)
+		data.seekStart()
+	return h.hexdigest()
+
+def load(key):
+	"""
+	Load the layerList stored with this key, the points and extrusion of the paths are views into memory mapped arrays.
+	:return: The layerList, or None when there is no valid cache entry for this key.
+	"""
+	path = os.path.join(getCachePath(), key)
+	if not os.path.isdir(path):
+		return None
+	try:
+		with open(os.path.join(path, 'info.pickle'), 'rb') as f:
+			info = pickle.load(f)
+		#Copy-on-write mapping, so the arrays behave as normal arrays without reading the whole file.
+		#Slicing a numpy.memmap is slow, so the paths get views of a plain ndarray on the same memory.
+		points = numpy.load(os.path.join(path, 'points.npy'), mmap_mode='c').view(numpy.ndarray)
+		extrusion = numpy.load(os.path.join(path, 'extrusion.npy'), mmap_mode='c').view(numpy.ndarray)
+		paths = numpy.load(os.path.join(path, 'paths.npy'))
+	except:
+		print "Failed to load GCode layer cache: %s" % (key)
+		return None
+
+	typeNames = info['typeNames']
+	pathTypeNames = info['pathTypeNames']
+	layerList = []
+	for n in xrange(0, info['layerCount']):
+		layerList.append([])
+	pointEnd = paths['pointEnd'].tolist()
+	pointStart = [0] + pointEnd[:-1]
+	extrusionEnd = paths['extrusionEnd'].tolist()
+	extrusionStart = [0] + extrusionEnd[:-1]
+	for n, layer, typeIdx, pathTypeIdx, extruder, layerThickness in zip(xrange(0, len(paths)), paths['layer'].tolist(), paths['type'].tolist(), paths['pathType'].tolist(), paths['extruder'].tolist(), paths['layerThickness'].tolist()):
+		layerList[layer].append({'type': typeNames[typeIdx],
+			'pathType': pathTypeNames[pathTypeIdx],
+			'layerThickness': layerThickness,
+			'extruder': extruder,
+			'points': points[pointStart[n]:pointEnd[n]],
+			'extrusion': extrusion[extrusionStart[n]:extrusionEnd[n]]})
+	try:
+		os.utime(path, None)
+	except:
+		pass
+	return layerList
+
+def save(key, layerList):
+	"""
+	Store a layerList under the given key. The entry is written in a temporary directory first, so an incomplete entry is never used.
+	"""
+	cachePath = getCachePath()
+	path = os.path.join(cachePath, key)
+	if os.path.isdir(path):
+		return
+	typeNames = []
+	pathTypeNames = []
+	pathCount = 0
+	for layer in layerList:
+		pathCount += len(layer)
+	paths = numpy.zeros(pathCount, _pathDType)
+	points = []
+	extrusion = []
+	pointEnd = 0
+	extrusionEnd = 0
+	n = 0
+	for layerNr, layer in enumerate(layerList):
+		for gcodePath in layer:
+			if gcodePath['type'] not in typeNames:
+				typeNames.append(gcodePath['type'])
+			if gcodePath['pathType'] not in pathTypeNames:
+				pathTypeNames.append(gcodePath['pathType'])
+			pointEnd += len(gcodePath['points'])
+			extrusionEnd += len(gcodePath['extrusion'])
+			paths[n] = (layerNr, typeNames.index(gcodePath['type']), pathTypeNames.index(gcodePath['pathType']), gcodePath['extruder'], gcodePath['layerThickness'], pointEnd, extrusionEnd)
+			points.append(gcodePath['points'])
+			extrusion.append(gcodePath['extrusion'])
+			n += 1
+	if len(points) > 0:
+		points = numpy.array(numpy.concatenate(points), numpy.float32).reshape((-1, 3))
+		extrusion = numpy.array(numpy.concatenate(extrusion), numpy.float32)
+	else:
+		points = numpy.zeros((0, 3), numpy.float32)
+		extrusion = numpy.zeros(0, numpy.float32)
+
+	tmpPath = path + '.tmp%d' % (os.getpid())
+	try:
+		if not os.path.isdir(tmpPath):
+			os.makedirs(tmpPath)
+		numpy.save(os.path.join(tmpPath, 'points.npy'), points)
+		numpy.save(os.path.join(tmpPath, 'extrusion.npy'), extrusion)
+		numpy.save(os.path.join(tmpPath, 'paths.npy'), paths)
+		with open(os.path.join(tmpPath, 'info.pickle'), 'wb') as f:
+			pickle.dump({'layerCount': len(layerList), 'typeNames': typeNames, 'pathTypeNames': pathTypeNames}, f, pickle.HIGHEST_PROTOCOL)
+		os.rename(tmpPath, path)
+	except:
+		print "Failed to save GCode layer cache: %s" % (key)
+		shutil.rmtree(tmpPath, True)
+		return
+	_removeOldEntries(cachePath)
+
+def _removeOldEntries(cachePath):
+	maxSize = profile.getPreferenceFloat('gcode_layer_cache_size') * 1024 * 1024
+	entries = []
+	totalSize = 0
+	for name in os.listdir(cachePath):
+		path = os.path.join(cachePath, name)
+		if not os.path.isdir(path) or '.tmp' in name:
+			continue
+		size = 0
+		for filename in os.listdir(path):
+			size += os.stat(os.path.join(path, filename)).st_size
+		entries.append((os.stat(path).st_mtime, size, path))
+		totalSize += size
+	entries.sort()
+	for mtime, size, path in entries:
+		if totalSize <= maxSize:
+			break
+		shutil.rmtree(path, True)
+		totalSize -= size
+
+def clear():
+	shutil.rmtree(getCachePath(), True)
@@ -10,15 +10,17 @@ import sys
 import time
 import math
 import re
+import bisect
+import operator
 import traceback
 import threading
 import platform
+import collections
+import json
 import Queue as queue
 
 import serial
-
-from Cura.avr_isp import stk500v2
-from Cura.avr_isp import ispBase
+import numpy
 
 from Cura.util import profile
 from Cura.util import version
@@ -72,13 +74,137 @@ def baudrateList():
 			ret.insert(0, prev)
 	return ret
 
+def serialDeviceId(port):
+	"""
+	:return: the USB VID:PID and serial number of the device on a serial port, None if it is not known.
+	"""
+	try:
+		from serial.tools import list_ports
+		for info in list_ports.comports():
+			if info[0] == port:
+				deviceId = ' '.join(filter(lambda s: s.startswith('VID:PID') or s.startswith('SER') or s.startswith('SNR'), info[2].split()))
+				if 'VID:PID' in deviceId:
+					return deviceId
+	except:
+		pass
+	return None
+
+def getSerialCachePath():
+	return os.path.join(profile.getBasePath(), 'serial_ports.json')
+
+def loadSerialCache():
+	"""
+	:return: the baudrates that worked for USB serial devices, keyed by serialDeviceId.
+	"""
+	try:
+		with open(getSerialCachePath(), 'r') as f:
+			return json.load(f)
+	except:
+		return {}
+
+def saveSerialCache(cache):
+	try:
+		with open(getSerialCachePath(), 'w') as f:
+			json.dump(cache, f)
+	except:
+		pass
+
+def probeSerial(port, baudrates, stop, log):
+	"""
+	Look for a printer on a serial port. Opening the port resets most boards, so the firmware gets time to
+	start, then M105 is sent at each baudrate until two temperature reports come back. Gives up when stop is set.
+	:return: (baudrate, open serial port) or None.
+	"""
+	try:
+		log("Connecting to: %s with baudrate: %s (auto)" % (port, baudrates[0]))
+		serialPort = serial.Serial(str(port), baudrates[0], timeout=0.5, writeTimeout=10000)
+	except:
+		log("Unexpected error while connecting to serial port: %s %s" % (port, getExceptionString()))
+		return None
+	try:
+		bootEnd = time.time() + 2.5
+		while time.time() < bootEnd and not stop.is_set():
+			if 'start' in serialPort.readline():
+				break
+		for baudrate in baudrates:
+			if stop.is_set():
+				break
+			log("Trying baudrate: %d on %s" % (baudrate, port))
+			serialPort.baudrate = baudrate
+			serialPort.flushInput()
+			serialPort.write('\nM105\n')
+			tempReports = 0
+			timeout = time.time() + 2
+			while time.time() < timeout and not stop.is_set():
+				line = serialPort.readline()
+				if 'T:' in line:
+					tempReports += 1
+					if tempReports == 2:
+						return (baudrate, serialPort)
+				if line == '' or 'T:' in line:
+					serialPort.write('M105\n')
+	except:
+		log("Unexpected error while probing serial port: %s %s" % (port, getExceptionString()))
+	serialPort.close()
+	return None
+
+def detectSerial(portBaudrates, log, maxThreads = 8):
+	"""
+	Probe serial ports for a printer at the same time, with a thread per port and at most maxThreads at once.
+	The probing stops as soon as a printer answered.
+	:param portBaudrates: list of (port, list of baudrates to try in this order).
+	:return: (port, baudrate, open serial port) of the printer, or None.
+	"""
+	ports = queue.Queue()
+	for item in portBaudrates:
+		ports.put(item)
+	found = []
+	foundLock = threading.Lock()
+	stop = threading.Event()
+
+	def probeThread():
+		while not stop.is_set():
+			try:
+				port, baudrates = ports.get(False)
+			except queue.Empty:
+				return
+			result = probeSerial(port, baudrates, stop, log)
+			if result is not None:
+				with foundLock:
+					if len(found) == 0:
+						found.append((port, result[0], result[1]))
+						stop.set()
+					else:
+						result[1].close()
+
+	threads = []
+	for i in xrange(0, min(maxThreads, len(portBaudrates))):
+		thread = threading.Thread(target=probeThread)
+		thread.daemon = True
+		thread.start()
+		threads.append(thread)
+	for thread in threads:
+		thread.join()
+	if len(found) < 1:
+		return None
+	return found[0]
+
+def gcodeChecksum(line):
+	"""
+	:return: the checksum of a gcode line, the xor of all its characters.
+	"""
+	if isinstance(line, unicode):
+		line = line.encode('ascii', 'replace')
+	return reduce(operator.xor, bytearray(line), 0)
+
 class VirtualPrinter():
 	"""
 	A virtual printer class used for debugging. Acts as a serial.Serial class, but without connecting to any port.
 	Only available when running the development version of Cura.
 	"""
-	def __init__(self):
+	def __init__(self, readDelay=0.001):
 		self.readList = ['start\n', 'Marlin: Virtual Marlin!\n', '\x80\n']
+		self.readDelay = readDelay
 		self.temp = 0.0
 		self.targetTemp = 0.0
 		self.lastTempAt = time.time()
@@ -121,7 +247,8 @@ class VirtualPrinter():
 				return ''
 			if self.readList is None:
 				return ''
-		time.sleep(0.001)
+		if self.readDelay:
+			time.sleep(self.readDelay)
 		#print "Recv: %s" % (self.readList[0].rstrip())
 		return self.readList.pop(0)
 	
@@ -167,6 +294,22 @@ class MachineCom(object):
 	STATE_CLOSED = 8
 	STATE_ERROR = 9
 	STATE_CLOSED_WITH_ERROR = 10
+
+	#Lines of a print that need more than a write, see _compileGCode.
+	LINE_PAUSE = 1
+	LINE_TEMPERATURE = 2
+
+	#Z lift in mm before the first move of a print that is resumed at a layer.
+	RESUME_LIFT = 2.0
+	#Commands that set up the printer for the lines after them, replayed when a print is resumed at a layer.
+	RESUME_STATE_COMMANDS = {
+		'M104': 'hotend', 'M109': 'hotend', 'M140': 'bed', 'M190': 'bed',
+		'M106': 'fan', 'M107': 'fan', 'M82': 'extrusion', 'M83': 'extrusion',
+		'G90': 'positioning', 'G91': 'positioning',
+	}
+
+	#Seconds the virtual printer waits before each reply.
+	_virtualReadDelay = 0.001
 	
 	def __init__(self, port = None, baudrate = None, callbackObject = None):
 		if port is None:
@@ -184,9 +327,7 @@ class MachineCom(object):
 		self._callback = callbackObject
 		self._state = self.STATE_NONE
 		self._serial = None
-		self._serialDetectList = []
 		self._baudrateDetectList = baudrateList()
-		self._baudrateDetectRetry = 0
 		self._extruderCount = int(profile.getMachineSetting('extruder_amount'))
 		self._temperatureRequestExtruder = 0
 		self._temp = [0] * self._extruderCount
@@ -194,14 +335,22 @@ class MachineCom(object):
 		self._bedTemp = 0
 		self._bedTargetTemp = 0
 		self._gcodeList = None
+		self._gcodePackets = None
+		self._gcodeSpecial = None
+		self._gcodeTime = None
+		self._layerStarts = []
+		self._layerState = []
+		self._resumeAt = None
+		self._resumeLayer = 0
 		self._gcodePos = 0
 		self._commandQueue = queue.Queue()
-		self._logQueue = queue.Queue(256)
+		self._logQueue = collections.deque(maxlen=256)
 		self._feedRateModifier = {}
 		self._currentZ = -1
 		self._heatupWaitStartTime = 0
 		self._heatupWaitTimeLost = 0.0
 		self._printStartTime100 = None
+		self._printStartLine = 100
 		
 		self.thread = threading.Thread(target=self._monitor)
 		self.thread.daemon = True
@@ -276,12 +425,28 @@ class MachineCom(object):
 		return time.time() - self._printStartTime
 
 	def getPrintTimeRemainingEstimate(self):
-		if self._printStartTime100 is None or self.getPrintPos() < 200:
+		if self._printStartTime100 is None or self.getPrintPos() < self._printStartLine + 100:
 			return None
 		printTime = (time.time() - self._printStartTime100) / 60
-		printTimeTotal = printTime * (len(self._gcodeList) - 100) / (self.getPrintPos() - 100)
-		printTimeLeft = printTimeTotal - printTime
-		return printTimeLeft
+		estimateDone = (self._gcodeTime[self.getPrintPos() - 1] - self._gcodeTime[self._printStartLine - 1]) / 60
+		if estimateDone <= 0:
+			printTimeTotal = printTime * (len(self._gcodePackets) - self._printStartLine) / (self.getPrintPos() - self._printStartLine)
+			return printTimeTotal - printTime
+		#Scale the estimate of the moves still to do by how far off it was for the moves done since the start.
+		estimateLeft = (self._gcodeTime[-1] - self._gcodeTime[self.getPrintPos() - 1]) / 60
+		return estimateLeft * printTime / estimateDone
+
+	def getLayerCount(self):
+		return len(self._layerStarts)
+
+	def getLayer(self):
+		"""
+		:return: the layer of the last line sent, counting from 0. -1 before the first layer.
+		"""
+		return bisect.bisect_right(self._layerStarts, self._gcodePos - 1) - 1
+
+	def getLayerZ(self, layer):
+		return self._layerState[layer][0]
 	
 	def getTemp(self):
 		return self._temp
@@ -290,69 +455,44 @@ class MachineCom(object):
 		return self._bedTemp
 	
 	def getLog(self):
-		ret = []
-		while not self._logQueue.empty():
-			ret.append(self._logQueue.get())
-		for line in ret:
-			self._logQueue.put(line, False)
-		return ret
+		return list(self._logQueue)
 	
 	def _monitor(self):
 		#Open the serial port.
-		if self._port == 'AUTO':
-			self._changeState(self.STATE_DETECT_SERIAL)
-			programmer = stk500v2.Stk500v2()
-			for p in serialList(True):
-				try:
-					self._log("Connecting to: %s (programmer)" % (p))
-					programmer.connect(p)
-					self._serial = programmer.leaveISP()
-					profile.putMachineSetting('serial_port_auto', p)
-					break
-				except ispBase.IspError as (e):
-					self._log("Error while connecting to %s: %s" % (p, str(e)))
-					pass
-				except:
-					self._log("Unexpected error while connecting to serial port: %s %s" % (p, getExceptionString()))
-				programmer.close()
-			if self._serial is None:
-				self._log("Serial port list: %s" % (str(serialList(True))))
-				self._serialDetectList = serialList(True)
-		elif self._port == 'VIRTUAL':
+		if self._port == 'VIRTUAL':
 			self._changeState(self.STATE_OPEN_SERIAL)
-			self._serial = VirtualPrinter()
+			self._serial = VirtualPrinter(self._virtualReadDelay)
+		elif self._port == 'AUTO' or self._baudrate == 0:
+			if self._port == 'AUTO':
+				self._changeState(self.STATE_DETECT_SERIAL)
+				self._serial = self._detectSerial(serialList(True))
+			else:
+				self._changeState(self.STATE_DETECT_BAUDRATE)
+				self._serial = self._detectSerial([self._port])
 		else:
 			self._changeState(self.STATE_OPEN_SERIAL)
 			try:
-				if self._baudrate == 0:
-					self._log("Connecting to: %s with baudrate: 115200 (fallback)" % (self._port))
-					self._serial = serial.Serial(str(self._port), 115200, timeout=3, writeTimeout=10000)
-				else:
-					self._log("Connecting to: %s with baudrate: %s (configured)" % (self._port, self._baudrate))
-					self._serial = serial.Serial(str(self._port), self._baudrate, timeout=5, writeTimeout=10000)
+				self._log("Connecting to: %s with baudrate: %s (configured)" % (self._port, self._baudrate))
+				self._serial = serial.Serial(str(self._port), self._baudrate, timeout=5, writeTimeout=10000)
 			except:
 				self._log("Unexpected error while connecting to serial port: %s %s" % (self._port, getExceptionString()))
 		if self._serial is None:
-			baudrate = self._baudrate
-			if baudrate == 0:
-				baudrate = self._baudrateDetectList.pop(0)
-			if len(self._serialDetectList) < 1:
-				self._log("Found no ports to try for auto detection")
+			if self._port == 'AUTO' or self._port == 'VIRTUAL':
 				self._errorValue = 'Failed to autodetect serial port.'
-				self._changeState(self.STATE_ERROR)
-				return
-			port = self._serialDetectList.pop(0)
-			self._log("Connecting to: %s with baudrate: %s (auto)" % (port, baudrate))
-			try:
-				self._serial = serial.Serial(port, baudrate, timeout=3, writeTimeout=10000)
-			except:
-				pass
-		else:
-			self._log("Connected to: %s, starting monitor" % (self._serial))
-			if self._baudrate == 0:
-				self._changeState(self.STATE_DETECT_BAUDRATE)
+			elif self._baudrate == 0:
+				self._errorValue = 'No suitable baudrate found.'
 			else:
-				self._changeState(self.STATE_CONNECTING)
+				self._errorValue = 'Failed to open serial port.'
+			self._changeState(self.STATE_ERROR)
+			return
+		self._log("Connected to: %s, starting monitor" % (self._serial))
+		if self._state == self.STATE_DETECT_SERIAL or self._state == self.STATE_DETECT_BAUDRATE:
+			#The printer answered the detection already.
+			self._sendCommand("M999")
+			self._serial.timeout = 2
+			self._changeState(self.STATE_OPERATIONAL)
+		else:
+			self._changeState(self.STATE_CONNECTING)
 
 		#Start monitoring the serial port.
 		if self._state == self.STATE_CONNECTING:
@@ -398,58 +538,7 @@ class MachineCom(object):
 			elif line.strip() != '' and line.strip() != 'ok' and not line.startswith('Resend:') and not line.startswith('Error:checksum mismatch') and not line.startswith('Error:Line Number is not Last Line Number+1') and line != 'echo:Unknown command:""\n' and self.isOperational():
 				self._callback.mcMessage(line)
 
-			if self._state == self.STATE_DETECT_BAUDRATE or self._state == self.STATE_DETECT_SERIAL:
-				if line == '' or time.time() > timeout:
-					if len(self._baudrateDetectList) < 1:
-						self.close()
-						self._errorValue = "No more baudrates to test, and no suitable baudrate found."
-						self._changeState(self.STATE_ERROR)
-					elif self._baudrateDetectRetry > 0:
-						self._baudrateDetectRetry -= 1
-						self._serial.write('\n')
-						self._log("Baudrate test retry: %d" % (self._baudrateDetectRetry))
-						self._sendCommand("M105")
-						self._testingBaudrate = True
-					else:
-						if self._state == self.STATE_DETECT_SERIAL:
-							if len(self._serialDetectList) == 0:
-								if len(self._baudrateDetectList) == 0:
-									self._log("Tried all serial ports and baudrates, but still not printer found that responds to M105.")
-									self._errorValue = 'Failed to autodetect serial port.'
-									self._changeState(self.STATE_ERROR)
-									return
-								else:
-									self._serialDetectList = serialList(True)
-									baudrate = self._baudrateDetectList.pop(0)
-							self._serial.close()
-							self._serial = serial.Serial(self._serialDetectList.pop(0), baudrate, timeout=2.5, writeTimeout=10000)
-						else:
-							baudrate = self._baudrateDetectList.pop(0)
-						try:
-							self._setBaudrate(baudrate)
-							self._serial.timeout = 0.5
-							self._log("Trying baudrate: %d" % (baudrate))
-							self._baudrateDetectRetry = 5
-							self._baudrateDetectTestOk = 0
-							timeout = time.time() + 5
-							self._serial.write('\n')
-							self._sendCommand("M105")
-							self._testingBaudrate = True
-						except:
-							self._log("Unexpected error while setting baudrate: %d %s" % (baudrate, getExceptionString()))
-				elif 'T:' in line:
-					self._baudrateDetectTestOk += 1
-					if self._baudrateDetectTestOk < 10:
-						self._log("Baudrate test ok: %d" % (self._baudrateDetectTestOk))
-						self._sendCommand("M105")
-					else:
-						self._sendCommand("M999")
-						self._serial.timeout = 2
-						profile.putMachineSetting('serial_baud_auto', self._serial.baudrate)
-						self._changeState(self.STATE_OPERATIONAL)
-				else:
-					self._testingBaudrate = False
-			elif self._state == self.STATE_CONNECTING:
+			if self._state == self.STATE_CONNECTING:
 				if line == '' or 'wait' in line:        # 'wait' needed for Repetier (kind of watchdog)
 					self._sendCommand("M105")
 				elif 'ok' in line:
@@ -491,23 +580,44 @@ class MachineCom(object):
 							self._gcodePos = int(line.split()[1])
 		self._log("Connection closed, closing down monitor")
 
-	def _setBaudrate(self, baudrate):
-		try:
-			self._serial.baudrate = baudrate
-		except:
-			print getExceptionString()
+	def _detectSerial(self, ports):
+		"""
+		Find the printer on the ports, they are probed at the same time, see detectSerial. A baudrate
+		that worked before for the USB device on a port is tried first.
+		:return: the open serial port, or None if no printer answered.
+		"""
+		cache = loadSerialCache()
+		portBaudrates = []
+		for port in ports:
+			baudrates = list(self._baudrateDetectList)
+			if self._baudrate != 0:
+				baudrates = [self._baudrate]
+			else:
+				deviceId = serialDeviceId(port)
+				if deviceId in cache and cache[deviceId] in baudrates:
+					baudrates.remove(cache[deviceId])
+					baudrates.insert(0, cache[deviceId])
+			portBaudrates.append((port, baudrates))
+		if len(portBaudrates) < 1:
+			self._log("Found no ports to try for auto detection")
+			return None
+		result = detectSerial(portBaudrates, self._log)
+		if result is None:
+			self._log("Tried all serial ports and baudrates, but still not printer found that responds to M105.")
+			return None
+		port, baudrate, serialPort = result
+		profile.putMachineSetting('serial_port_auto', port)
+		profile.putMachineSetting('serial_baud_auto', baudrate)
+		deviceId = serialDeviceId(port)
+		if deviceId is not None and cache.get(deviceId) != baudrate:
+			cache[deviceId] = baudrate
+			saveSerialCache(cache)
+		return serialPort
 
 	def _log(self, message):
 		self._callback.mcLog(message)
-		try:
-			self._logQueue.put(message, False)
-		except:
-			#If the log queue is full, remove the first message and append the new message again
-			self._logQueue.get()
-			try:
-				self._logQueue.put(message, False)
-			except:
-				pass
+		#The log queue keeps the last messages, appending to a full queue drops the first one.
+		self._logQueue.append(message)
 
 	def _readline(self):
 		if self._serial is None:
@@ -555,6 +665,11 @@ class MachineCom(object):
 				self._bedTargetTemp = float(re.search('S([0-9]+)', cmd).group(1))
 			except:
 				pass
+		self._writeCommand(cmd)
+
+	def _writeCommand(self, cmd):
+		if self._serial is None:
+			return
 		self._log('Send: %s' % (cmd))
 		try:
 			self._serial.write(cmd + '\n')
@@ -572,31 +687,166 @@ class MachineCom(object):
 			self._errorValue = getExceptionString()
 			self.close(True)
 	
+	def _compileGCode(self, gcodeList):
+		"""
+		Prepare the lines of a print once, so sending a line on each 'ok' is a table lookup and a write.
+		_gcodePackets gets the line with line number and checksum for each line. _gcodeSpecial maps the
+		few lines that need more to (section, z, kind): the section that starts at the line, the Z it moves
+		to and LINE_PAUSE or LINE_TEMPERATURE. Each of them can be None.
+
+		It also builds the index of the print. _gcodeTime has the estimated print time in seconds up to and
+		including each line, from the length and feedrate of the moves. _layerStarts has the line each layer
+		starts at: the first Z move after the last extrusion of the layer below. _layerState has the Z of the
+		layer, the E and feedrate (mm/s) before its first line and the last of each of RESUME_STATE_COMMANDS
+		seen before it, so _skipToLayer can set up the printer as the skipped lines would have.
+
+		Extruding moves that also move Z do not start a layer. The spiral of a spiralized print is one
+		layer, so such a print can only be resumed at one of the solid layers below the spiral.
+		"""
+		packets = []
+		special = {}
+		moveTimes = numpy.zeros(len(gcodeList), numpy.float64)
+		layerStarts = []
+		layerState = []
+		x, y, z, e = 0.0, 0.0, 0.0, 0.0
+		absolute = True
+		absoluteE = True
+		feedrate = 50.0
+		layerZ = None
+		zStart = None
+		state = {}
+		for n in xrange(0, len(gcodeList)):
+			line = gcodeList[n]
+			section = None
+			if type(line) is tuple:
+				section = line[1]
+				line = line[0]
+			newZ = None
+			kind = None
+			if line == 'M0' or line == 'M1':
+				kind = self.LINE_PAUSE
+				line = 'M105'	#Don't send the M0 or M1 to the machine, as M0 and M1 are handled as an LCD menu pause.
+			elif 'M104' in line or 'M109' in line or 'M140' in line or 'M190' in line:
+				kind = self.LINE_TEMPERATURE
+			elif line[:3] == 'G0 ' or line[:3] == 'G1 ':
+				lineFeedrate = feedrate
+				mx, my, mz, me = x, y, z, e
+				for param in line[3:].split():
+					try:
+						value = float(param[1:])
+					except ValueError:
+						self._log("Bad value in line %d: %s" % (n, line))
+						continue
+					axis = param[0]
+					if axis == 'X':
+						mx = value if absolute else x + value
+					elif axis == 'Y':
+						my = value if absolute else y + value
+					elif axis == 'Z':
+						mz = value if absolute else z + value
+						newZ = value
+					elif axis == 'E':
+						me = value if absoluteE else e + value
+					elif axis == 'F' and value > 0:
+						feedrate = value / 60.0
+				distance = math.sqrt((mx - x) ** 2 + (my - y) ** 2 + (mz - z) ** 2)
+				if distance == 0:
+					distance = abs(me - e)
+				moveTimes[n] = distance / feedrate
+				if mz != z and zStart is None:
+					zStart = (n, e, lineFeedrate, state.copy())
+				if me > e and (mx != x or my != y):
+					if zStart is not None and mz == z and (layerZ is None or mz > layerZ + 0.001):
+						layerZ = mz
+						layerStarts.append(zStart[0])
+						layerState.append((mz, zStart[1], zStart[2], zStart[3]))
+					zStart = None
+				x, y, z, e = mx, my, mz, me
+			elif line[:3] == 'G92' or line[:3] == 'G28':
+				params = line.split()[1:]
+				if len(params) == 0:
+					params = ['X0', 'Y0', 'Z0', 'E0']
+				for param in params:
+					try:
+						value = float(param[1:] or 0)
+					except ValueError:
+						continue
+					if param[0] == 'X':
+						x = value
+					elif param[0] == 'Y':
+						y = value
+					elif param[0] == 'Z':
+						z = value
+					elif param[0] == 'E' and line[:3] == 'G92':
+						e = value
+			elif line[:2] == 'G4':
+				for param in line.split()[1:]:
+					try:
+						if param[0] == 'P':
+							moveTimes[n] = float(param[1:]) / 1000.0
+						elif param[0] == 'S':
+							moveTimes[n] = float(param[1:])
+					except ValueError:
+						pass
+			elif line == 'G90':
+				absolute = True
+				absoluteE = True
+			elif line == 'G91':
+				absolute = False
+				absoluteE = False
+			elif line == 'M82':
+				absoluteE = True
+			elif line == 'M83':
+				absoluteE = False
+			command = line.split(' ', 1)[0]
+			if command in self.RESUME_STATE_COMMANDS:
+				key = self.RESUME_STATE_COMMANDS[command]
+				for param in line.split()[1:]:
+					if param[0] == 'T':
+						key += param
+				state[key] = line
+			line = "N%d%s" % (n, line)
+			packets.append("%s*%d" % (line, gcodeChecksum(line)))
+			if section is not None or newZ is not None or kind is not None:
+				special[n] = (section, newZ, kind)
+		self._gcodePackets = packets
+		self._gcodeSpecial = special
+		self._gcodeTime = numpy.cumsum(moveTimes)
+		self._layerStarts = layerStarts
+		self._layerState = layerState
+
 	def _sendNext(self):
-		if self._gcodePos >= len(self._gcodeList):
+		if self._gcodePos >= len(self._gcodePackets):
 			self._changeState(self.STATE_OPERATIONAL)
 			return
-		if self._gcodePos == 100:
+		if self._gcodePos == self._resumeAt:
+			self._skipToLayer()
+			return
+		if self._gcodePos == self._printStartLine:
 			self._printStartTime100 = time.time()
-		line = self._gcodeList[self._gcodePos]
-		if type(line) is tuple:
-			self._printSection = line[1]
-			line = line[0]
-		try:
-			if line == 'M0' or line == 'M1':
+		packet = self._gcodePackets[self._gcodePos]
+		kind = None
+		if self._gcodePos in self._gcodeSpecial:
+			section, z, kind = self._gcodeSpecial[self._gcodePos]
+			if section is not None:
+				self._printSection = section
+			if kind == self.LINE_PAUSE:
 				self.setPause(True)
-				line = 'M105'	#Don't send the M0 or M1 to the machine, as M0 and M1 are handled as an LCD menu pause.
-			if self._printSection in self._feedRateModifier:
+			if z is not None and self._currentZ != z:
+				self._currentZ = z
+				self._callback.mcZChange(z)
+		if self._printSection in self._feedRateModifier:
+			try:
+				line = packet[len(str(self._gcodePos)) + 1:packet.rindex('*')]
 				line = re.sub('F([0-9]*)', lambda m: 'F' + str(int(int(m.group(1)) * self._feedRateModifier[self._printSection])), line)
-			if ('G0' in line or 'G1' in line) and 'Z' in line:
-				z = float(re.search('Z([0-9\.]*)', line).group(1))
-				if self._currentZ != z:
-					self._currentZ = z
-					self._callback.mcZChange(z)
-		except:
-			self._log("Unexpected error: %s" % (getExceptionString()))
-		checksum = reduce(lambda x,y:x^y, map(ord, "N%d%s" % (self._gcodePos, line)))
-		self._sendCommand("N%d%s*%d" % (self._gcodePos, line, checksum))
+				line = "N%d%s" % (self._gcodePos, line)
+				packet = "%s*%d" % (line, gcodeChecksum(line))
+			except:
+				self._log("Unexpected error: %s" % (getExceptionString()))
+		if kind == self.LINE_TEMPERATURE:
+			self._sendCommand(packet)
+		else:
+			self._writeCommand(packet)
 		self._gcodePos += 1
 		self._callback.mcProgress(self._gcodePos)
 	
@@ -607,12 +857,59 @@ class MachineCom(object):
 		elif self.isOperational():
 			self._sendCommand(cmd)
 	
-	def printGCode(self, gcodeList):
+	def _skipToLayer(self):
+		"""
+		The start gcode before the first layer has been sent, continue with the layer to resume at. The
+		temperatures, fan and modes the skipped lines set are restored, waiting for the temperatures. The
+		head is lifted above the layer first, and the printer is told the line number we continue with.
+		"""
+		start = self._layerStarts[self._resumeLayer]
+		z, e, feedrate, state = self._layerState[self._resumeLayer]
+		self._log("Resuming print at layer %d, line %d" % (self._resumeLayer, start))
+		cmds = []
+		for key in sorted(state.keys()):
+			if key.startswith('hotend') or key.startswith('bed'):
+				cmd, sep, params = state[key].partition(' ')
+				cmds.append({'M104': 'M109', 'M140': 'M190'}.get(cmd, cmd) + sep + params)
+		if 'fan' in state:
+			cmds.append(state['fan'])
+		cmds += ['G90', 'G92 E%.5f' % (e), 'G0 Z%.3f F600' % (z + self.RESUME_LIFT), 'G0 F%d' % (feedrate * 60)]
+		for key in ['positioning', 'extrusion']:
+			if key in state:
+				cmds.append(state[key])
+		for cmd in cmds:
+			self._commandQueue.put(cmd)
+		line = "N%dM110" % (start - 1)
+		self._commandQueue.put("%s*%d" % (line, gcodeChecksum(line)))
+		for n in sorted(self._gcodeSpecial.keys()):
+			if n >= start:
+				break
+			if self._gcodeSpecial[n][0] is not None:
+				self._printSection = self._gcodeSpecial[n][0]
+		self._gcodePos = start
+		self._printStartTime100 = None
+		self._printStartLine = start + 100
+		self._sendCommand(self._commandQueue.get())
+
+	def printGCode(self, gcodeList, startLayer = 0):
+		"""
+		Print a list of gcode lines. With a startLayer the lines before the first layer are sent, then the
+		print continues with that layer, see _skipToLayer.
+		"""
 		if not self.isOperational() or self.isPrinting():
 			return
 		self._gcodeList = gcodeList
+		self._compileGCode(gcodeList)
+		self._resumeAt = None
+		if startLayer > 0:
+			if startLayer >= len(self._layerStarts):
+				self._log("Cannot resume at layer %d, the print has %d layers" % (startLayer, len(self._layerStarts)))
+				return
+			self._resumeAt = self._layerStarts[0]
+			self._resumeLayer = startLayer
 		self._gcodePos = 0
 		self._printStartTime100 = None
+		self._printStartLine = 100
 		self._printSection = 'CUSTOM'
 		self._changeState(self.STATE_PRINTING)
 		self._printStartTime = time.time()
@@ -637,3 +934,41 @@ class MachineCom(object):
 def getExceptionString():
 	locationInfo = traceback.extract_tb(sys.exc_info()[2])[0]
 	return "%s: '%s' @ %s:%s:%d" % (str(sys.exc_info()[0].__name__), str(sys.exc_info()[1]), os.path.basename(locationInfo[0]), locationInfo[2], locationInfo[1])
+
+if __name__ == '__main__':
+	#Benchmark of the print loop against the virtual printer, without its reply delay.
+	# Usage: python -m Cura.util.machineCom [file.gcode|number of lines]
+	arg = '100000'
+	if len(sys.argv) > 1:
+		arg = sys.argv[1]
+	if os.path.isfile(arg):
+		gcodeList = ['M110']
+		for line in open(arg, 'r'):
+			if ';' in line:
+				line = line[:line.index(';')]
+			line = line.strip()
+			if len(line) > 0:
+				gcodeList.append(line)
+	else:
+		gcodeList = ['M110', ('G1 Z0.2 F1200', 'CUSTOM')]
+		for n in xrange(0, int(arg)):
+			if n % 1000 == 0:
+				gcodeList.append(('G0 X10 Y10 Z%.1f F9000' % (0.2 + n / 1000 * 0.1), 'SKIRT'))
+			else:
+				gcodeList.append('G1 X%.3f Y%.3f E%.5f' % (10 + n % 100, 10 + n % 77, n * 0.01))
+
+	MachineCom._virtualReadDelay = 0
+	comm = MachineCom('VIRTUAL', 250000)
+	while not comm.isOperational():
+		if comm.isClosedOrError():
+			print comm.getStateString()
+			sys.exit(1)
+		time.sleep(0.1)
+
+	t = time.time()
+	comm.printGCode(gcodeList)
+	compileTime = time.time() - t
+	while comm.isPrinting():
+		time.sleep(0.05)
+	printTime = time.time() - t
+	print "%d lines, start %.2f s, print %.2f s, %.0f lines/sec" % (len(gcodeList), compileTime, printTime, len(gcodeList) / printTime)
@@ -16,9 +16,13 @@ import sys
 import os
 import struct
 import time
+import numpy
 
 from Cura.util import printableObject
 
+#A face in a binary STL: the normal, the 3 vertexes and 2 attribute bytes, 50 bytes without padding.
+_binaryFaceType = numpy.dtype([('normal', '<f4', (3,)), ('vertexes', '<f4', (9,)), ('attribute', '<u2')])
+
 def _loadAscii(m, f):
 	cnt = 0
 	for lines in f:
@@ -42,10 +46,12 @@ def _loadBinary(m, f):
 	#Skip the header
 	f.read(80-5)
 	faceCount = struct.unpack('<I', f.read(4))[0]
+	#Read all faces at once, a truncated file gives less faces than the header says.
+	data = numpy.fromfile(f, _binaryFaceType, faceCount)
+	faceCount = len(data)
 	m._prepareFaceCount(faceCount)
-	for idx in xrange(0, faceCount):
-		data = struct.unpack("<ffffffffffffH", f.read(50))
-		m._addFace(data[3], data[4], data[5], data[6], data[7], data[8], data[9], data[10], data[11])
+	m.vertexes.reshape(faceCount, 9)[:] = data['vertexes']
+	m.vertexCount = faceCount * 3
 
 def loadScene(filename):
 	obj = printableObject.printableObject(filename)
@@ -91,3 +97,32 @@ def saveSceneStream(stream, objects):
 				stream.write(struct.pack("<fff", v2[0], v2[1], v2[2]))
 				stream.write(struct.pack("<fff", v3[0], v3[1], v3[2]))
 				stream.write(struct.pack("<H", 0))
+
+if __name__ == '__main__':
+	#Benchmark of the binary loader, compared with just reading the file.
+	# Usage: python -m Cura.util.meshLoaders.stl [number of faces ...]
+	import tempfile
+	sizes = [10000, 100000, 1000000, 2000000]
+	if len(sys.argv) > 1:
+		sizes = map(int, sys.argv[1:])
+	for faceCount in sizes:
+		data = numpy.zeros(faceCount, _binaryFaceType)
+		data['vertexes'] = numpy.random.random((faceCount, 9)) * 100
+		fd, filename = tempfile.mkstemp(suffix='.stl')
+		with os.fdopen(fd, 'wb') as f:
+			f.write('CURA BENCHMARK'.ljust(80, '\000'))
+			f.write(struct.pack('<I', faceCount))
+			data.tofile(f)
+		t = time.time()
+		with open(filename, 'rb') as f:
+			f.read()
+		readTime = time.time() - t
+		t = time.time()
+		m = printableObject.printableObject(filename)._addMesh()
+		with open(filename, 'rb') as f:
+			f.read(5)
+			_loadBinary(m, f)
+		loadTime = time.time() - t
+		os.remove(filename)
+		assert (m.vertexes.reshape(faceCount, 9) == data['vertexes']).all()
+		print "%8d faces, %6.1f MB: load %.3f s, read %.3f s" % (faceCount, faceCount * 50 / 1e6, loadTime, readTime)
@@ -172,6 +172,24 @@ class printerConnectionBase(object):
 		"""
 		pass
 
+	def hasResume(self):
+		"""
+		Return True if this driver can resume an interrupted print
+		"""
+		return False
+
+	def canResume(self):
+		"""
+		Return True if the loaded file has an interrupted print to resume.
+		"""
+		return False
+
+	def resumePrint(self):
+		"""
+		Resume the interrupted print of the loaded file.
+		"""
+		pass
+
 	def hasOnIdle(self):
 		"""
 		Return True if this driver uses/needs onIdle gui events.
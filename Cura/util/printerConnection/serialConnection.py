@@ -11,6 +11,7 @@ import platform
 import os
 import sys
 import subprocess
+import tempfile
 import json
 
 from Cura.util import profile
@@ -57,6 +58,7 @@ class serialConnection(printerConnectionBase.printerConnectionBase):
 	When an active connection is created, a 2nd python process is spawned which handles the actual serial communication.
 
 	This class communicates with the Cura.serialCommunication module trough stdin/stdout pipes.
+	The gcode of a print is handed over in a temporary file, not line by line through the pipe.
 	"""
 	def __init__(self, port):
 		super(serialConnection, self).__init__(port)
@@ -74,6 +76,8 @@ class serialConnection(printerConnectionBase.printerConnectionBase):
 		self._commState = None
 		self._commStateString = None
 		self._gcodeData = []
+		self._printLayer = -1
+		self._printTimeLeft = -1
 
 	#Load the data into memory for printing, returns True on success
 	def loadGCodeData(self, dataStream):
@@ -92,15 +96,19 @@ class serialConnection(printerConnectionBase.printerConnectionBase):
 			self._gcodeData.append(line)
 		return True
 
-	#Start printing the previously loaded file
-	def startPrint(self):
+	#Start printing the previously loaded file, from startLayer on if it is given.
+	def startPrint(self, startLayer = 0):
 		if self.isPrinting() or len(self._gcodeData) < 1 or self._process is None:
 			return
 		self._process.stdin.write('STOP\n')
-		for line in self._gcodeData:
-			self._process.stdin.write('G:%s\n' % (line))
-		self._process.stdin.write('START\n')
+		fd, filename = tempfile.mkstemp(prefix='cura_print_', suffix='.gcode')
+		with os.fdopen(fd, 'wb') as f:
+			f.write('\n'.join(self._gcodeData))
+		self._process.stdin.write('FILE:%s\n' % (filename))
+		self._process.stdin.write('START:%d\n' % (startLayer))
 		self._printProgress = 0
+		self._printLayer = -1
+		self._printTimeLeft = -1
 
 	#Abort the previously loaded print file
 	def cancelPrint(self):
@@ -125,6 +133,11 @@ class serialConnection(printerConnectionBase.printerConnectionBase):
 	# Get the connection status string. This is displayed to the user and can be used to communicate
 	#  various information to the user.
 	def getStatusString(self):
+		if self.isPrinting() and self._printLayer >= 0:
+			ret = "%s, layer %d" % (self._commStateString, self._printLayer + 1)
+			if self._printTimeLeft >= 0:
+				ret += ", %d:%02d left" % (self._printTimeLeft / 3600, self._printTimeLeft / 60 % 60)
+			return ret
 		return "%s" % (self._commStateString)
 
 	#Returns true if we need to establish an active connection. True for serial connections.
@@ -218,7 +231,10 @@ class serialConnection(printerConnectionBase.printerConnectionBase):
 				self._commStateString = line[1]
 				self._doCallback()
 			elif line[0] == 'progress':
-				self._printProgress = int(line[1])
+				line = line[1].split(':')
+				self._printProgress = int(line[0])
+				self._printLayer = int(line[1])
+				self._printTimeLeft = int(line[2])
 				self._doCallback()
 			else:
 				print line
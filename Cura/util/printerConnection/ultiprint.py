@@ -33,8 +33,34 @@
 #   G10: 3
 #   G11: 4
 # 
+#
+# Pack format 2 (opt-in, needs a firmware that knows it) adds:
+#
+#   G0:  5   # like 1/2, but X, Y and E are 2 byte signed deltas against
+#   G1:  6   # the last value of the parameter
+#   short command: 7
+#
+# Delta moves: the same flags and layout as G0/G1, X, Y and E are int16
+# in units of 1/1000 mm (X, Y) and 1/100000 mm (E), Z stays a float.
+# Printer and host keep the last value of X, Y and E as an integer in these
+# units, set by each accepted packed G0/G1 (keys 1, 2, 5 and 6) from the float
+# value, rounded half to even, unknown for values of 1e6 and more.
+# M110 makes them unknown. A delta is only sent if the parameter value is known
+# and the float value it gives is the same as the one of the text command.
+#
+# Short commands, a table index instead of the command text:
+#
+# 1 byte:            command key, 7
+# 1 byte:            'parameter mask', bits: 0000PS00, P: param present
+# 1 byte:            index into shortCommands
+# 4 bytes:           param (float)
+# 2/4 bytes:         line counter
+# 1 byte:            checksum
+#
 
-import sys, time, struct, argparse, collections
+import sys, os, re, time, mmap, json, struct, hashlib, argparse, threading, collections
+
+import numpy
 
 from serial import Serial, SerialException 
 
@@ -65,84 +91,221 @@ class DummyEvent:
     def RequestMore(self, b):
         pass
 
+# Commands with a short form in pack format 2: (command, parameter letter or None)
+shortCommands = [
+    ("M104", "S"), ("M109", "S"), ("M140", "S"), ("M190", "S"),
+    ("M106", "S"), ("M106", None), ("M107", None),
+    ("G92", "E"), ("G4", "P"), ("G4", "S"),
+    ("M82", None), ("M83", None), ("G90", None), ("G91", None),
+    ("G28", None), ("M84", None), ("M400", None),
+    ]
+shortIndex = dict([(shortCommands[i], i) for i in range(len(shortCommands))])
+
+# Units of the delta moves of pack format 2, and the limit of known last values
+deltaScales = { "x": 1000.0, "y": 1000.0, "e": 100000.0 }
+deltaLimit = 1e6
+
+# Kinds of commands in the statistics, by command key
+packedKinds = { 1: "G0/G1", 2: "G0/G1", 3: "G10/G11", 4: "G10/G11", 5: "G0/G1 delta", 6: "G0/G1 delta", 7: "short" }
+
 class Preprocessor:
 
-    def __init__(self, mode, filename=None, gcode=[], stream=None):
+    # Number of commands packed ahead of the send position, and
+    # number of sent commands kept for resends.
+    lookahead = 256
+    resendWindow = 512
+
+    # Number of lines packed at once
+    blockSize = 1024
+
+    # G0/G1 commands packed by packBlock(), parameters have to be in FXYZE order
+    number = r"-?(?:\d+(?:\.\d*)?|\.\d+)"
+    moveRE = re.compile(r"G([01])(?: F(\d+))?(?: X(%s))?(?: Y(%s))?(?: Z(%s))?(?: E(%s))?$" % (number, number, number, number))
+
+    # Layout of a packed G0/G1 command with all parameters and a 4 byte line number
+    packDType = numpy.dtype([("cmd", "u1"), ("flags", "u1"), ("f", "<u2"), ("x", "<f4"), ("y", "<f4"), ("z", "<f4"), ("e", "<f4"), ("lineNr", "<u4"), ("chk", "u1"), ("nl", "u1")])
+
+    # Layout of a delta G0/G1 command of pack format 2
+    deltaDType = numpy.dtype([("cmd", "u1"), ("flags", "u1"), ("f", "<u2"), ("x", "<i2"), ("y", "<i2"), ("z", "<f4"), ("e", "<i2"), ("lineNr", "<u4"), ("chk", "u1"), ("nl", "u1")])
+
+    # Parameters for short commands (key 7) of pack format 2
+    shortRE = re.compile(r"([GM]\d+)(?: ([A-Z])(%s))?$" % number)
+
+    # Commands that make up the state a print is resumed with, the
+    # last command of each kind is kept.
+    stateCommands = {
+        "M104": "hotend", "M109": "hotend", "M140": "bed", "M190": "bed",
+        "M106": "fan", "M107": "fan", "M82": "extrusion", "M83": "extrusion",
+        "G90": "positioning", "G91": "positioning", "G10": "retract", "G11": "retract",
+        "G28": "home",
+        }
+
+    # Z lift in mm before the travel to the first move of a resumed layer
+    resumeLift = 2.0
+
+    def __init__(self, mode, filename=None, gcode=[], stream=None, vectorized=True, packVersion=1, resume=None):
+
+        # Pack format 2 is always packed with numpy
+        self.vectorized = vectorized or packVersion == 2
+        self.packVersion = packVersion
 
         self.lineNr = 0
         self.origbytes = 0
         self.packbytes = 0
         self.uncompressedCmds = collections.defaultdict(int)
 
+        # Commands, bytes and unpacked bytes for each kind of command
+        self.kindCount = collections.defaultdict(int)
+        self.kindBytes = collections.defaultdict(int)
+        self.kindOrigBytes = collections.defaultdict(int)
+
+        # Last X, Y and E values of pack format 2, None if unknown
+        self.lastValues = dict.fromkeys("xye")
+
+        # Layer index, a dict with the layer number, the position of the ";LAYER:"
+        # comment in the command stream, its offset in the input and the state
+        # at that point for each layer.
+        self.layers = []
+        # Last state commands, and the last G0/G1/G92 commands with a Z, E or F
+        self.state = {}
+        # Layer to resume the print at, the input is read from its offset
+        self.resume = resume
+
+        self.filename = filename
+        self.stream = stream
+
+        # Bytes read from the input file or stream, used for the progress
+        self.inputBytes = 0
+        self.totalBytes = 0
+
         # Always reset line counter first
-        gcode = [("M110", "ok")] + gcode
+        self.header = [("M110", "ok")] + gcode
+        self.trailer = []
 
         if filename or stream:
 
             # If in printing mode, then send custom M623 command,
             # select file for UM2 print
             if mode == "print":
-                gcode += [("M623 usb.g", "ok")]
+                self.header += [("M623 usb.g", "ok")]
 
             # Store or print mode, open the file on the
             # SD card with the M28 command, then send the
             # contents of the file given on the commandline.
             # Close file on SD card with M29 if done.
-            gcode += [("M28 usb.g", "ok")]
+            self.header += [("M28 usb.g", "ok")]
+            self.trailer += [("M29", Printer.endStoreToken)]
 
-            if filename:
-                inFile = open(filename)
-
-                print "Preprocessing:", filename
-                sys.stdout.flush()
-
-                for line in inFile.readlines():
-    
-                    # Strip very long lines like ";CURA_PROFILE_STRING" line at the end of the file:
-                    # Marlin: #define MAX_CMD_SIZE 96
-                    if len(line) > 80:
-                        continue
-
-                    gcode.append((line, None))
+            if resume:
+                # The state is read back from json as unicode
+                self.resume["state"] = dict([(str(key), str(value)) for (key, value) in resume["state"].items()])
+                self.inputBytes = resume["offset"]
+                self.header += [(cmd, None) for cmd in self.resumeCommands(self.resume["state"])]
+                print "Resuming at layer %d" % resume["layer"]
 
             if filename:
-                inFile.close()
+                self.totalBytes = os.path.getsize(filename)
+                print "Preprocessing:", filename
             else:
-                
+                self.totalBytes = len(stream)
                 print "Preprocessing:", stream
+            sys.stdout.flush()
 
-                for line in stream:
+        # The gcode is read and packed while it is sent, so the print
+        # starts at once and only a small part of the file is in memory.
+        self.prep = CommandStream(self.preprocessGCode(self.readGCode()), self.lookahead, self.resendWindow)
 
-                    # Strip very long lines like ";CURA_PROFILE_STRING" line at the end of the file:
-                    # Marlin: #define MAX_CMD_SIZE 96
-                    if len(line) > 80:
-                        continue
+    def readGCode(self):
 
-                    gcode.append((line, None))
+        for cmd in self.header:
+            yield cmd
 
-            gcode.append(("M29", Printer.endStoreToken))
+        if self.resume:
+            # The state is the one before the layer, not the one set by the resume commands
+            self.state = dict(self.resume["state"])
 
-        self.prep = self.preprocessGCode(gcode)
+        if self.filename:
+            # Binary, so the offsets of the layer index are byte offsets
+            inFile = open(self.filename, "rb")
+        else:
+            inFile = self.stream
+
+        if inFile:
 
-        # debug
-        """
-        if mode == "pre":
-            print "saving to /tmp/usb.g"
-            f = open("/tmp/usb.g", "w")
-            lnr = 0
-            for (cmd, resp) in self.prep:
-                if isPackedCommand(cmd):
-                    if lnr < 0x10000:
-                        f.writelines(cmd[:-4] + "\n")
-                    else:
-                        f.writelines(cmd[:-6] + "\n")
+            lines = inFile
+
+            if self.resume:
+                if self.filename:
+                    inFile.seek(self.resume["offset"])
                 else:
-                    n = cmd.split()[0]
-                    c = cmd.split("*")[-1]
-                    f.writelines(cmd[len(n)+1:-(len(c)+1)] + "\n")
-                lnr += 1
-            f.close()
-        """
+                    # Streams can't seek, skip the lines before the layer
+                    lines = (line for line in inFile)
+                    skipped = 0
+                    while skipped < self.resume["offset"]:
+                        skipped += len(lines.next())
+
+            for line in lines:
+
+                self.inputBytes += len(line)
+
+                # Strip very long lines like ";CURA_PROFILE_STRING" line at the end of the file:
+                # Marlin: #define MAX_CMD_SIZE 96
+                if len(line) > 80:
+                    continue
+
+                yield (line, None)
+
+        if self.filename:
+            inFile.close()
+
+        for cmd in self.trailer:
+            yield cmd
+
+    # Commands that restore the state before a layer of a resumed print
+    def resumeCommands(self, state):
+
+        cmds = []
+
+        for key in ["hotend", "bed"]:
+            if key in state:
+                # Wait for the temperature before the print goes on
+                (cmd, sep, params) = state[key].partition(" ")
+                cmd = { "M104": "M109", "M140": "M190" }.get(cmd, cmd)
+                cmds.append((cmd + sep + params).strip())
+
+        for key in ["fan", "extrusion", "home"]:
+            if key in state:
+                cmds.append(state[key])
+
+        cmds.append("G90")
+
+        z = getParam(state.get("z"), "Z")
+        if z is not None:
+            cmds.append("G0 Z%.3f" % (float(z) + self.resumeLift))
+
+        e = getParam(state.get("e"), "E")
+        if e is not None:
+            cmds.append("G92 E%s" % e)
+
+        f = getParam(state.get("f"), "F")
+        if f is not None:
+            cmds.append("G0 F%s" % f)
+
+        if state.get("retract") == "G10":
+            cmds.append("G10")
+
+        if state.get("positioning") == "G91":
+            cmds.append("G91")
+
+        return cmds
+
+    # Amount of the input read so far, 0.0 to 1.0
+    def getProgress(self):
+
+        if not self.totalBytes:
+            return 0.0
+
+        return float(self.inputBytes) / self.totalBytes
 
     def printStat(self):
         print "\n-----------------------------------------------"
@@ -151,6 +314,9 @@ class Preprocessor:
         print "Size of unpacked commands: %d bytes" % self.origbytes
         print "Size of   packed commands: %d bytes" % self.packbytes
         print "Compression ratio: %.1f%%" % (self.packbytes*100.0/self.origbytes)
+        print "Pack format: %d\n" % self.packVersion
+
+        printKindStat(self.kindCount, self.kindBytes, self.kindOrigBytes)
 
         print "# Uncompressed commands: "
         for cmd in self.uncompressedCmds:
@@ -270,11 +436,10 @@ class Preprocessor:
 
             return packed + "\n"
 
+    # Generator, reads the gcode in blocks and packs each block when it is needed.
     def preprocessGCode(self, gcode):
 
-        print "Preprocessing %d gcode lines..." % len(gcode)
-
-        prep = []
+        block = []
 
         for (cmd, response) in gcode:
 
@@ -287,7 +452,54 @@ class Preprocessor:
             if scmd == "M110":
                 self.lineNr = 0
 
-            prefix = "N" + str(self.lineNr) + " " + scmd
+            if scmd[0] == ";":
+                if scmd.startswith(";LAYER:"):
+                    self.addLayer(scmd, len(cmd))
+            elif scmd[:3] in ("G0 ", "G1 "):
+                if " Z" in scmd:
+                    self.state["z"] = scmd
+                if " E" in scmd:
+                    self.state["e"] = scmd
+                if " F" in scmd:
+                    self.state["f"] = scmd
+            else:
+                cmdName = scmd.split(None, 1)[0]
+                if cmdName in self.stateCommands:
+                    self.state[self.stateCommands[cmdName]] = scmd
+                elif cmdName == "G92" and " E" in scmd:
+                    self.state["e"] = scmd
+
+            block.append((scmd, response, self.lineNr))
+            self.lineNr += 1
+
+            if len(block) >= self.blockSize:
+                for packed in self.packBlock(block):
+                    yield packed
+                block = []
+
+        for packed in self.packBlock(block):
+            yield packed
+
+        print "Preprocessing done..."
+
+    # Add the layer that starts with the ";LAYER:" comment at the current line
+    def addLayer(self, scmd, length):
+
+        try:
+            layerNr = int(scmd[7:])
+        except ValueError:
+            return
+
+        self.layers.append({ "layer": layerNr, "pos": self.lineNr, "offset": self.inputBytes - length, "state": dict(self.state) })
+
+    # Pack a block of (cmd, response, lineNr) tuples, one line at a time.
+    def packLines(self, block):
+
+        prep = []
+
+        for (scmd, response, lineNr) in block:
+
+            prefix = "N" + str(lineNr) + " " + scmd
             chksm = self.checksum(prefix)
 
             # print scmd
@@ -301,41 +513,814 @@ class Preprocessor:
             # + 1 + len(chksum), *<checksum>
             # + 1, newline
             #
-            origlen = 1 + len("%d" % self.lineNr) + 1 + len(scmd) + 1 + len("%d" % chksm) + 1
+            origlen = 1 + len("%d" % lineNr) + 1 + len(scmd) + 1 + len("%d" % chksm) + 1
             self.origbytes += origlen
 
-            packed = self.packGCode(scmd, self.lineNr)
+            packed = self.packGCode(scmd, lineNr)
 
             if packed:
 
                 self.packbytes += len(packed)
+                self.countKind(packed, origlen)
 
                 prep.append( ( packed, response ) )
             else:
 
-                self.packbytes += origlen
+                prep.append( self.uncompressedCommand(scmd, response, lineNr, chksm, origlen) )
+
+        return prep
+
+    def countKind(self, cmd, origlen):
+
+        kind = commandKind(cmd)
+        self.kindCount[kind] += 1
+        self.kindBytes[kind] += len(cmd)
+        self.kindOrigBytes[kind] += origlen
+
+    def uncompressedCommand(self, scmd, response, lineNr, chksm, origlen):
+
+        self.packbytes += origlen
+
+        if scmd[0] == ";":
+            self.uncompressedCmds["<comment>"] += 1
+        else:
+            self.uncompressedCmds[scmd.split()[0]] += 1
+
+        scmd = "N%d %s*%d\n" % (lineNr, scmd, chksm)
+
+        # print "ll: ", len(scmd),  origlen
+        # print "'%s'" % scmd
+        assert(len(scmd) == origlen) # +1 is for newline
+
+        self.countKind(scmd, origlen)
+
+        return ( scmd, response )
+
+    # Pack a block of (cmd, response, lineNr) tuples, the G0/G1 commands
+    # and the checksums of all commands are computed with numpy arrays.
+    # The result is the same as from packLines().
+    def packBlock(self, block):
+
+        if not self.vectorized:
+            return self.packLines(block)
+
+        n = len(block)
+        if n < 1:
+            return []
+
+        scmds = [b[0] for b in block]
+        lineNrs = numpy.array([b[2] for b in block], numpy.int64)
+
+        # Checksum and length of the uncompressed commands, "N<lineNr> <cmd>*<checksum>\n"
+        lengths = numpy.array(map(len, scmds), numpy.int64)
+        chksms = numpy.bitwise_xor.reduceat(numpy.frombuffer("".join(scmds), numpy.uint8), numpy.cumsum(lengths) - lengths).astype(numpy.int64)
+        chksms ^= ord("N") ^ ord(" ") ^ (ord("0") + lineNrs % 10)
+        lineNrDigits = numpy.ones(n, numpy.int64)
+        digits = lineNrs / 10
+        while digits.any():
+            hasDigit = digits > 0
+            chksms[hasDigit] ^= ord("0") + digits[hasDigit] % 10
+            lineNrDigits += hasDigit
+            digits /= 10
+        origlens = lineNrDigits + lengths + 5 + (chksms >= 10) + (chksms >= 100)
+        self.origbytes += int(origlens.sum())
+
+        # G0/G1 commands with the parameters in the usual order are packed here,
+        # everything else with packGCode(). For pack format 2 all G0/G1 commands
+        # that packGCode() can pack are packed here, as they set the last values.
+        matches = map(self.moveRE.match, scmds)
+        if self.packVersion == 2:
+            matches = [m and m.groups() or self.splitMove(scmd) for (m, scmd) in zip(matches, scmds)]
+        else:
+            matches = [m and m.groups() for m in matches]
+        moveIdx = [i for i in xrange(n) if matches[i]]
+        moves = [matches[i] for i in moveIdx]
+
+        packed = [None] * n
+
+        if moves:
+
+            params = zip(*moves)
+
+            fMask, fValues = self.parseParam(params[1])
+            # Out of range speeds are left to packGCode(), which asserts as before
+            valid = (fValues > 0) & (fValues < 0x10000) | ~fMask
+
+            rec = numpy.zeros(len(moves), self.packDType)
+            rec["cmd"] = numpy.array(params[0], numpy.int64) + 1
+            flags = (fMask << 7) | (lineNrs[moveIdx] < 0x10000) << 2
+            rec["f"] = numpy.where(valid, fValues, 0)
+            rec["lineNr"] = lineNrs[moveIdx]
+            rec["nl"] = ord("\n")
+
+            # Bytes of each record that are sent: all but the absent parameters and
+            # the upper half of a line number below 0x10000.
+            recBytes = rec.view(numpy.uint8).reshape((len(moves), self.packDType.itemsize))
+            sent = numpy.ones(recBytes.shape, numpy.bool)
+            sent[:,2:4] = fMask[:,None]
+
+            masks = {}
+            values = {}
+            for (col, name, bit) in [(2, "x", 6), (3, "y", 5), (4, "z", 4), (5, "e", 3)]:
+                masks[name], values[name] = self.parseParam(params[col])
+                flags |= masks[name] << bit
+                rec[name] = values[name]
+                offset = self.packDType.fields[name][1]
+                sent[:,offset:offset+4] = masks[name][:,None]
+
+            rec["flags"] = flags
+            sent[:,22:24] = (lineNrs[moveIdx] >= 0x10000)[:,None]
+            rec["chk"] = numpy.bitwise_xor.reduce(recBytes[:,:24], 1)
+
+            data = recBytes[sent].tostring()
+            ends = numpy.cumsum(sent.sum(1))
+            starts = ends - sent.sum(1)
+
+            for (i, start, end, ok) in zip(moveIdx, starts.tolist(), ends.tolist(), valid.tolist()):
+                if ok:
+                    packed[i] = data[start:end]
+
+            if self.packVersion == 2:
+                # M110 lines before each move, they make the last values unknown
+                resets = numpy.cumsum([scmd == "M110" for scmd in scmds])
+                for (i, cmd) in self.packDeltas(rec, valid, masks, values, resets[moveIdx], resets[-1]):
+                    packed[moveIdx[i]] = cmd
+
+        prep = []
+        origlens = origlens.tolist()
+        chksms = chksms.tolist()
+
+        for i in xrange(n):
+
+            (scmd, response, lineNr) = block[i]
+
+            cmd = packed[i]
 
-                if scmd[0] == ";":
-                    self.uncompressedCmds["<comment>"] += 1
+            if cmd is None:
+
+                if self.packVersion == 2 and matches[i] is None and scmd.split()[0] in ("G0", "G1"):
+                    # Would change the last values unnoticed
+                    cmd = None
                 else:
-                    self.uncompressedCmds[scmd.split()[0]] += 1
+                    cmd = self.packGCode(scmd, lineNr)
 
-                scmd = prefix + "*" + str(chksm) + "\n"
+                if not cmd and self.packVersion == 2:
+                    cmd = self.packShort(scmd, lineNr)
 
-                # print "ll: ", len(scmd),  origlen
-                # print "'%s'" % scmd
-                assert(len(scmd) == origlen) # +1 is for newline
+                if not cmd:
+                    prep.append( self.uncompressedCommand(scmd, response, lineNr, chksms[i], origlens[i]) )
+                    continue
 
-                prep.append( ( scmd, response ) )
+            self.packbytes += len(cmd)
+            self.countKind(cmd, origlens[i])
 
-            self.lineNr += 1
+            prep.append( ( cmd, response ) )
 
-        print "done..."
         return prep
 
+    # G0/G1 command with the parameters not in FXYZE order, as moveRE groups.
+    # None if packGCode() can't pack it.
+    def splitMove(self, scmd):
+
+        splitted = scmd.split()
+
+        if splitted[0] not in ("G0", "G1") or len(splitted) > 6:
+            return None
+
+        params = {}
+
+        for param in splitted[1:]:
+
+            if param[0] not in "FXYZE" or param[0] in params:
+                return None
+
+            try:
+                if param[0] == "F":
+                    params["F"] = str(int(param[1:]))
+                else:
+                    params[param[0]] = repr(float(param[1:]))
+            except ValueError:
+                return None
+
+        return (splitted[0][1], ) + tuple([params.get(name) for name in "FXYZE"])
+
+    # Pack format 2: replace the G0/G1 commands whose X, Y and E can be sent as
+    # deltas against the last values by delta moves. 'rec' are the records of
+    # the packed moves, 'resets' the number of M110 before each move and in the
+    # whole block. Returns (move index, packed command) tuples.
+    def packDeltas(self, rec, valid, masks, values, resets, blockResets):
+
+        n = len(rec)
+        rows = numpy.arange(n)
+
+        delta = numpy.zeros(n, self.deltaDType)
+        # Moves with at least one delta and no parameter that can't be a delta
+        useDelta = valid.copy()
+        hasDelta = numpy.zeros(n, numpy.bool)
+
+        for name in "xye":
+
+            mask = masks[name]
+            scale = deltaScales[name]
+
+            # The last value after each move as the printer computes it from the float
+            floats = values[name].astype(numpy.float32)
+            known = mask & (numpy.abs(floats) < deltaLimit)
+            last = numpy.rint(numpy.where(known, floats, 0).astype(numpy.float64) * scale).astype(numpy.int64)
+
+            # Move that set the last value before each move
+            setBy = numpy.maximum.accumulate(numpy.where(mask, rows, -1))
+            prevRow = numpy.concatenate(([-1], setBy[:-1]))
+            prev = last[prevRow]
+            prevKnown = (prevRow >= 0) & known[prevRow] & (resets[prevRow] == resets)
+
+            if self.lastValues[name] is not None:
+                fromLastBlock = (prevRow < 0) & (resets == 0)
+                prev[fromLastBlock] = self.lastValues[name]
+                prevKnown |= fromLastBlock
+
+            target = numpy.rint(numpy.where(known, values[name], 0) * scale).astype(numpy.int64)
+            diff = target - prev
+            decoded = (target / scale).astype(numpy.float32)
+            exact = (decoded == floats) & (numpy.signbit(decoded) == numpy.signbit(floats))
+            ok = prevKnown & known & exact & (diff >= -0x8000) & (diff < 0x8000)
+
+            useDelta &= ok | ~mask
+            hasDelta |= mask
+            delta[name] = numpy.where(ok, diff, 0)
+
+            # Last value for the next block
+            if setBy[-1] >= 0 and resets[setBy[-1]] == blockResets:
+                self.lastValues[name] = int(last[setBy[-1]]) if known[setBy[-1]] else None
+            elif blockResets:
+                self.lastValues[name] = None
+
+        useDelta &= hasDelta
+        deltaIdx = numpy.nonzero(useDelta)[0]
+        if not len(deltaIdx):
+            return []
+
+        delta = delta[deltaIdx]
+        flags = rec["flags"][deltaIdx]
+        delta["cmd"] = rec["cmd"][deltaIdx] + 4
+        delta["flags"] = flags
+        delta["f"] = rec["f"][deltaIdx]
+        delta["z"] = rec["z"][deltaIdx]
+        delta["lineNr"] = rec["lineNr"][deltaIdx]
+        delta["nl"] = ord("\n")
+
+        deltaBytes = delta.view(numpy.uint8).reshape((len(deltaIdx), self.deltaDType.itemsize))
+        delta["chk"] = numpy.bitwise_xor.reduce(deltaBytes[:,:18], 1)
+
+        sent = numpy.ones(deltaBytes.shape, numpy.bool)
+        for (name, bit) in [("f", 0x80), ("x", 0x40), ("y", 0x20), ("z", 0x10), ("e", 0x8)]:
+            (dtype, offset) = self.deltaDType.fields[name]
+            sent[:,offset:offset+dtype.itemsize] = (flags & bit).astype(numpy.bool)[:,None]
+        sent[:,16:18] = ~(flags & 0x4).astype(numpy.bool)[:,None]
+
+        data = deltaBytes[sent].tostring()
+        ends = numpy.cumsum(sent.sum(1)).tolist()
+        starts = [0] + ends[:-1]
+
+        return [(i, data[start:end]) for (i, start, end) in zip(deltaIdx.tolist(), starts, ends)]
+
+    # Pack format 2: short form of the commands in shortCommands, None for other commands
+    def packShort(self, scmd, lineNr):
+
+        m = self.shortRE.match(scmd)
+        if not m:
+            return None
+
+        (cmd, paramType, param) = m.groups()
+        index = shortIndex.get((cmd, paramType))
+        if index is None:
+            return None
+
+        paramFlags = 0
+        paramHex = ""
+        if paramType:
+            paramFlags += 1 << 3
+            paramHex = struct.pack("<f", float(param))
+
+        lnHex = struct.pack("<I", lineNr)
+        if lineNr < 0x10000:
+            # pack line number as short
+            paramFlags += 1 << 2
+            lnHex = struct.pack("<H", lineNr)
+
+        packed = struct.pack("<BBB", 7, paramFlags, index) + paramHex + lnHex
+        packed += struct.pack("<B", self.checksum(packed))
+
+        return packed + "\n"
+
+    # Convert a column of parameter strings, None if the parameter is absent.
+    # Returns the mask of present parameters and the values, 0 where absent.
+    def parseParam(self, strings):
+
+        mask = numpy.array([v is not None for v in strings], numpy.bool)
+        values = numpy.fromstring(" ".join([v or "0" for v in strings]), numpy.float64, sep=" ")
+        return (mask, values)
+
 def isPackedCommand(cmd):
     return cmd[0] < "\n"
 
+# Value of a parameter of a text command, None if the command or parameter is missing
+def getParam(scmd, paramType):
+
+    if scmd:
+        for param in scmd.split()[1:]:
+            if param[0] == paramType:
+                return param[1:]
+
+    return None
+
+def commandKind(cmd):
+
+    if isPackedCommand(cmd):
+        return packedKinds.get(ord(cmd[0]), "?")
+    return "text"
+
+# Commands and bytes for each kind of command, and the bytes they take unpacked if known
+def printKindStat(counts, sizes, origSizes=None):
+
+    header = "%-12s %9s %10s %9s" % ("# Kind", "commands", "bytes", "bytes/cmd")
+    if origSizes:
+        header += " %9s" % "ratio"
+    print header
+
+    for kind in sorted(counts):
+        line = "%-12s %9d %10d %9.1f" % (kind, counts[kind], sizes[kind], float(sizes[kind])/counts[kind])
+        if origSizes:
+            line += " %8.1f%%" % (sizes[kind]*100.0/origSizes[kind])
+        print line
+
+    print
+
+class CommandStream:
+    """
+    The preprocessed commands, indexed by their position, which is also
+    the line number sent to the printer.
+    Commands are taken from the generator up to 'lookahead' commands
+    ahead of the requested position. Only the last 'window' commands
+    before the requested position are kept for resends.
+    """
+
+    def __init__(self, commands, lookahead=256, window=512):
+
+        self.commands = iter(commands)
+        self.lookahead = lookahead
+        self.window = window
+
+        self.buffer = collections.deque()
+        # Position of the first command in the buffer
+        self.first = 0
+        self.eof = False
+
+    def fill(self, pos):
+
+        while not self.eof and self.first + len(self.buffer) <= pos + self.lookahead:
+            try:
+                self.buffer.append(self.commands.next())
+            except StopIteration:
+                self.eof = True
+
+    # True if there is a command at position pos
+    def hasCommand(self, pos):
+
+        self.fill(pos)
+        return pos < self.first + len(self.buffer)
+
+    def __getitem__(self, pos):
+
+        if pos < self.first:
+            raise IndexError("command %d is no longer in the resend window" % pos)
+
+        self.fill(pos)
+
+        while pos - self.first > self.window:
+            self.buffer.popleft()
+            self.first += 1
+
+        if pos >= self.first + len(self.buffer):
+            raise IndexError("command %d is past the end of the gcode" % pos)
+
+        return self.buffer[pos - self.first]
+
+
+#
+# Precompiled print package (.upk), the output of the Preprocessor stored in a file:
+#
+# header:   magic "UPK1", sha1 of the gcode, mode, number of commands, index interval,
+#           file offset of the index, unpacked and packed size for the statistics
+# data:     the commands, directly after the header
+# index:    data offset of every 'index interval'-th command as uint64,
+#           followed by the commands that want a reply: count, then (position, length, reply)
+#
+# The commands contain the line numbers, so a package is for one mode only.
+#
+packageHeader = struct.Struct("<4s20s8sIIQQQ")
+packageMagic = "UPK1"
+
+def hashGCode(f, abortCheck=None):
+    """
+    Sha1 of a gcode file object or storage with read(), used to find the package of a gcode.
+    Returns None when abortCheck returns True before the whole gcode is read.
+    """
+    h = hashlib.sha1()
+    while True:
+        if abortCheck is not None and abortCheck():
+            return None
+        data = f.read(1024 * 1024)
+        if not data:
+            break
+        h.update(data)
+    return h.hexdigest()
+
+# Packed commands contain binary floats, so their length has to be taken
+# from the flags instead of looking for the newline.
+def commandLength(data, offset):
+
+    if data[offset] < "\n":
+        key = ord(data[offset])
+        flags = ord(data[offset+1])
+        if key == 7:
+            length = 3 + 4 * ((flags >> 3) & 1) + 2
+        elif key >= 5:
+            # Delta move, 2 byte X, Y and E
+            length = 2 + 2 * bin(flags & 0x68).count("1") + 4 * ((flags >> 4) & 1) + 2
+        else:
+            length = 2 + 4 * bin(flags & 0x78).count("1") + 2
+        if flags & 0x80:
+            length += 2
+        if flags & 0x4:
+            return length + 2
+        return length + 4
+
+    return data.find("\n", offset) + 1 - offset
+
+def writePackage(commands, filename, sourceHash, mode, preprocessor, indexInterval=1000):
+    """
+    Generator, passes the commands through while they are written to a package file.
+    The package is only created when all commands have been taken, so a canceled
+    print does not leave a partial package behind. The layer index of the
+    preprocessor is stored after the replies, so prints from the package can be
+    resumed.
+    """
+    tmpFilename = "%s.tmp%d" % (filename, os.getpid())
+    f = open(tmpFilename, "wb")
+    try:
+        f.write("\0" * packageHeader.size)
+
+        offsets = []
+        replies = []
+        dataSize = 0
+        pos = 0
+
+        for (cmd, response) in commands:
+
+            if pos % indexInterval == 0:
+                offsets.append(dataSize)
+            if response:
+                replies.append((pos, response))
+
+            f.write(cmd)
+            dataSize += len(cmd)
+            pos += 1
+
+            yield (cmd, response)
+
+        f.write(numpy.array(offsets, numpy.uint64).tostring())
+        f.write(struct.pack("<I", len(replies)))
+        for (replyPos, response) in replies:
+            f.write(struct.pack("<IH", replyPos, len(response)) + response)
+        layers = json.dumps(preprocessor.layers)
+        f.write(struct.pack("<I", len(layers)) + layers)
+
+        f.seek(0)
+        f.write(packageHeader.pack(packageMagic, sourceHash.decode("hex"), mode, pos, indexInterval, packageHeader.size + dataSize, preprocessor.origbytes, preprocessor.packbytes))
+        f.close()
+
+        if os.path.exists(filename):
+            os.remove(filename)
+        os.rename(tmpFilename, filename)
+        print "Package written:", filename
+    finally:
+        if not f.closed:
+            f.close()
+        if os.path.exists(tmpFilename):
+            os.remove(tmpFilename)
+
+def compilePackage(gfile, output, mode, packVersion=1):
+    """
+    Preprocess a gcode file into a print package, returns the preprocessor.
+    """
+    f = open(gfile, "rb")
+    sourceHash = hashGCode(f)
+    f.close()
+    prep = Preprocessor(mode, gfile, packVersion=packVersion)
+    for cmd in writePackage(prep.prep, output, sourceHash, mode, prep):
+        pass
+    return prep
+
+class Package:
+    """
+    A precompiled print package, the commands are read from a memory
+    mapping of the file. It has the same interface as CommandStream, so the
+    printer can send from it.
+    """
+
+    def __init__(self, filename):
+
+        self.file = open(filename, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, sourceHash, mode, self.count, self.indexInterval, indexOffset, self.origbytes, self.packbytes) = packageHeader.unpack_from(self.data, 0)
+
+        if magic != packageMagic:
+            raise ValueError("%s is not a print package" % filename)
+
+        self.sourceHash = sourceHash.encode("hex")
+        self.mode = mode.rstrip("\0")
+
+        indexCount = (self.count + self.indexInterval - 1) / self.indexInterval
+        self.offsets = numpy.frombuffer(self.data[indexOffset:indexOffset + indexCount * 8], numpy.uint64).tolist()
+
+        self.replies = {}
+        offset = indexOffset + indexCount * 8
+        (replyCount, ) = struct.unpack_from("<I", self.data, offset)
+        offset += 4
+        for i in range(replyCount):
+            (replyPos, length) = struct.unpack_from("<IH", self.data, offset)
+            offset += 6
+            self.replies[replyPos] = self.data[offset:offset+length]
+            offset += length
+
+        # Layer index like Preprocessor.layers, packages written before it was stored have none
+        self.layers = []
+        if offset + 4 <= len(self.data):
+            (length, ) = struct.unpack_from("<I", self.data, offset)
+            self.layers = json.loads(self.data[offset+4:offset+4+length])
+
+        # Position and data offset of the next command, for sequential reads
+        self.pos = 0
+        self.offset = packageHeader.size
+
+        self.prep = self
+
+    def hasCommand(self, pos):
+        return pos < self.count
+
+    def __getitem__(self, pos):
+
+        if pos >= self.count:
+            raise IndexError("command %d is past the end of the package" % pos)
+
+        if pos != self.pos:
+            # Resend, start at the nearest indexed command before it
+            self.pos = pos - pos % self.indexInterval
+            self.offset = packageHeader.size + self.offsets[pos / self.indexInterval]
+            while self.pos < pos:
+                self.offset += commandLength(self.data, self.offset)
+                self.pos += 1
+
+        length = commandLength(self.data, self.offset)
+        cmd = self.data[self.offset:self.offset + length]
+        self.offset += length
+        self.pos += 1
+
+        return (cmd, self.replies.get(pos))
+
+    # Amount of the package sent, 0.0 to 1.0
+    def getProgress(self):
+
+        if not self.count:
+            return 0.0
+
+        return float(self.pos) / self.count
+
+    def printStat(self):
+        print "Print package: %d commands, %d bytes, %d bytes unpacked" % (self.count, self.packbytes, self.origbytes)
+
+        counts = collections.defaultdict(int)
+        sizes = collections.defaultdict(int)
+        offset = packageHeader.size
+        for pos in xrange(self.count):
+            length = commandLength(self.data, offset)
+            kind = commandKind(self.data[offset])
+            counts[kind] += 1
+            sizes[kind] += length
+            offset += length
+
+        printKindStat(counts, sizes)
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+class Checkpoint:
+    """
+    Progress of a print, written while the print runs, so it can be resumed at
+    a layer boundary after the host or the USB connection died. The small
+    checkpoint file is rewritten each 'interval' seconds, the layer index of the
+    preprocessor or package is appended to <filename>.layers.
+
+    The checkpoint of an earlier print is only replaced when the first command
+    of this print has been acknowledged, so a print that is started by mistake
+    does not destroy it. Without a preprocessor the print can't be resumed, and
+    the checkpoint only removes the one of the earlier print.
+    """
+
+    # Seconds between the writes of the checkpoint
+    interval = 5.0
+
+    def __init__(self, filename, preprocessor, sourceHash, mode, packVersion=1):
+
+        self.filename = filename
+        self.preprocessor = preprocessor
+        self.info = { "sourceHash": sourceHash, "mode": mode, "packVersion": packVersion, "pos": 0, "layer": None }
+
+        # The checkpoint of an earlier print is replaced with the first write
+        self.replaced = False
+        self.layersFile = None
+        self.layersWritten = 0
+        self.lastWrite = 0
+
+    # Called with the number of acknowledged commands
+    def update(self, ackedPos):
+
+        if not self.replaced or time.time() - self.lastWrite >= self.interval:
+            self.write(ackedPos)
+
+    def write(self, ackedPos):
+
+        if not self.replaced:
+            if ackedPos < 1:
+                return
+            self.replaced = True
+            if self.preprocessor is None:
+                self.remove()
+                return
+            self.layersFile = open(self.filename + ".layers", "wb")
+
+        if self.layersFile is None:
+            return
+
+        layers = self.preprocessor.layers
+        for layer in layers[self.layersWritten:]:
+            self.layersFile.write(json.dumps(layer) + "\n")
+        self.layersWritten = len(layers)
+        self.layersFile.flush()
+
+        layer = findLayer(layers, ackedPos)
+        self.info["pos"] = ackedPos
+        self.info["layer"] = layer and layer["layer"]
+        self.info["time"] = time.time()
+
+        tmpFilename = self.filename + ".tmp"
+        f = open(tmpFilename, "wb")
+        json.dump(self.info, f)
+        f.close()
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+        os.rename(tmpFilename, self.filename)
+
+        self.lastWrite = time.time()
+
+    def close(self):
+        if self.layersFile:
+            self.layersFile.close()
+
+    # The print is done, the checkpoint is not needed anymore
+    def remove(self):
+
+        self.close()
+        for filename in [self.filename, self.filename + ".layers"]:
+            if os.path.exists(filename):
+                os.remove(filename)
+
+def loadCheckpoint(filename):
+    """
+    Read a checkpoint and its layer index, returns (info, layers).
+    """
+    f = open(filename, "rb")
+    info = json.load(f)
+    f.close()
+
+    layers = []
+    f = open(filename + ".layers", "rb")
+    for line in f:
+        try:
+            layers.append(json.loads(line))
+        except ValueError:
+            # Last line of a host that died while writing it
+            break
+    f.close()
+
+    return (info, layers)
+
+# The layer with the number 'layerNr', or the last layer that starts at or before
+# the command position 'pos'. None if there is no such layer.
+def findLayer(layers, pos, layerNr=None):
+
+    found = None
+
+    for layer in layers:
+        if layerNr is not None:
+            if layer["layer"] == layerNr:
+                return layer
+        elif layer["pos"] <= pos:
+            found = layer
+
+    return found
+
+class PrintLog:
+    """
+    Log of the print path. Messages above 'level' are dropped before they are
+    formatted. Messages up to 'ringLevel' are also kept unformatted in a ring
+    buffer of the last 'ringSize' messages, which is written out by dump(),
+    for example after an error. The formatted messages are written to 'out',
+    sys.stdout if None, with 'name' in front of them if it is given.
+    """
+
+    ERROR, WARN, INFO, DEBUG, TRACE = range(5)
+    levelNames = ["ERROR", "WARN", "INFO", "DEBUG", "TRACE"]
+
+    def __init__(self, level=INFO, ringLevel=DEBUG, ringSize=2000, out=None, summaryInterval=10.0, name=None):
+
+        self.out = out
+        self.prefix = ""
+        if name:
+            self.prefix = name + " "
+        self.ring = collections.deque(maxlen=ringSize)
+        self.setLevel(level, ringLevel)
+
+        # Seconds between the summaries of the counters
+        self.summaryInterval = summaryInterval
+        self.lastSummary = time.time()
+
+    def setLevel(self, level, ringLevel=None):
+
+        self.level = level
+        if ringLevel is not None:
+            self.ringLevel = ringLevel
+        self.maxLevel = max(self.level, self.ringLevel)
+
+    def log(self, level, msg, *args):
+
+        if level > self.maxLevel:
+            return
+
+        if level <= self.ringLevel:
+            self.ring.append((time.time(), level, msg, args))
+
+        if level <= self.level:
+            self.write(self.format(time.time(), level, msg, args))
+
+    def error(self, msg, *args):
+        self.log(PrintLog.ERROR, msg, *args)
+
+    def warn(self, msg, *args):
+        self.log(PrintLog.WARN, msg, *args)
+
+    def info(self, msg, *args):
+        self.log(PrintLog.INFO, msg, *args)
+
+    def debug(self, msg, *args):
+        if self.maxLevel >= PrintLog.DEBUG:
+            self.log(PrintLog.DEBUG, msg, *args)
+
+    def trace(self, msg, *args):
+        if self.maxLevel >= PrintLog.TRACE:
+            self.log(PrintLog.TRACE, msg, *args)
+
+    def format(self, t, level, msg, args):
+
+        if args:
+            msg = msg % args
+
+        return "%s%s.%03d %-5s %s\n" % (self.prefix, time.strftime("%H:%M:%S", time.localtime(t)), int(t * 1000) % 1000, self.levelNames[level], msg.rstrip("\n"))
+
+    def write(self, text):
+
+        out = self.out or sys.stdout
+        out.write(text)
+
+    # Write the messages in the ring buffer, and clear it
+    def dump(self):
+
+        self.write("---- last %d messages:\n" % len(self.ring))
+        self.write("".join([self.format(*entry) for entry in self.ring]))
+        self.write("---- end of messages\n")
+        self.ring.clear()
+
+    # True each 'summaryInterval' seconds
+    def summaryDue(self):
+
+        if time.time() - self.lastSummary < self.summaryInterval:
+            return False
+
+        self.lastSummary = time.time()
+        return True
 
 class SERIALDISCON(SerialException):
     pass
@@ -357,7 +1342,7 @@ class Printer(Serial):
         self.endTokens = None
         self.lastSend = 0
 
-        self.gcodeData = []
+        self.gcodeData = CommandStream([])
         self.gcodePos = 0
 
         # Retry counter on rx errors
@@ -372,9 +1357,29 @@ class Printer(Serial):
         self.startTime = None
 
         self.wantReply = None
-        self.wantAck = None
+        # Number of sent commands that are not acknowledged yet
+        self.acksPending = 0
+        # Number of replies to drop after a resend
+        self.staleReplies = 0
+        # Number of commands that may be sent without waiting for
+        # their ACK. 1 sends a command only after the ACK of the
+        # previous one.
+        self.sendWindow = 1
+        # Throughput counters
+        self.sentCommands = 0
+        self.sentBytes = 0
+        self.resends = 0
+        self.acks = 0
+        self.errors = 0
         # Part of a response read from printer
         self.recvPart = ""
+        # Bytes read from the serial port that are not returned by
+        # safeReadline() yet
+        self.recvBuffer = ""
+        # Checkpoint of a resumable print, or None
+        self.checkpoint = None
+        # Log of the print path
+        self.log = PrintLog()
 
     def initMode(self, mode):
 
@@ -388,6 +1393,7 @@ class Printer(Serial):
         self.timeout = 0.05
         self.writeTimeout = 10
         self.open()
+        self.recvBuffer = ""
 
         # Store usb information for later re-connection even if device
         # name has changed:
@@ -396,7 +1402,7 @@ class Printer(Serial):
         # ('/dev/ttyACM0', 'ttyACM0', 'USB VID:PID=2341:0042 SNR=75237333536351815111')]
         for (dev, name, usbid) in comports:
             if dev == device or name == device:
-                print "Found usbid %s for device %s" % (usbid, dev)
+                self.log.info("Found usbid %s for device %s", usbid, dev)
                 self.usbId = usbid
                 break
         
@@ -409,7 +1415,7 @@ class Printer(Serial):
         # ('/dev/ttyACM0', 'ttyACM0', 'USB VID:PID=2341:0042 SNR=75237333536351815111')]
         for (dev, name, usbid) in comports:
             if usbid == self.usbId:
-                print "reconnect(): found device %s, previous device: %s" % (dev, self.port)
+                self.log.info("reconnect(): found device %s, previous device: %s", dev, self.port)
                 self.close()
                 self.initSerial(dev, br=self.baudrate)
                 return
@@ -430,13 +1436,18 @@ class Printer(Serial):
             # Error:checksum mismatch, Last Line: 71388
             lastLine = int(recvLine.split(":")[2])
 
-            print "\nERROR:"
-            print "Reply: ", recvLine,
-            print "Scheduling resend of command:", lastLine+1
+            self.log.warn("Reply: %s, scheduling resend of command: %d", recvLine.strip(), lastLine+1)
+            self.errors += 1
 
             # assert(self.gcodePos == lastLine + 2)
 
             self.gcodePos = lastLine + 1
+            self.resends += 1
+
+            # The commands that were in flight after the failed one are
+            # rejected too, their replies come before the replies to the
+            # resent commands and are dropped.
+            self.staleReplies = max(0, self.acksPending - 1)
 
             # Wait 0.1 sec, give firmware time to drain buffers
             time.sleep(0.5)
@@ -446,8 +1457,11 @@ class Printer(Serial):
             if token in recvLine:
 
                 self.printing = False
+                self.errors += 1
 
                 s = "ERROR: reply from printer: '%s'" % recvLine
+                self.log.error(s)
+                self.log.dump()
                 self.showError(s)
 
                 # print "\nERROR:"
@@ -463,66 +1477,86 @@ class Printer(Serial):
     # Read a response from printer, "handle" exceptions
     def safeReadline(self):
 
-        result = ""
-
         while True:
+
+            line = self.nextRecvLine()
+            if line:
+                return line
+
+            # Read all waiting bytes at once, or wait for one byte
+            # up to the timeout.
             try:
-                c = self.read()
-                # print "c: ", c
+                data = self.read(max(1, self.inWaiting()))
+                # print "data: ", data
             except SerialException as ex:
-                print "Readline() Exception raised:", ex
+                self.log.warn("Readline() Exception raised: %s", ex)
 
                 self.rxErrors += 1
+                self.errors += 1
 
                 if self.rxErrors >= Printer.maxRXErrors:
-                    print "declare line is dead ..."
+                    self.log.error("declare line is dead ...")
+                    self.log.dump()
                     raise SERIALDISCON
 
                 time.sleep(0.1)
-                break
+                return ""
 
-            if not c:
-                break
+            if not data:
+                # Timeout, return the part of a line received so far
+                result = self.recvBuffer
+                self.recvBuffer = ""
+                return result
 
             # Received something, reset error counter
             self.rxErrors = 0
 
-            result += c
+            self.recvBuffer += data
 
-            if c == "\n":
-                break
+    # Take the next line or ACK from the receive buffer, an ACK is
+    # returned with a newline added.
+    def nextRecvLine(self):
 
-            if ord(c) == 0x6:
-                result += "\n"
-                break
+        nl = self.recvBuffer.find("\n")
+        ack = self.recvBuffer.find(chr(0x6))
 
-        return result
+        if ack >= 0 and (nl < 0 or ack < nl):
+            result = self.recvBuffer[:ack+1] + "\n"
+            self.recvBuffer = self.recvBuffer[ack+1:]
+            return result
+
+        if nl >= 0:
+            result = self.recvBuffer[:nl+1]
+            self.recvBuffer = self.recvBuffer[nl+1:]
+            return result
+
+        return ""
 
     # Monitor printer responses for a while (wait waitcount * 0.1 seconds)
     def readMore(self, waitcount=100):
 
-        print "waiting %.2f seconds for more messages..." % (waitcount/20.0)
+        self.log.debug("waiting %.2f seconds for more messages...", waitcount/20.0)
 
         for i in range(waitcount):
 
             try:
                 recvLine = self.safeReadline()        
             except SERIALDISCON:
-                print "Line disconnected in readMore"
+                self.log.warn("Line disconnected in readMore")
                 return
 
             if recvLine:
                 if ord(recvLine[0]) > 20:
-                    print "Reply: ", recvLine,
+                    self.log.info("Reply: %s", recvLine)
                 else:
-                    print "Reply: 0x%s" % recvLine.encode("hex")
+                    self.log.info("Reply: 0x%s", recvLine.encode("hex"))
 
     # Stop and reset the printer
     # xxx does not work right yet, um2 display still says 'preheating...'
     # yyy is this still the case?
     def reset(self):
 
-        print "\nResetting printer"
+        self.log.info("Resetting printer")
 
         # self._send("M29\n") # End sd write, response: "Done saving"
         # self._send("G28\n") # Home all Axis, response: ok
@@ -533,24 +1567,19 @@ class Printer(Serial):
         gcode = ["M29", "G28", "M84", "M104 S0", "M140 S0"]
         prep = Preprocessor("reset", gcode = map(lambda x: (x, None), gcode))
 
-        print "Reset code sequence: ", prep.prep
+        prep = list(prep.prep)
 
-        for (cmd, resp) in prep.prep:
+        self.log.debug("Reset code sequence: %r", prep)
+
+        for (cmd, resp) in prep:
             self.send(cmd)
             self.readMore(5)
 
-    # Send a command to the printer, add a newline if 
-    # needed.
+    # Send a command to the printer
     def send(self, cmd):
 
-        if isPackedCommand(cmd):
-        
-            print "\nSend: ", cmd.encode("hex")
-            self.write(cmd)
-        else:
-
-            print "\nSend: ", cmd,
-            self.write(cmd)
+        self.log.trace("Send: %r", cmd)
+        self.write(cmd)
 
 
     # The 'mainloop' process each command in the list 'gcode', check
@@ -561,11 +1590,15 @@ class Printer(Serial):
 
         self.startTime = time.time()
 
+        if isinstance(gcode, list):
+            gcode = CommandStream(gcode)
+
         self.gcodeData = gcode
         self.gcodePos = 0
 
         self.wantReply = wantReply
-        self.wantAck = False
+        self.acksPending = 0
+        self.resetCounters()
 
         self.recvPart = None
 
@@ -574,29 +1607,55 @@ class Printer(Serial):
         while self.processCommand(ev):
             pass
 
+    # Counters of one print, the summary of a print only counts its own commands
+    def resetCounters(self):
+
+        self.sentCommands = 0
+        self.sentBytes = 0
+        self.resends = 0
+        self.acks = 0
+        self.errors = 0
+        self.staleReplies = 0
+
+    def getSummary(self):
+        return "sent %d, acked %d, resent %d, errors %d, %s" % (self.sentCommands, self.acks, self.resends, self.errors, self.getThroughput())
+
+    def getThroughput(self):
+
+        duration = max(time.time() - self.startTime, 0.001)
+        return "%.1f gcodes/sec, %.1f kb/sec, %d resends" % (self.sentCommands/duration, self.sentBytes/duration/1024, self.resends)
+
     def processCommand(self, ev):
 
         if not self.printing and time.time() > self.postMonitor:
             return False
 
         # if time.time() <  self.postMonitor: 
-            # print "postmon: ", self.wantAck, self.wantReply, self.gcodePos
+            # print "postmon: ", self.acksPending, self.wantReply, self.gcodePos
         
         # if self.printing:
-            # print "print: ", self.wantAck, self.wantReply, self.gcodePos
+            # print "print: ", self.acksPending, self.wantReply, self.gcodePos
 
-        if self.printing and not self.wantAck and not self.wantReply and self.mode != "mon" and self.gcodePos < len(self.gcodeData):
+        # Send lines until the window of unacknowledged commands is full
+        while self.printing and self.acksPending < self.sendWindow and not self.wantReply and self.mode != "mon" and self.gcodeData.hasCommand(self.gcodePos):
             # send a line
-            (line, self.wantReply) = self.gcodeData[self.gcodePos]
+            try:
+                (line, self.wantReply) = self.gcodeData[self.gcodePos]
+            except IndexError as ex:
+                self.printing = False
+                self.showError("Can't send command %d: %s" % (self.gcodePos, str(ex)))
+                return True
+
             self.send(line)
             self.gcodePos += 1
             self.lastSend = time.time()
-            self.wantAck = True
+            self.acksPending += 1
+            self.sentCommands += 1
+            self.sentBytes += len(line)
 
             # Update gui
             if (self.gcodePos % 250) == 0:
-                duration = time.time() - self.startTime
-                self.showMessage("Sent %d/%d gcodes, %.1f gcodes/sec" % (self.gcodePos, len(self.gcodeData), self.gcodePos/duration))
+                self.showMessage("Sent %d gcodes, %s" % (self.gcodePos, self.getThroughput()))
 
             # We have sent a command to the printer, request more
             # cpu cycles from wx to process the answer quickly
@@ -628,22 +1687,32 @@ class Printer(Serial):
             self.recvPart = recvLine
             return True
 
+        if self.staleReplies and (recvLine[0] == chr(0x6) or ("Error:" in recvLine and "Last Line" in recvLine)):
+            self.log.debug("Dropping reply to a command sent before the resend: %s", recvLine)
+            self.staleReplies -= 1
+            return True
+
         if self.mode != "mon" and self.checkError(recvLine):
             # command resend
-            self.wantAck = False
+            self.acksPending = 0
             self.wantReply = None
             return True
 
-        if self.wantAck and recvLine[0] == chr(0x6):
-            print "ACK"
-            self.wantAck = False
+        if self.acksPending and recvLine[0] == chr(0x6):
+            self.log.trace("ACK")
+            self.acksPending -= 1
+            self.acks += 1
+            if self.checkpoint:
+                self.checkpoint.update(self.gcodePos - self.acksPending)
+            if self.log.summaryDue():
+                self.log.info("Summary: %s", self.getSummary())
             return True
 
         if self.wantReply and recvLine.startswith(self.wantReply):
-            print "Got Required reply: ", recvLine,
+            self.log.info("Got Required reply: %s", recvLine)
             self.wantReply = None
         else:
-            print "Reply: ", recvLine,
+            self.log.info("Reply: %s", recvLine)
 
         # self.endTokens = ['echo:enqueing "M84"']   
 
@@ -651,16 +1720,14 @@ class Printer(Serial):
 
             self.postMonitor = time.time() + 5
 
-            print "\n-----------------------------------------------"
-            print "Store statistics:"
-            print "-----------------------------------------------\n"
+            self.log.info("Store statistics: %s", self.getSummary())
             duration = time.time() - self.startTime
 
             if self.mode == "store":
-                self.showMessage("Sent %d gcodes in %.1f seconds, %.1f gcodes/sec." % (self.gcodePos, duration, self.gcodePos/duration))
+                self.showMessage("Sent %d gcodes in %.1f seconds, %s." % (self.gcodePos, duration, self.getThroughput()))
                 self.printing = False
             else:
-                self.showMessage("Sent %d gcodes in %.1f seconds, %.1f gcodes/sec.\nPlease wait for the print to finish.\n" % (self.gcodePos, duration, self.gcodePos/duration))
+                self.showMessage("Sent %d gcodes in %.1f seconds, %s.\nPlease wait for the print to finish.\n" % (self.gcodePos, duration, self.getThroughput()))
 
         else:
 
@@ -669,15 +1736,124 @@ class Printer(Serial):
 
                     self.postMonitor = time.time() + 5
 
-                    print "end-reply received, finished print..."
+                    self.log.info("end-reply received, finished print: %s", self.getSummary())
                     self.printing = False
 
+                    if self.checkpoint:
+                        self.checkpoint.remove()
+                        self.checkpoint = None
+
                     duration = time.time() - self.startTime
 
                     self.showMessage("Print finished. Duration: %.1f seconds, Downloadspeed: %.1f gcodes/sec.\n" % (duration, self.gcodePos/duration))
 
         return True
 
+class FarmPrinter(Printer):
+    """
+    A printer of a Farm, its messages are kept as its status.
+    """
+
+    def __init__(self, device):
+
+        Printer.__init__(self)
+
+        self.device = device
+        self.status = "Waiting"
+        self.error = None
+        self.package = None
+
+    def showMessage(self, s):
+        if s.strip():
+            self.status = s.strip().splitlines()[0]
+
+    def showError(self, s):
+        self.error = s.strip()
+        self.status = "ERROR: " + self.error
+
+class Farm:
+    """
+    Prints one job on several printers at once. The job is preprocessed once
+    into a print package, each printer sends from its own Package of it, so the
+    packed commands are shared read-only through the memory mapping. Each
+    printer is served by a worker thread.
+    """
+
+    def __init__(self, packageFile, devices, sendWindow=1, logLevel=PrintLog.INFO, logFile=None):
+
+        self.packageFile = packageFile
+
+        package = Package(packageFile)
+        self.mode = package.mode
+        package.close()
+
+        self.printers = []
+        for device in devices:
+            printer = FarmPrinter(device)
+            printer.initMode(self.mode)
+            printer.sendWindow = max(1, sendWindow)
+            printer.log = PrintLog(logLevel, out=logFile, name=device)
+            self.printers.append(printer)
+
+        self.threads = []
+
+    def start(self):
+
+        for printer in self.printers:
+            thread = threading.Thread(target=self.printJob, args=(printer, ))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    # Worker thread of a printer
+    def printJob(self, printer):
+
+        try:
+            printer.initSerial(printer.device)
+            printer.package = Package(self.packageFile)
+            printer.sendGcode(printer.package.prep, "echo:SD card ok")
+        except Exception as ex:
+            printer.printing = False
+            printer.showError("%s: %s" % (ex.__class__.__name__, str(ex)))
+
+        if printer.isOpen():
+            printer.close()
+
+    def isRunning(self):
+        return [thread for thread in self.threads if thread.is_alive()] != []
+
+    # Progress and throughput of each printer
+    def getStatus(self):
+
+        lines = ["%-16s %6s %9s  %s" % ("# Printer", "done", "commands", "status")]
+
+        for printer in self.printers:
+
+            progress = 0.0
+            if printer.package:
+                progress = printer.package.getProgress()
+
+            lines.append("%-16s %5.1f%% %9d  %s" % (printer.device, progress * 100, printer.gcodePos, printer.status))
+
+            if printer.printing and printer.startTime:
+                lines.append("%-16s %s" % ("", printer.getThroughput()))
+
+        return "\n".join(lines)
+
+    # Print the job on all printers, the status is written to 'out' each 'interval'
+    # seconds. Returns True if all printers finished without an error.
+    def run(self, interval=5, out=sys.stdout):
+
+        self.start()
+
+        while self.isRunning():
+            for thread in self.threads:
+                thread.join(interval / float(len(self.threads)))
+            out.write(self.getStatus() + "\n\n")
+            out.flush()
+
+        return [printer for printer in self.printers if printer.error] == []
+
 # 
 # Main
 #
@@ -685,22 +1861,44 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description='UltiPrint, print on UM2 over USB.')
     parser.add_argument("-d", dest="device", action="store", type=str, help="Device to use, default: /dev/ttyACM0.", default="/dev/ttyACM0")
+    parser.add_argument("-w", dest="window", action="store", type=int, help="Number of commands sent without waiting for their ACK, default: 1.", default=1)
+    parser.add_argument("-p", dest="packVersion", action="store", type=int, choices=[1, 2], help="Pack format, 2 needs firmware support, default: 1.", default=1)
+    parser.add_argument("-v", dest="verbose", action="count", help="More messages, -vv traces each command.", default=0)
 
-    subparsers = parser.add_subparsers(dest="mode", help='Mode: mon(itor)|print|store|reset|pre(process).')
+    subparsers = parser.add_subparsers(dest="mode", help='Mode: mon(itor)|print|resume|store|farm|compile|reset|pre(process)|bench.')
 
     sp = subparsers.add_parser("mon", help=u"Monitor printer.")
 
     sp = subparsers.add_parser("print", help=u"Print file.")
+    sp.add_argument("gfile", help="Input GCode file or print package (.upk).")
+
+    sp = subparsers.add_parser("resume", help=u"Resume the print of a file from its checkpoint <gfile>.checkpoint.")
+    sp.add_argument("-l", dest="layer", action="store", type=int, help="Layer to resume at, default: the layer of the last acknowledged command.", default=None)
     sp.add_argument("gfile", help="Input GCode file.")
 
     sp = subparsers.add_parser("store", help=u"Store file as USB.G on sd-card.")
+    sp.add_argument("gfile", help="Input GCode file or print package (.upk).")
+
+    sp = subparsers.add_parser("compile", help=u"Preprocess gcode into a print package (.upk) for print or store.")
+    sp.add_argument("-o", dest="output", action="store", type=str, help="Output file, default: <gfile>.upk.", default=None)
+    sp.add_argument("--store", dest="store", action="store_true", help="Compile for store mode instead of print mode.")
     sp.add_argument("gfile", help="Input GCode file.")
 
+    sp = subparsers.add_parser("farm", help=u"Print file on several printers at once, it is preprocessed once.")
+    sp.add_argument("-l", dest="log", action="store", type=str, help="File for the messages of the printers, default: farm.log.", default="farm.log")
+    sp.add_argument("-i", dest="interval", action="store", type=float, help="Status interval in seconds, default: 5.", default=5)
+    sp.add_argument("--store", dest="store", action="store_true", help="Store the file on the printers instead of printing it.")
+    sp.add_argument("gfile", help="Input GCode file or print package (.upk).")
+    sp.add_argument("devices", nargs="+", help="Devices of the printers.")
+
     sp = subparsers.add_parser("reset", help=u"Try to stop/reset printer.")
 
     sp = subparsers.add_parser("pre", help=u"Preprocess gcode, for debugging purpose.")
     sp.add_argument("gfile", help="Input GCode file.")
 
+    sp = subparsers.add_parser("bench", help=u"Compare speed and output of the line by line and the vectorized preprocessor.")
+    sp.add_argument("gfile", help="Input GCode file.")
+
     args = parser.parse_args()
     # print "args: ", args
 
@@ -708,12 +1906,81 @@ if __name__ == "__main__":
         #
         # Preprocess only
         #
-        prep = Preprocessor(args.mode, args.gfile)
+        prep = Preprocessor(args.mode, args.gfile, packVersion=args.packVersion)
+        for cmd in prep.prep:
+            pass
         prep.printStat();
         sys.exit(0)
 
+    if args.mode == 'compile':
+        #
+        # Preprocess into a print package
+        #
+        mode = args.store and "store" or "print"
+        prep = compilePackage(args.gfile, args.output or (args.gfile + ".upk"), mode, args.packVersion)
+        prep.printStat();
+        sys.exit(0)
+
+    if args.mode == 'farm':
+        #
+        # Print on several printers
+        #
+        mode = args.store and "store" or "print"
+        packageFile = args.gfile
+        if not packageFile.endswith(".upk"):
+            packageFile = args.gfile + ".upk"
+            compilePackage(args.gfile, packageFile, mode, args.packVersion)
+
+        # The messages of the printers go to the log file, the console shows the status
+        logFile = open(args.log, "a")
+        farm = Farm(packageFile, args.devices, args.window, PrintLog.INFO + args.verbose, logFile)
+        if farm.mode != mode:
+            print "Package %s is compiled for %s, not for %s." % (packageFile, farm.mode, mode)
+            sys.exit(1)
+
+        ok = farm.run(args.interval)
+        logFile.close()
+
+        print farm.getStatus()
+        sys.exit(not ok)
+
+    if args.mode == 'bench':
+        #
+        # Preprocessor benchmark
+        #
+        results = []
+        for vectorized in [False, True]:
+            prep = Preprocessor("print", args.gfile, vectorized=vectorized)
+            t = time.time()
+            cmds = list(prep.prep)
+            duration = time.time() - t
+            print "%s: %d lines in %.2f seconds, %.0f lines/sec" % (vectorized and "vectorized" or "line by line", len(cmds), duration, len(cmds)/duration)
+            results.append(cmds)
+        print "Output identical:", results[0] == results[1]
+        sys.exit(0)
+
+    resumeLayer = None
+    if args.mode == "resume":
+        #
+        # Find the layer to resume the print at
+        #
+        (info, layers) = loadCheckpoint(args.gfile + ".checkpoint")
+        f = open(args.gfile, "rb")
+        if hashGCode(f) != info["sourceHash"]:
+            print "%s has changed since the checkpoint was written." % args.gfile
+            sys.exit(1)
+        f.close()
+        resumeLayer = findLayer(layers, info["pos"], args.layer)
+        if not resumeLayer:
+            print "No layer to resume at, layers in the checkpoint: %s" % " ".join([str(layer["layer"]) for layer in layers])
+            sys.exit(1)
+        args.packVersion = info["packVersion"]
+        args.mode = "print"
+
     printer = Printer()
+    printer.log.setLevel(PrintLog.INFO + args.verbose)
     printer.initMode(args.mode)
+    printer.sendWindow = max(1, args.window)
     printer.initSerial(args.device)
 
     # Read left over garbage
@@ -737,7 +2004,18 @@ if __name__ == "__main__":
         sys.exit(0)
 
 
-    prep = Preprocessor(args.mode, args.gfile)
+    if args.gfile.endswith(".upk"):
+        prep = Package(args.gfile)
+        if prep.mode != args.mode:
+            print "Package %s is compiled for %s, not for %s." % (args.gfile, prep.mode, args.mode)
+            sys.exit(1)
+    else:
+        prep = Preprocessor(args.mode, args.gfile, packVersion=args.packVersion, resume=resumeLayer)
+
+        if args.mode == "print":
+            f = open(args.gfile, "rb")
+            printer.checkpoint = Checkpoint(args.gfile + ".checkpoint", prep, hashGCode(f), args.mode, args.packVersion)
+            f.close()
 
     printer.sendGcode(prep.prep, "echo:SD card ok")
 
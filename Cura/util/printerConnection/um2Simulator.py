@@ -0,0 +1,367 @@
+#!/usr/bin/env python
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+#
+# Copyright (C) 2014 Erwin Rieger
+#
+
+#
+# Simulated UM2 with the USB print firmware, for testing ultiprint.py
+# without a printer.
+#
+# The simulator creates a pty and behaves like the printer on the slave
+# side of it:
+#
+#   * Decodes the packed G0/G1/G10/G11 commands, the delta moves and
+#     short commands of pack format 2 and the text commands, checks the
+#     checksums and line numbers.
+#   * Replies with an ACK (0x6) for each accepted command, and with
+#     "Error:... Last Line: N" for a bad checksum or line number.
+#   * Replies "ok" to M110/M623/M28 and "Done saving" to M29, in print
+#     mode (after M623) followed by the end of print token.
+#   * Accepted commands go into a planner buffer that is executed at a
+#     fixed rate. If the buffer is full, the ACK is delayed and no more
+#     input is read, like the firmware does.
+#
+# Usage:
+#
+#   um2Simulator.py -l 2 -b 16 -r 500 -e 0.001
+#   ultiprint.py -d /dev/pts/<n> store file.gcode
+#
+
+import sys, os, pty, tty, time, struct, random, select, argparse, threading, collections
+
+import numpy
+
+import ultiprint
+
+packedNames = { 1: "G0", 2: "G1", 3: "G10", 4: "G11", 5: "G0", 6: "G1" }
+
+class Um2Simulator:
+
+    def __init__(self, latency=0.0, bufferSize=16, execRate=0, errorRate=0.0, seed=0, verbose=False):
+
+        # Seconds till a reply is sent
+        self.latency = latency
+        # Size of the planner buffer and commands executed per
+        # second, 0 executes each command at once
+        self.bufferSize = bufferSize
+        self.execRate = execRate
+        # Fraction of the commands that get a checksum error
+        self.errorRate = errorRate
+        self.random = random.Random(seed)
+        self.verbose = verbose
+
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.deviceName = os.ttyname(self.slave)
+
+        self.inBuffer = ""
+        # Replies to send: (time, data)
+        self.replies = collections.deque()
+        # Commands in the planner buffer and accepted commands waiting
+        # for a free place in it
+        self.planner = collections.deque()
+        self.waiting = collections.deque()
+        self.nextExec = 0
+
+        self.lastLine = -1
+        self.printMode = False
+
+        # Last X, Y and E values of pack format 2, and the values of the
+        # decoded command, which become the last values when it is accepted
+        self.lastValues = dict.fromkeys("xye")
+        self.decodedValues = {}
+        self.running = False
+        self.thread = None
+
+        self.resetStats()
+
+    def resetStats(self):
+
+        self.startTime = None
+        self.commands = 0
+        self.bytes = 0
+        self.errors = 0
+        self.injectedErrors = 0
+
+    def getStats(self):
+
+        duration = 0
+        if self.startTime:
+            duration = max(time.time() - self.startTime, 0.001)
+
+        rate = 0
+        if duration:
+            rate = self.commands / duration
+
+        return "%d commands, %d bytes, %d errors (%d injected), %.1f commands/sec" % (self.commands, self.bytes, self.errors, self.injectedErrors, rate)
+
+    def reply(self, data):
+
+        self.replies.append((time.time() + self.latency, data))
+
+    # Decode a packed command, returns (name, params, lineNr, checksum ok)
+    def decodePacked(self, cmd):
+
+        (cmdHex, flags) = struct.unpack("<BB", cmd[:2])
+        pos = 2
+        params = []
+        decodeOk = True
+
+        if cmdHex == 7:
+            (index, ) = struct.unpack("<B", cmd[pos:pos+1])
+            pos += 1
+            (name, paramType) = ultiprint.shortCommands[index]
+            if flags & 0x8:
+                params.append("%s%s" % (paramType, struct.unpack("<f", cmd[pos:pos+4])[0]))
+                pos += 4
+        else:
+            name = packedNames.get(cmdHex, "?%d" % cmdHex)
+
+            if flags & 0x80:
+                params.append("F%d" % struct.unpack("<H", cmd[pos:pos+2]))
+                pos += 2
+
+            for (bit, paramType) in [(0x40, "x"), (0x20, "y"), (0x10, "z"), (0x8, "e")]:
+
+                if not flags & bit:
+                    continue
+
+                if cmdHex >= 5 and paramType != "z":
+                    (delta, ) = struct.unpack("<h", cmd[pos:pos+2])
+                    pos += 2
+                    if self.lastValues[paramType] is None:
+                        decodeOk = False
+                        continue
+                    value = numpy.float32((self.lastValues[paramType] + delta) / ultiprint.deltaScales[paramType])
+                else:
+                    (value, ) = struct.unpack("<f", cmd[pos:pos+4])
+                    value = numpy.float32(value)
+                    pos += 4
+
+                if paramType != "z":
+                    last = None
+                    if abs(value) < ultiprint.deltaLimit:
+                        last = int(numpy.rint(float(value) * ultiprint.deltaScales[paramType]))
+                    self.decodedValues[paramType] = last
+
+                params.append("%s%f" % (paramType.upper(), value))
+
+        if flags & 0x4:
+            (lineNr, ) = struct.unpack("<H", cmd[pos:pos+2])
+            pos += 2
+        else:
+            (lineNr, ) = struct.unpack("<I", cmd[pos:pos+4])
+            pos += 4
+
+        chk = reduce(lambda x, y: x ^ y, map(ord, cmd[:pos]))
+
+        return (name, params, lineNr, decodeOk and chk == ord(cmd[pos]))
+
+    # Decode a text command "N<lineNr> <cmd>*<checksum>"
+    def decodeText(self, cmd):
+
+        (prefix, sep, chk) = cmd.strip().rpartition("*")
+        splitted = prefix.split()
+
+        try:
+            lineNr = int(splitted[0][1:])
+            chkOk = reduce(lambda x, y: x ^ y, map(ord, prefix)) == int(chk)
+        except (ValueError, IndexError):
+            return (cmd.strip(), [], None, False)
+
+        return (splitted[1], splitted[2:], lineNr, chkOk)
+
+    # Take the complete commands from the input buffer
+    def parseInput(self):
+
+        while self.inBuffer and not self.waiting:
+
+            if self.inBuffer[0] < "\n":
+                if len(self.inBuffer) < 2:
+                    return
+                length = ultiprint.commandLength(self.inBuffer, 0)
+                if len(self.inBuffer) < length:
+                    return
+                cmd = self.inBuffer[:length]
+                self.decodedValues = {}
+                decoded = self.decodePacked(cmd[:-1])
+            else:
+                end = self.inBuffer.find("\n")
+                if end < 0:
+                    return
+                cmd = self.inBuffer[:end+1]
+                if not cmd.strip():
+                    self.inBuffer = self.inBuffer[end+1:]
+                    continue
+                self.decodedValues = {}
+                decoded = self.decodeText(cmd)
+
+            self.inBuffer = self.inBuffer[len(cmd):]
+            self.handleCommand(cmd, *decoded)
+
+    def handleCommand(self, cmd, name, params, lineNr, chkOk):
+
+        if self.startTime is None:
+            self.startTime = time.time()
+
+        if self.verbose:
+            print "Recv: N%s %s %s" % (lineNr, name, " ".join(params))
+
+        if chkOk and self.errorRate and self.random.random() < self.errorRate:
+            self.injectedErrors += 1
+            chkOk = False
+
+        if not chkOk:
+            self.errors += 1
+            self.reply("Error:checksum mismatch, Last Line: %d\n" % self.lastLine)
+            return
+
+        if name == "M110":
+            self.lastLine = lineNr
+        elif lineNr != self.lastLine + 1:
+            self.errors += 1
+            self.reply("Error:Line Number is not Last Line Number+1, Last Line: %d\n" % self.lastLine)
+            return
+
+        self.lastLine = lineNr
+        self.commands += 1
+        self.bytes += len(cmd)
+
+        if name == "M110":
+            self.lastValues = dict.fromkeys("xye")
+        self.lastValues.update(self.decodedValues)
+
+        self.waiting.append(name)
+        self.fillPlanner()
+
+    # Move the accepted commands into the planner buffer while there is
+    # room, and send their ACK and replies.
+    def fillPlanner(self):
+
+        while self.waiting and (not self.execRate or len(self.planner) < self.bufferSize):
+
+            name = self.waiting.popleft()
+
+            if self.execRate:
+                if not self.planner:
+                    self.nextExec = time.time() + 1.0 / self.execRate
+                self.planner.append(name)
+
+            self.reply(chr(0x6))
+
+            if name == "M623":
+                self.printMode = True
+
+            if name in ["M110", "M623", "M28"]:
+                self.reply("ok\n")
+            elif name == "M29":
+                self.reply(ultiprint.Printer.endStoreToken + " file.\n")
+                if self.printMode:
+                    self.reply('echo:enqueing "M84"\n')
+                    self.printMode = False
+
+    def execute(self):
+
+        now = time.time()
+
+        while self.planner and now >= self.nextExec:
+            self.planner.popleft()
+            self.nextExec += 1.0 / self.execRate
+
+        self.fillPlanner()
+
+    def sendReplies(self):
+
+        now = time.time()
+
+        while self.replies and self.replies[0][0] <= now:
+            os.write(self.master, self.replies.popleft()[1])
+
+    def poll(self, timeout=0.01):
+
+        if self.replies:
+            timeout = max(0, min(timeout, self.replies[0][0] - time.time()))
+
+        (r, w, x) = select.select([self.master], [], [], timeout)
+
+        if r:
+            self.inBuffer += os.read(self.master, 4096)
+
+        self.parseInput()
+
+        if self.execRate:
+            self.execute()
+
+        self.sendReplies()
+
+    # Serve the printer until stop() is called. Until the first command
+    # arrives the firmware greeting is repeated, as the host waits for it
+    # before it starts sending.
+    def run(self, reportInterval=0):
+
+        self.running = True
+        lastGreeting = 0
+        lastReport = time.time()
+
+        while self.running:
+
+            if self.startTime is None and time.time() - lastGreeting > 1:
+                self.reply("start\necho:SD card ok\n")
+                lastGreeting = time.time()
+
+            self.poll()
+
+            if reportInterval and time.time() - lastReport > reportInterval:
+                print self.getStats()
+                sys.stdout.flush()
+                lastReport = time.time()
+
+    def start(self):
+
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+
+        self.running = False
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def close(self):
+
+        self.stop()
+        os.close(self.master)
+        os.close(self.slave)
+
+#
+# Main
+#
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Simulated UM2 with USB print firmware, on a pty.')
+    parser.add_argument("-l", dest="latency", action="store", type=float, help="Reply latency in ms, default: 0.", default=0)
+    parser.add_argument("-b", dest="bufferSize", action="store", type=int, help="Planner buffer size, default: 16.", default=16)
+    parser.add_argument("-r", dest="execRate", action="store", type=float, help="Commands executed per second, default: 0, no limit.", default=0)
+    parser.add_argument("-e", dest="errorRate", action="store", type=float, help="Fraction of commands with an injected checksum error, default: 0.", default=0)
+    parser.add_argument("-s", dest="seed", action="store", type=int, help="Random seed for the injected errors, default: 0.", default=0)
+    parser.add_argument("-i", dest="interval", action="store", type=float, help="Statistics interval in seconds, default: 5.", default=5)
+    parser.add_argument("-v", dest="verbose", action="store_true", help="Print each received command.")
+
+    args = parser.parse_args()
+
+    sim = Um2Simulator(args.latency / 1000.0, args.bufferSize, args.execRate, args.errorRate, args.seed, args.verbose)
+
+    print "Simulated UM2 on", sim.deviceName
+    sys.stdout.flush()
+
+    try:
+        sim.run(args.interval)
+    except KeyboardInterrupt:
+        pass
+
+    print sim.getStats()
@@ -8,19 +8,54 @@ Based on serialConnection.py,
 Copyright (C) 2014 Erwin Rieger: heavy modifications for UM2 USB print.
 """
 
+import os
+import re
 import time
+import threading
+import traceback
+import collections
 
 import serial
 import ultiprint
 
 from Cura.util import profile
 from Cura.util.printerConnection.printerConnectionBase import printerConnectionBase
-from Cura.util.printerConnection.ultiprint import Preprocessor, Printer
+from Cura.util.printerConnection.ultiprint import Preprocessor, Printer, Package, CommandStream, Checkpoint, PrintLog, hashGCode, writePackage, loadCheckpoint, findLayer
 from Cura.util.printerConnection.serialConnection import serialConnectionGroup
 
 def isPackedCommand(cmd):
 	return cmd[0] < "\n"
 
+def getPackagePath():
+	return os.path.join(profile.getBasePath(), 'print_packages')
+
+def getCheckpointPath(printerId):
+	"""
+	Path of the checkpoint of the printer with this usb id or port name, each printer has its own checkpoint.
+	"""
+	return os.path.join(profile.getBasePath(), 'usb_print_checkpoint_%s' % (re.sub('[^A-Za-z0-9]+', '_', printerId).strip('_')))
+
+def _removeOldPackages(packagePath, newPackageSize = 0):
+	"""
+	Remove the least recently used print packages until they and a new package of newPackageSize bytes fit in the
+	'usb_print_package_cache_size' preference.
+	"""
+	maxSize = profile.getPreferenceFloat('usb_print_package_cache_size') * 1024 * 1024 - newPackageSize
+	entries = []
+	totalSize = 0
+	for name in os.listdir(packagePath):
+		if name.endswith('.upk'):
+			path = os.path.join(packagePath, name)
+			size = os.stat(path).st_size
+			entries.append((os.stat(path).st_mtime, size, path))
+			totalSize += size
+	entries.sort()
+	for mtime, size, path in entries:
+		if totalSize <= maxSize:
+			break
+		os.remove(path)
+		totalSize -= size
+
 class Um2UsbConnectionGroup(serialConnectionGroup):
 	"""
 	The serial connection group. Keeps track of all available serial ports,
@@ -74,13 +109,20 @@ class Um2UsbConnection(printerConnectionBase, Printer):
 		self._commStateString = ""
 
 		self.dataStream = None
+		self.preprocessor = None
+
+		# The serial port is served by this thread during a print, so a busy gui does not stall the printer.
+		self._ioThread = None
+		self._ioStop = False
+		# Messages for the callbacks, filled by the I/O thread and emptied by onIdle in the gui thread.
+		self._messages = collections.deque()
 
 	def showMessage(self, s):
 		print "showMessage: %s" % s
 		self._commStateString = s
-		# Pass string also to _doCallback, to skip "rate limiting" in 
+		# The string is passed to _doCallback from onIdle, to skip "rate limiting" in
 		# doPrinterConnectionUpdate()
-		self._doCallback(s)
+		self._messages.append(s)
 
 	def showError(self, s):
 
@@ -141,16 +183,71 @@ class Um2UsbConnection(printerConnectionBase, Printer):
 		if self.isPrinting() or len(self.dataStream) < 1:
 			return
 
-		self.showMessage("Preprocessing gcode.")
+		self._startPrint(self._getPrintStream(), int(profile.getMachineSetting('um2_usb_pack_format')))
+
+	def hasResume(self):
+		return True
+
+	def canResume(self):
+		return self.dataStream is not None and os.path.isfile(self._getCheckpointPath())
+
+	def _getCheckpointPath(self):
+		# The usb id stays the same when the printer gets another device name after a reconnect
+		return getCheckpointPath(self.usbId or self._portName)
 
-		self.dataStream.seekStart();
-		prep = Preprocessor(self.mode, stream = self.dataStream)
+	#Resume the print of the loaded file at the layer of the last acknowledged command in the checkpoint
+	def resumePrint(self):
 
-		prep.printStat()
+		if self.isPrinting() or not self.canResume():
+			return
 
-		self.gcodeData = prep.prep
+		try:
+			(info, layers) = loadCheckpoint(self._getCheckpointPath())
+		except:
+			traceback.print_exc()
+			self.showError("Can't read the checkpoint of the print.")
+			return
+
+		layer = findLayer(layers, info['pos'])
+		if info['mode'] != self.mode:
+			self.showError("The checkpoint is of a print in %s mode, not in %s mode." % (info['mode'], self.mode))
+		elif layer is None:
+			self.showError("The print did not reach a layer to resume at.")
+		else:
+			# The gcode is compared with the checkpoint by the I/O thread, see _preparePrint
+			self._startPrint(self._getPrintStream(), info['packVersion'], info['sourceHash'], layer)
+
+	def _getPrintStream(self):
+		# The gcode is preprocessed while it is sent. A clone of the stream is used, so
+		# other readers of the gcode data don't change the read position during the print.
+		stream = self.dataStream
+		if hasattr(stream, "clone"):
+			stream = stream.clone()
+		stream.seekStart()
+		return stream
+
+	def _startPrint(self, stream, packVersion, resumeHash=None, resumeLayer=None):
+
+		# The monitor thread of a cancelled or finished print must not serve the port any more.
+		self._stopIOThread()
+
+		if isinstance(self.preprocessor, Package):
+			self.preprocessor.close()
+		self.preprocessor = None
+
+		if self.checkpoint:
+			self.checkpoint.close()
+		self.checkpoint = None
+
+		# Nothing is sent until the I/O thread has set up the commands
+		self.gcodeData = CommandStream([])
 		self.gcodePos = 0
 
+		self.sendWindow = max(1, int(profile.getMachineSettingFloat('um2_usb_send_window')))
+		self.log.setLevel(PrintLog.levelNames.index(profile.getPreference('usb_print_log_level')))
+		self.acksPending = 0
+		self.resetCounters()
+
 		self.printing = True
 
 		self.startTime = time.time()
@@ -159,17 +256,121 @@ class Um2UsbConnection(printerConnectionBase, Printer):
 
 		self.showMessage("Start %s." % self.mode)
 
+		# Hashing and preprocessing read the gcode, that is done by the I/O thread so the gui stays responsive.
+		self._startIOThread(lambda: self._preparePrint(stream, packVersion, resumeHash, resumeLayer))
+
+	def _preparePrint(self, stream, packVersion, resumeHash, resumeLayer):
+		"""
+		Set up the commands and the checkpoint of the print, from the print package of the gcode when
+		there is one. Returns False when the print can't start or was cancelled.
+		"""
+		usePackage = profile.getPreference('usb_print_package_cache') == 'True' and resumeLayer is None
+		sourceHash = None
+		if usePackage or self.mode == "print":
+			sourceHash = hashGCode(stream, lambda: self._ioStop)
+			if sourceHash is None:
+				return False
+			stream.seekStart()
+
+		if resumeHash is not None and sourceHash != resumeHash:
+			self.printing = False
+			self.showError("The checkpoint is of another print.")
+			return False
+
+		if usePackage:
+			self.gcodeData = self._loadPackage(stream, packVersion, sourceHash)
+		else:
+			self.preprocessor = Preprocessor(self.mode, stream = stream, packVersion = packVersion, resume = resumeLayer)
+			self.gcodeData = self.preprocessor.prep
+
+		# Prints can be resumed, stores only replace the checkpoint of an earlier print.
+		layerSource = None
+		if self.mode == "print":
+			layerSource = self.preprocessor
+		try:
+			self.checkpoint = Checkpoint(self._getCheckpointPath(), layerSource, sourceHash, self.mode, packVersion)
+		except:
+			traceback.print_exc()
+
+		self.startTime = time.time()
+		return True
+
+	def _startIOThread(self, prepare=None):
+		self._ioStop = False
+		self._ioThread = threading.Thread(target=self._ioThreadLoop, args=(prepare,))
+		self._ioThread.daemon = True
+		self._ioThread.start()
+
+	def _stopIOThread(self):
+		if self._ioThread is None:
+			return
+		self._ioStop = True
+		if self._ioThread is not threading.current_thread():
+			self._ioThread.join()
+		self._ioThread = None
+
+	def _ioThreadLoop(self, prepare):
+		ev = ultiprint.DummyEvent()
+		try:
+			if prepare is not None and not prepare():
+				return
+			while not self._ioStop and self.processCommand(ev):
+				pass
+		except:
+			traceback.print_exc()
+			self.printing = False
+			self.showError("Error in the printer communication: %s" % (traceback.format_exc().splitlines()[-1]))
+
+	def _loadPackage(self, stream, packVersion, sourceHash):
+		"""
+		Get the commands from the print package of this gcode and mode when there is one. Else
+		preprocess the gcode, and write the package while the commands are sent.
+		"""
+		packagePath = getPackagePath()
+		suffix = ''
+		if packVersion != 1:
+			suffix = '_v%d' % packVersion
+		filename = os.path.join(packagePath, '%s_%s%s.upk' % (sourceHash, self.mode, suffix))
+		if os.path.isfile(filename):
+			try:
+				self.preprocessor = Package(filename)
+				os.utime(filename, None)
+				print "Printing from package:", filename
+				return self.preprocessor.prep
+			except:
+				traceback.print_exc()
+				os.remove(filename)
+
+		self.preprocessor = Preprocessor(self.mode, stream = stream, packVersion = packVersion)
+		try:
+			if not os.path.isdir(packagePath):
+				os.makedirs(packagePath)
+			#The package is not bigger than the gcode
+			_removeOldPackages(packagePath, len(stream))
+		except:
+			traceback.print_exc()
+			return self.preprocessor.prep
+		return CommandStream(writePackage(self.preprocessor.prep, filename, sourceHash, self.mode, self.preprocessor), Preprocessor.lookahead, Preprocessor.resendWindow)
+
 	#Abort the previously loaded print file
 	def cancelPrint(self, immediate=False):
 
+		self._stopIOThread()
+
 		self.printing = False
 
+		if self.checkpoint:
+			# Keep the checkpoint, so the print can be resumed later
+			self.checkpoint.write(self.gcodePos - self.acksPending)
+			self.checkpoint.close()
+			self.checkpoint = None
+
 		if not immediate:
 			self.postMonitor = time.time() + 10
 
-		if self.wantAck:
-			print "Clearing stale wantAck..."
-			self.wantAck = False
+		if self.acksPending:
+			print "Clearing stale acksPending..."
+			self.acksPending = 0
 
 		if self.wantReply:
 			print "Clearing stale wantReply..."
@@ -190,16 +391,20 @@ class Um2UsbConnection(printerConnectionBase, Printer):
 
 		self.showMessage("Stopped.")
 
+		if not immediate:
+			# Monitor the printer replies after the reset
+			self._startIOThread()
+
 	def isPrinting(self):
 		return self.printing
 
 	#Amount of progression of the current print file. 0.0 to 1.0
 	def getPrintProgress(self):
 
-		if not len(self.gcodeData):
+		if self.preprocessor is None:
 			return 0.0
 
-		return float(self.gcodePos) / len(self.gcodeData)
+		return self.preprocessor.getProgress()
 
 	# Return if the printer with this connection type is available
 	def isAvailable(self):
@@ -225,6 +430,7 @@ class Um2UsbConnection(printerConnectionBase, Printer):
 		if self.printing:
 			self.cancelPrint(True)
 
+		self._stopIOThread()
 		self.close()
 
 	#Is the active connection open right now.
@@ -302,10 +508,11 @@ class Um2UsbConnection(printerConnectionBase, Printer):
 
 	def onIdle(self, ev):
 		"""
-		Called if gui is idle, to perform 'background tasks'
+		Called if gui is idle and from a timer, passes the messages of the I/O thread to the callbacks.
 		"""
 
-		self.processCommand(ev)
+		while self._messages:
+			self._doCallback(self._messages.popleft())
 
 
 
@@ -497,6 +497,15 @@ setting('model_colour2', '#CB3030', str, 'preference', 'hidden').setLabel(_('Mod
 setting('model_colour3', '#DDD93C', str, 'preference', 'hidden').setLabel(_('Model colour (3)'), _('Display color for third extruder'))
 setting('model_colour4', '#4550D3', str, 'preference', 'hidden').setLabel(_('Model colour (4)'), _('Display color for forth extruder'))
 setting('printing_window', 'Basic', ['Basic'], 'preference', 'hidden').setLabel(_('Printing window type'), _('Select the interface used for USB printing.'))
+setting('gcode_interpreter', 'Classic', ['Classic', 'Vectorized'], 'preference', 'hidden').setLabel(_('GCode interpreter'), _('Select the engine used to load the toolpath for the layer view.\nClassic parses the GCode line by line.\nVectorized parses the GCode in large blocks, which is about twice as fast on big files.'))
+setting('gcode_layer_cache', 'False', bool, 'preference', 'hidden').setLabel(_('Cache GCode layers'), _('Store the layer view of loaded GCode on disk, so opening the same GCode again does not need to parse it again.'))
+setting('gcode_layer_cache_size', '500', float, 'preference', 'hidden').setRange(0).setLabel(_('GCode layer cache size (MB)'), _('The maximum amount of disk space used to store the layers of loaded GCode.'))
+setting('slice_cache_memory_size', '200', float, 'preference', 'hidden').setRange(0).setLabel(_('Slice result memory cache size (MB)'), _('The maximum size of the slice results kept in memory, so going back to an earlier configuration does not need the engine.'))
+setting('slice_cache_disk', 'False', bool, 'preference', 'hidden').setLabel(_('Keep slice results on disk'), _('Store the results of the slicing engine on disk, so slicing the same models with the same settings again does not need the engine, also after a restart of Cura.'))
+setting('slice_cache_disk_size', '1000', float, 'preference', 'hidden').setRange(0).setLabel(_('Slice result cache size (MB)'), _('The maximum amount of disk space used to store slice results.'))
+setting('usb_print_package_cache', 'True', bool, 'preference', 'hidden').setLabel(_('Cache UM2 USB print packages'), _('Store the preprocessed GCode of a UM2 USB print on disk, so printing the same GCode again starts without preprocessing.'))
+setting('usb_print_package_cache_size', '500', float, 'preference', 'hidden').setRange(0).setLabel(_('UM2 USB print package cache size (MB)'), _('The maximum amount of disk space used to store UM2 USB print packages.'))
+setting('usb_print_log_level', 'INFO', ['ERROR', 'WARN', 'INFO', 'DEBUG', 'TRACE'], 'preference', 'hidden').setLabel(_("USB print log level"), _("Messages of the UM2 USB print connection written to the log. TRACE logs each command and slows down the print."))
 
 setting('window_maximized', 'True', bool, 'preference', 'hidden')
 setting('window_pos_x', '-1', float, 'preference', 'hidden')
@@ -527,6 +536,8 @@ setting('steps_per_e', '0', float, 'machine', 'hidden').setLabel(_("E-Steps per
 setting('serial_port', 'AUTO', str, 'machine', 'hidden').setLabel(_("Serial port"), _("Serial port to use for communication with the printer"))
 setting('serial_port_auto', '', str, 'machine', 'hidden')
 setting('serial_baud', 'AUTO', str, 'machine', 'hidden').setLabel(_("Baudrate"), _("Speed of the serial port communication\nNeeds to match your firmware settings\nCommon values are 250000, 115200, 57600"))
+setting('um2_usb_send_window', '1', int, 'machine', 'hidden').setRange(1,16).setLabel(_("UM2 USB send window"), _("Number of commands sent to an Ultimaker2 over USB without waiting for their acknowledge.\n1 waits for each command, higher values keep the printer busy on prints with many small segments."))
+setting('um2_usb_pack_format', '1', ['1', '2'], 'machine', 'hidden').setLabel(_("UM2 USB pack format"), _("Format of the packed commands sent to an Ultimaker2 over USB.\n2 sends moves as small deltas and common M codes in a short form, it needs a firmware that supports it."))
 setting('serial_baud_auto', '', int, 'machine', 'hidden')
 
 setting('extruder_head_size_min_x', '0.0', float, 'machine', 'hidden').setLabel(_("Head size towards X min (mm)"), _("The head size when printing multiple objects, measured from the tip of the nozzle towards the outer part of the head. 75mm for an Ultimaker if the fan is on the left side."))
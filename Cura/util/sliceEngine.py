@@ -18,8 +18,11 @@ import socket
 import struct
 import errno
 import inspect
+import shutil
+import collections
+import cPickle as pickle
 
-from Cura.util.bigDataStorage import BigDataStorage
+from Cura.util.bigDataStorage import DiskDataStorage
 from Cura.util import profile
 from Cura.util import pluginInfo
 from Cura.util import version
@@ -49,6 +52,86 @@ def getEngineFilename():
 		return '/usr/local/bin/CuraEngine'
 	return ''
 
+class PolygonList(object):
+	"""
+	All polygons of one type in one layer, stored as one (N,3) float32 vertex array and an array with the start offset of each polygon.
+	The offsets array has one extra entry at the end with the total vertex count, so polygon i is points[offsets[i]:offsets[i+1]].
+	"""
+	__slots__ = ('_data',)
+
+	def __init__(self):
+		#Points and offsets are replaced as one tuple, so the GUI thread never sees a half updated list while the engine sends polygons.
+		self._data = (numpy.zeros((0, 3), numpy.float32), numpy.zeros(1, numpy.int64))
+
+	def append(self, points, lengths):
+		"""
+		Add polygons from an (N,3) vertex array and the vertex count of each polygon in it.
+		"""
+		oldPoints, oldOffsets = self._data
+		offsets = numpy.cumsum(numpy.array(lengths, numpy.int64)) + oldOffsets[-1]
+		if len(oldPoints) > 0:
+			points = numpy.concatenate((oldPoints, points))
+		self._data = (points, numpy.concatenate((oldOffsets, offsets)))
+
+	def getPoints(self):
+		return self._data[0]
+
+	def getOffsets(self):
+		return self._data[1]
+
+	def __len__(self):
+		return len(self._data[1]) - 1
+
+	def __getitem__(self, index):
+		points, offsets = self._data
+		return points[offsets[index]:offsets[index + 1]]
+
+	def getMemorySize(self):
+		return self._data[0].nbytes + self._data[1].nbytes
+
+	def __getstate__(self):
+		return self._data
+
+	def __setstate__(self, state):
+		self._data = state
+
+class PolygonLayer(object):
+	"""
+	The polygons the engine sent for one layer, a PolygonList for each type of polygon.
+	"""
+	__slots__ = ('_types',)
+
+	def __init__(self):
+		self._types = {}
+
+	def add(self, typeName, points, lengths):
+		if typeName not in self._types:
+			self._types[typeName] = PolygonList()
+		self._types[typeName].append(points, lengths)
+
+	def getZ(self, typeName):
+		"""
+		:return: The height of the polygons of this type, or None when there are none.
+		"""
+		if typeName not in self._types or len(self._types[typeName].getPoints()) < 1:
+			return None
+		return self._types[typeName].getPoints()[0][2]
+
+	def getMemorySize(self):
+		return sum(map(lambda polygons: polygons.getMemorySize(), self._types.values()))
+
+	def __contains__(self, typeName):
+		return typeName in self._types
+
+	def __getitem__(self, typeName):
+		return self._types[typeName]
+
+	def __getstate__(self):
+		return self._types
+
+	def __setstate__(self, state):
+		self._types = state
+
 class EngineResult(object):
 	"""
 	Result from running the CuraEngine.
@@ -56,7 +139,7 @@ class EngineResult(object):
 	"""
 	def __init__(self):
 		self._engineLog = []
-		self._gcodeData = BigDataStorage()
+		self._gcodeData = DiskDataStorage()
 		self._polygons = []
 		self._replaceInfo = {}
 		self._success = False
@@ -66,8 +149,12 @@ class EngineResult(object):
 		self._profileString = profile.getProfileString()
 		self._preferencesString = profile.getPreferencesString()
 		self._gcodeInterpreter = gcodeInterpreter.gcode()
+		self._gcodeLayerIndex = None
 		self._gcodeLoadThread = None
 		self._finished = False
+		#Engine arguments that change the toolpath, and the start and end code the GCode was made with. Used to update the result without running the engine again.
+		self._geometryKey = None
+		self._headerFooterCode = None
 
 	def getFilamentWeight(self, e=0):
 		#Calculates the weight of the filament in kg
@@ -108,7 +195,7 @@ class EngineResult(object):
 		return self._gcodeData
 
 	def setGCode(self, gcode):
-		self._gcodeData = BigDataStorage()
+		self._gcodeData = DiskDataStorage()
 		self._gcodeData.write(gcode)
 		self._replaceInfo = {}
 
@@ -120,6 +207,7 @@ class EngineResult(object):
 
 	def setFinished(self, result):
 		if result:
+			#The Replace: keys are patched in place in the stored GCode, no data is copied.
 			for k, v in self._replaceInfo.items():
 				self._gcodeData.replaceAtStart(k, v)
 		self._finished = result
@@ -127,17 +215,111 @@ class EngineResult(object):
 	def isFinished(self):
 		return self._finished
 
+	def updateHeaderFooter(self, headerFooterCode):
+		"""
+		Create a finished EngineResult with the same toolpath, where the start and end code in the GCode are replaced.
+		:param headerFooterCode: Dictionary with the new value of each setting in Engine.headerFooterSettings.
+		:return: The updated EngineResult, or None when the old start or end code cannot be found in the GCode.
+		"""
+		if headerFooterCode == self._headerFooterCode:
+			return self
+		size = len(self._gcodeData)
+		oldStart = self._headerFooterCode['startCode']
+		oldEnd = self._headerFooterCode['endCode']
+		newStart = headerFooterCode['startCode']
+		newEnd = headerFooterCode['endCode']
+		startIdx = 0
+		endIdx = size
+		if oldStart != newStart:
+			if oldStart == '':
+				return None
+			#The start code is at the beginning of the file, but the Replace: keys in it are already replaced.
+			head = self._gcodeData.readRange(0, 64 * 1024 + len(oldStart))
+			startIdx = head.find(self._replaceTags(oldStart))
+			if startIdx < 0:
+				startIdx = head.find(oldStart)
+			if startIdx < 0:
+				return None
+		else:
+			oldStart = newStart = ''
+		if oldEnd != newEnd:
+			if oldEnd == '':
+				return None
+			tailStart = max(0, size - 64 * 1024 - len(oldEnd))
+			endIdx = self._gcodeData.readRange(tailStart, size - tailStart).rfind(oldEnd)
+			if endIdx < 0:
+				return None
+			endIdx += tailStart
+		else:
+			oldEnd = newEnd = ''
+		if endIdx < startIdx + len(oldStart):
+			return None
+
+		result = EngineResult()
+		result._engineLog = self._engineLog
+		result._polygons = self._polygons
+		result._replaceInfo = self._replaceInfo
+		result._printTimeSeconds = self._printTimeSeconds
+		result._filamentMM = self._filamentMM[:]
+		result._modelHash = self._modelHash
+		result._geometryKey = self._geometryKey
+		result._headerFooterCode = headerFooterCode
+		result._gcodeData.writeRange(self._gcodeData, 0, startIdx)
+		result._gcodeData.write(newStart)
+		result._gcodeData.writeRange(self._gcodeData, startIdx + len(oldStart), endIdx - startIdx - len(oldStart))
+		result._gcodeData.write(newEnd)
+		result._gcodeData.writeRange(self._gcodeData, endIdx + len(oldEnd), size - endIdx - len(oldEnd))
+		result.setFinished(True)
+		return result
+
+	def getCacheCopy(self):
+		"""
+		Create a finished EngineResult for SliceResultCache that shares the polygons and the GCode of this result, but not the layers loaded from the GCode.
+		"""
+		result = EngineResult()
+		for k in ['_engineLog', '_polygons', '_replaceInfo', '_printTimeSeconds', '_filamentMM', '_modelHash', '_geometryKey', '_headerFooterCode', '_profileString', '_preferencesString']:
+			setattr(result, k, getattr(self, k))
+		result._gcodeData = self._gcodeData.clone()
+		result._finished = True
+		return result
+
+	def getMemorySize(self):
+		"""
+		:return: The bytes used by the polygons and the GCode of this result, the size SliceResultCache counts.
+		"""
+		return sum(map(lambda layer: layer.getMemorySize(), self._polygons)) + len(self._gcodeData)
+
+	def _replaceTags(self, code):
+		for k, v in self._replaceInfo.items():
+			code = code.replace(k, (v + ' ' * len(k))[:len(k)])
+		return code
+
 	def getGCodeLayers(self, loadCallback):
 		if not self._finished:
 			return None
 		if self._gcodeInterpreter.layerList is None and self._gcodeLoadThread is None:
 			self._gcodeInterpreter.progressCallback = self._gcodeInterpreterCallback
-			self._gcodeLoadThread = threading.Thread(target=lambda : self._gcodeInterpreter.load(self._gcodeData.clone()))
+			self._gcodeLoadThread = threading.Thread(target=self._loadGCodeLayers)
 			self._gcodeLoadCallback = loadCallback
 			self._gcodeLoadThread.daemon = True
 			self._gcodeLoadThread.start()
 		return self._gcodeInterpreter.layerList
 
+	def getGCodeLayerIndex(self):
+		"""
+		:return: The gcodeLayerIndex to decode single layers while the full layer list is still loading, or None when it is not available.
+		"""
+		return self._gcodeLayerIndex
+
+	def _loadGCodeLayers(self):
+		#First build the layer index, so the layers the user looks at can be shown before the whole GCode is loaded.
+		self._gcodeLayerIndex = gcodeInterpreter.gcodeLayerIndex(self._gcodeData.clone())
+		if self._gcodeLoadCallback(self, 0.0):
+			return
+		self._gcodeInterpreter.load(self._gcodeData.clone())
+		#All layers are loaded, the index is no longer needed.
+		self._gcodeLayerIndex = None
+
 	def _gcodeInterpreterCallback(self, progress):
 		if len(self._gcodeInterpreter.layerList) % 5 == 0:
 			time.sleep(0.1)
@@ -167,6 +349,190 @@ class EngineResult(object):
 			import traceback
 			traceback.print_exc()
 
+class _SocketReader(object):
+	"""
+	Buffered reader for the engine socket. The data is received with recv_into in one preallocated buffer,
+	so the many small reads of the polygon messages do not each need a system call and a new string.
+	Big reads are received directly into the target memory.
+	"""
+	def __init__(self, sock, bufferSize = 256 * 1024):
+		self._sock = sock
+		self._buffer = bytearray(bufferSize)
+		self._view = memoryview(self._buffer)
+		self._start = 0
+		self._end = 0
+
+	def _fill(self, size):
+		#Make sure at least size bytes are in the buffer.
+		if size > len(self._buffer):
+			buffer = bytearray(size)
+			buffer[0:self._end - self._start] = self._buffer[self._start:self._end]
+			self._buffer = buffer
+			self._view = memoryview(self._buffer)
+			self._end -= self._start
+			self._start = 0
+		elif self._start + size > len(self._buffer):
+			self._buffer[0:self._end - self._start] = self._buffer[self._start:self._end]
+			self._end -= self._start
+			self._start = 0
+		while self._end - self._start < size:
+			received = self._sock.recv_into(self._view[self._end:])
+			if received < 1:
+				raise EOFError()
+			self._end += received
+
+	def readInt(self):
+		self._fill(4)
+		value = struct.unpack_from('@i', self._buffer, self._start)[0]
+		self._start += 4
+		return value
+
+	def readInts(self, count):
+		self._fill(4 * count)
+		values = struct.unpack_from('@%di' % (count), self._buffer, self._start)
+		self._start += 4 * count
+		return values
+
+	def read(self, size):
+		self._fill(size)
+		data = str(self._buffer[self._start:self._start + size])
+		self._start += size
+		return data
+
+	def readPolygons(self, count):
+		"""
+		Read count polygons, each sent as the point count followed by the points as pairs of int64.
+		:return: A bytearray with the points of all polygons after each other, and a list with the point count of each polygon.
+		"""
+		data = bytearray()
+		lengths = []
+		for n in xrange(0, count):
+			length = self.readInt()
+			lengths.append(length)
+			size = length * 16
+			while size > 0:
+				if self._start == self._end:
+					self._fill(1)
+				chunk = min(size, self._end - self._start)
+				data += self._view[self._start:self._start + chunk]
+				self._start += chunk
+				size -= chunk
+		return data, lengths
+
+class SliceResultCache(object):
+	"""
+	Least recently used cache of finished EngineResults, keyed on the geometry of the models and the engine command line.
+	The results are kept in memory up to the 'slice_cache_memory_size' preference, and when the 'slice_cache_disk' preference is
+	enabled also stored on disk, so going back to an earlier configuration or undoing a move gives the earlier result without running the engine.
+	The memory size counts the polygons and the GCode, which is kept in a temporary file. Layers loaded for the layer view are not cached.
+	"""
+	def __init__(self):
+		self._results = collections.OrderedDict()
+		self._memorySize = 0
+		self._lock = threading.Lock()
+
+	def getCachePath(self):
+		return os.path.join(profile.getBasePath(), 'slice_cache')
+
+	def get(self, key):
+		"""
+		:return: The cached EngineResult for this key, or None.
+		"""
+		self._lock.acquire()
+		try:
+			if key in self._results:
+				result = self._results.pop(key)
+				self._results[key] = result
+				return result.getCacheCopy()
+			if profile.getPreference('slice_cache_disk') != 'True':
+				return None
+			result = self._loadFromDisk(key)
+			if result is not None:
+				self._addToMemory(key, result)
+			return result
+		finally:
+			self._lock.release()
+
+	def add(self, key, result):
+		self._lock.acquire()
+		try:
+			self._addToMemory(key, result)
+			if profile.getPreference('slice_cache_disk') == 'True':
+				self._saveToDisk(key, result)
+		finally:
+			self._lock.release()
+
+	def _addToMemory(self, key, result):
+		if key in self._results:
+			self._memorySize -= self._results.pop(key).getMemorySize()
+		result = result.getCacheCopy()
+		self._results[key] = result
+		self._memorySize += result.getMemorySize()
+		maxSize = profile.getPreferenceFloat('slice_cache_memory_size') * 1024 * 1024
+		while self._memorySize > maxSize and len(self._results) > 0:
+			self._memorySize -= self._results.popitem(False)[1].getMemorySize()
+
+	def _loadFromDisk(self, key):
+		path = os.path.join(self.getCachePath(), key)
+		if not os.path.isdir(path):
+			return None
+		try:
+			with open(os.path.join(path, 'result.pickle'), 'rb') as f:
+				info = pickle.load(f)
+			result = EngineResult()
+			result._gcodeData = DiskDataStorage.fromFile(os.path.join(path, 'result.gcode'))
+			for k, v in info.items():
+				setattr(result, k, v)
+			result._finished = True
+			os.utime(path, None)
+		except:
+			traceback.print_exc()
+			return None
+		return result
+
+	def _saveToDisk(self, key, result):
+		cachePath = self.getCachePath()
+		path = os.path.join(cachePath, key)
+		if os.path.isdir(path):
+			os.utime(path, None)
+			return
+		tmpPath = path + '.tmp%d' % (os.getpid())
+		info = {}
+		for k in ['_engineLog', '_polygons', '_replaceInfo', '_printTimeSeconds', '_filamentMM', '_modelHash', '_geometryKey', '_headerFooterCode']:
+			info[k] = getattr(result, k)
+		try:
+			if not os.path.isdir(tmpPath):
+				os.makedirs(tmpPath)
+			result._gcodeData.saveToFile(os.path.join(tmpPath, 'result.gcode'))
+			with open(os.path.join(tmpPath, 'result.pickle'), 'wb') as f:
+				pickle.dump(info, f, pickle.HIGHEST_PROTOCOL)
+			os.rename(tmpPath, path)
+		except:
+			traceback.print_exc()
+			shutil.rmtree(tmpPath, True)
+			return
+		self._removeOldEntries(cachePath)
+
+	def _removeOldEntries(self, cachePath):
+		maxSize = profile.getPreferenceFloat('slice_cache_disk_size') * 1024 * 1024
+		entries = []
+		totalSize = 0
+		for name in os.listdir(cachePath):
+			path = os.path.join(cachePath, name)
+			if not os.path.isdir(path) or '.tmp' in name:
+				continue
+			size = 0
+			for filename in os.listdir(path):
+				size += os.stat(os.path.join(path, filename)).st_size
+			entries.append((os.stat(path).st_mtime, size, path))
+			totalSize += size
+		entries.sort()
+		for mtime, size, path in entries:
+			if totalSize <= maxSize:
+				break
+			shutil.rmtree(path, True)
+			totalSize -= size
+
 class Engine(object):
 	"""
 	Class used to communicate with the CuraEngine.
@@ -177,6 +543,9 @@ class Engine(object):
 	GUI_CMD_SEND_POLYGONS = 0x02
 	GUI_CMD_FINISH_OBJECT = 0x03
 
+	#Engine settings that only end up in the start and end of the GCode. When only these change, the previous result is updated instead of running the engine again.
+	headerFooterSettings = ['startCode', 'endCode']
+
 	def __init__(self, progressCallback):
 		self._process = None
 		self._thread = None
@@ -184,6 +553,7 @@ class Engine(object):
 		self._progressSteps = ['inset', 'skin', 'export']
 		self._objCount = 0
 		self._result = None
+		self._resultCache = SliceResultCache()
 
 		self._engine_executable = getEngineFilename()
 		self._serversocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -217,47 +587,37 @@ class Engine(object):
 
 	def _socketConnectionThread(self, sock):
 		layerNrOffset = 0
+		reader = _SocketReader(sock)
 		while True:
 			try:
-				data = sock.recv(4)
-			except:
-				data = ''
-			if len(data) == 0:
+				cmd = reader.readInt()
+			except (EOFError, socket.error):
 				sock.close()
 				return
-			cmd = struct.unpack('@i', data)[0]
 			if cmd == self.GUI_CMD_REQUEST_MESH:
 				meshInfo = self._modelData[0]
 				self._modelData = self._modelData[1:]
 				sock.sendall(struct.pack('@i', meshInfo[0]))
 				sock.sendall(meshInfo[1].tostring())
 			elif cmd == self.GUI_CMD_SEND_POLYGONS:
-				cnt = struct.unpack('@i', sock.recv(4))[0]
-				layerNr = struct.unpack('@i', sock.recv(4))[0]
+				try:
+					cnt, layerNr, z, typeNameLen = reader.readInts(4)
+					typeName = reader.read(typeNameLen)
+					data, lengths = reader.readPolygons(cnt)
+				except (EOFError, socket.error):
+					sock.close()
+					return
 				layerNr += layerNrOffset
-				z = struct.unpack('@i', sock.recv(4))[0]
 				z = float(z) / 1000.0
-				typeNameLen = struct.unpack('@i', sock.recv(4))[0]
-				typeName = sock.recv(typeNameLen)
+				#All polygons of the message are decoded into one contiguous array.
+				points = numpy.frombuffer(data, numpy.int64).reshape((-1, 2))
+				polygonPoints = numpy.empty((len(points), 3), numpy.float32)
+				polygonPoints[:,:-1] = points
+				polygonPoints[:,:-1] /= 1000.0
+				polygonPoints[:,2] = z
 				while len(self._result._polygons) < layerNr + 1:
-					self._result._polygons.append({})
-				polygons = self._result._polygons[layerNr]
-				if typeName not in polygons:
-					polygons[typeName] = []
-				for n in xrange(0, cnt):
-					length = struct.unpack('@i', sock.recv(4))[0]
-					data = ''
-					while len(data) < length * 8 * 2:
-						recvData = sock.recv(length * 8 * 2 - len(data))
-						if len(recvData) < 1:
-							return
-						data += recvData
-					polygon2d = numpy.array(numpy.fromstring(data, numpy.int64), numpy.float32) / 1000.0
-					polygon2d = polygon2d.reshape((len(polygon2d) / 2, 2))
-					polygon = numpy.empty((len(polygon2d), 3), numpy.float32)
-					polygon[:,:-1] = polygon2d
-					polygon[:,2] = z
-					polygons[typeName].append(polygon)
+					self._result._polygons.append(PolygonLayer())
+				self._result._polygons[layerNr].add(typeName, polygonPoints, lengths)
 			elif cmd == self.GUI_CMD_FINISH_OBJECT:
 				layerNrOffset = len(self._result._polygons)
 			else:
@@ -307,14 +667,19 @@ class Engine(object):
 			for k, v in overrides.items():
 				profile.setTempOverride(k, v)
 		commandList = [self._engine_executable, '-v', '-p']
-		for k, v in self._engineSettings(extruderCount).iteritems():
+		headerFooterCode = {}
+		for k, v in sorted(self._engineSettings(extruderCount).items()):
 			commandList += ['-s', '%s=%s' % (k, str(v))]
+			if k in self.headerFooterSettings:
+				headerFooterCode[k] = str(v)
 		commandList += ['-g', '%d' % (self._serverPortNr)]
 		if overrides is not None:
 			profile.resetTempOverride()
 		self._objCount = 0
 		engineModelData = []
 		hash = hashlib.sha512()
+		#The model hash is of the meshes as loaded, the geometry hash of the meshes the engine gets, with their scale, rotation and position.
+		geometryHash = hashlib.sha1()
 		order = scene.printOrder()
 		if order is None:
 			pos = numpy.array(profile.getMachineCenterCoords()) * 1000
@@ -355,6 +720,7 @@ class Engine(object):
 							vertexes += numpy.array([obj.getPosition()[0], obj.getPosition()[1], 0.0])
 							verts = numpy.concatenate((verts, vertexes))
 							hash.update(obj._meshList[n].vertexes.tostring())
+							geometryHash.update(vertexes.tostring())
 				engineModelData.append((vertexTotal[n], verts))
 
 			commandList += ['$' * meshMax]
@@ -365,6 +731,8 @@ class Engine(object):
 				for mesh in obj._meshList:
 					engineModelData.append((mesh.vertexCount, mesh.vertexes))
 					hash.update(mesh.vertexes.tostring())
+					#The matrix and position of the object are in the command line.
+					geometryHash.update(mesh.vertexes.tostring())
 				pos = obj.getPosition() * 1000
 				pos += numpy.array(profile.getMachineCenterCoords()) * 1000
 				commandList += ['-m', ','.join(map(str, obj._matrix.getA().flatten()))]
@@ -377,6 +745,25 @@ class Engine(object):
 		if self._thread != threading.currentThread():
 			return
 
+		#The key of the toolpath: the geometry hash, the engine command line without the start and end code and the socket port, and the post-processing plugins.
+		geometryKey = [geometryHash.hexdigest()] + filter(lambda arg: arg.split('=')[0] not in self.headerFooterSettings, commandList[1:])
+		del geometryKey[geometryKey.index('-g'):geometryKey.index('-g') + 2]
+		geometryKey.append(profile.getProfileSetting('plugin_config'))
+		geometryKey = hashlib.sha1('\0'.join(geometryKey)).hexdigest()
+		result = self._resultCache.get(geometryKey)
+		if result is not None:
+			if result._headerFooterCode != headerFooterCode and len(pluginInfo.getPostProcessPluginConfig()) > 0:
+				#The plugins already changed the GCode of the cached result, so the start and end code cannot be replaced.
+				result = None
+			else:
+				#Only the start or end code can be different, so the toolpath of the cached result can be used.
+				result = result.updateHeaderFooter(headerFooterCode)
+			if result is not None:
+				self._resultCache.add(geometryKey, result)
+				self._result = result
+				self._callback(1.0)
+				return
+
 		self._modelData = engineModelData
 		try:
 			self._process = self._runEngineProcess(commandList)
@@ -387,6 +774,8 @@ class Engine(object):
 		self._result = EngineResult()
 		self._result.addLog('Running: %s' % (' '.join(commandList)))
 		self._result.setHash(modelHash)
+		self._result._geometryKey = geometryKey
+		self._result._headerFooterCode = headerFooterCode
 		self._callback(0.0)
 
 		logThread = threading.Thread(target=self._watchStderr, args=(self._process.stderr,))
@@ -394,12 +783,7 @@ class Engine(object):
 		logThread.start()
 
 		try:
-			data = self._process.stdout.read(4096)
-			while len(data) > 0:
-				if self._thread != threading.currentThread():
-					self._process.terminate()
-				self._result._gcodeData.write(data)
-				data = self._process.stdout.read(4096)
+			self._result._gcodeData.writeFromStream(self._process.stdout, self._checkAbortEngine)
 
 			returnCode = self._process.wait()
 			logThread.join()
@@ -409,6 +793,7 @@ class Engine(object):
 					print plugin_error
 					self._result.addLog(plugin_error)
 				self._result.setFinished(True)
+				self._resultCache.add(geometryKey, self._result)
 				self._callback(1.0)
 			else:
 				for line in self._result.getLog():
@@ -419,6 +804,10 @@ class Engine(object):
 			self._result.addLog("MemoryError")
 			self._callback(-1.0)
 
+	def _checkAbortEngine(self):
+		if self._thread != threading.currentThread():
+			self._process.terminate()
+
 	def _watchStderr(self, stderr):
 		objectNr = 0
 		line = stderr.readline()